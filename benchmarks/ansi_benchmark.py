@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Times nbconflux's ansi2html against nbconvert's on large log outputs.
+
+Usage: python benchmarks/ansi_benchmark.py [--megabytes 100] [--colored-megabytes 2]
+
+Plain logs have no escape codes. Colored logs have a color code every line,
+which nbconvert converts in time quadratic in the output size, so they are
+kept smaller by default.
+"""
+import argparse
+import time
+
+from nbconflux.ansi import ansi2html as fast_ansi2html
+from nbconvert.filters.ansi import ansi2html
+
+
+def make_log(megabytes, colored):
+    """Makes log text of about the given size."""
+    if colored:
+        line = '2018-01-31 12:00:00 \x1b[1;32mINFO\x1b[0m step <{}> loss=0.{} & done\n'
+    else:
+        line = '2018-01-31 12:00:00 INFO step <{}> loss=0.{} & done\n'
+    lines = []
+    size = 0
+    i = 0
+    while size < megabytes * 2 ** 20:
+        lines.append(line.format(i, i % 997))
+        size += len(lines[-1])
+        i += 1
+    return ''.join(lines)
+
+
+def timed(func, text):
+    """Gets the result of a call and its duration in seconds."""
+    start = time.perf_counter()
+    html = func(text)
+    return html, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--megabytes', type=float, default=100, help='Size of the plain log')
+    parser.add_argument('--colored-megabytes', type=float, default=2,
+                        help='Size of the colored log')
+    args = parser.parse_args()
+
+    for name, megabytes, colored in (('plain', args.megabytes, False),
+                                     ('colored', args.colored_megabytes, True)):
+        text = make_log(megabytes, colored)
+        expected, nbconvert_seconds = timed(ansi2html, text)
+        html, fast_seconds = timed(fast_ansi2html, text)
+        assert html == expected, 'output differs from nbconvert'
+        print('{:8} {:7.1f} MB  nbconvert {:8.3f}s  nbconflux {:8.3f}s  {:6.1f}x'.format(
+            name, len(text) / 2 ** 20, nbconvert_seconds, fast_seconds,
+            nbconvert_seconds / fast_seconds))
+
+
+if __name__ == '__main__':
+    main()
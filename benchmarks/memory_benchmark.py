@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+"""Measures how the memory of publishing a notebook grows with its size.
+
+Usage: python benchmarks/memory_benchmark.py [--scales 1 2 4 8] [--vary all]
+       [--images 20] [--image-kb 200] [--text-kb 200] [--cells 100] [--json PATH]
+
+Generates synthetic notebooks at every scale and publishes each with
+from_filename in a fresh process against an offline stand-in for Confluence,
+so that nothing but the publish shows in its peak RSS. Reports the peak RSS
+of the whole publish and of each phase, then publishes again under
+tracemalloc for the peak traced memory and top allocators of each phase,
+which tracemalloc slows down and inflates the RSS of.
+
+The scaling exponent between consecutive scales is the log-log slope of the
+peak RSS above the interpreter baseline against the notebook size. About 1
+is linear growth; well above 1 is super-linear. --max-exponent fails the run
+when any step grows faster, to catch regressions in CI.
+"""
+import argparse
+import base64
+import contextlib
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# Seconds between RSS samples
+SAMPLE_INTERVAL = 0.002
+
+# Offline page the benchmark publishes to
+PAGE_URL = 'http://confluence.localhost/pages/viewpage.action?pageId=1'
+
+# Notebook dimensions each --vary choice multiplies by the scale, where all
+# keeps the image size so that notebook bytes grow linearly with the scale
+DIMENSIONS = {
+    'all': ('images', 'text_kb', 'cells'),
+    'images': ('images',),
+    'image-kb': ('image_kb',),
+    'text': ('text_kb',),
+    'cells': ('cells',),
+}
+
+
+def make_notebook(images, image_kb, text_kb, cells, seed=0):
+    """Makes a notebook with the given number of images of random bytes, text
+    spread over stream outputs and markdown, and code cells.
+    """
+    from nbformat import v4
+
+    rng = random.Random(seed)
+    nb = v4.new_notebook()
+    line = 'step {} loss=0.{} <done> & "ok"\n'
+    text_per_cell = text_kb * 1024 // max(cells, 1)
+    for i in range(cells):
+        if i % 10 == 0:
+            nb.cells.append(v4.new_markdown_cell(
+                '## Section {}\n\nSome *notes* about step {}.'.format(i // 10, i)))
+        text = ''.join(line.format(j, rng.randrange(1000))
+                       for j in range(text_per_cell // len(line) + 1))
+        nb.cells.append(v4.new_code_cell('train({})'.format(i), outputs=[
+            v4.new_output('stream', name='stdout', text=text[:text_per_cell])]))
+    # Spread the images over the code cells
+    code_cells = [cell for cell in nb.cells if cell.cell_type == 'code']
+    if not code_cells:
+        code_cells.append(v4.new_code_cell('plot()'))
+        nb.cells.extend(code_cells)
+    for i in range(images):
+        data = base64.b64encode(
+            rng.getrandbits(image_kb * 8192).to_bytes(image_kb * 1024, 'little'))
+        code_cells[i % len(code_cells)].outputs.append(
+            v4.new_output('display_data', data={'image/png': data.decode('ascii')}))
+    return nb
+
+
+def rss_bytes():
+    """Gets the resident set size of this process, or None where /proc is
+    unavailable.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss_bytes():
+    """Gets the peak resident set size of this process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RSSSampler(threading.Thread):
+    """Samples the resident set size of this process until stopped."""
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.samples.append((time.perf_counter(), rss_bytes()))
+            time.sleep(SAMPLE_INTERVAL)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.samples.append((time.perf_counter(), rss_bytes()))
+
+    def peak(self, start, end):
+        """Gets the peak RSS sampled between two time.perf_counter() values."""
+        return max((rss for t, rss in self.samples if start <= t <= end and rss is not None),
+                   default=None)
+
+
+class OfflineSession:
+    """Stands in for the HTTP transport with a Confluence server that has an
+    empty page and accepts every change, preparing every request body like
+    requests does and then dropping it.
+    """
+    def request(self, method, url, **kwargs):
+        import requests
+
+        fields = ('headers', 'files', 'data', 'json', 'params', 'auth')
+        prepared = requests.Request(method, url, **{key: value for key, value in kwargs.items()
+                                                    if key in fields}).prepare()
+        if prepared.body is not None and not isinstance(prepared.body, (bytes, str)):
+            # Encode streamed bodies as they would be sent
+            for _ in prepared.body:
+                pass
+
+        path = url.split('?')[0]
+        if method == 'GET' and path.endswith('/child/attachment'):
+            content = {'results': [], '_links': {}}
+        elif method == 'GET':
+            content = {'id': '1', 'title': 'Benchmark', 'version': {'number': 1},
+                       'space': {'key': 'BENCH'}}
+        else:
+            content = {'results': []}
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = json.dumps(content).encode('utf-8')
+        resp.headers['Content-Type'] = 'application/json'
+        resp.request = prepared
+        resp.url = url
+        return resp
+
+    def close(self):
+        pass
+
+
+class PhaseTracer:
+    """Records the peak traced memory and the top allocators of each phase
+    of a publish, from tracemalloc snapshots at its start and end.
+
+    Parameters
+    ----------
+    exporter: nbconflux.exporter.ConfluenceExporter
+        Exporter whose report phases and render phase to trace
+    top: int
+        Allocators to keep per phase
+    """
+    # Allocations of the tracing itself
+    FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+               tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'))
+
+    def __init__(self, exporter, top):
+        self.top = top
+        self.phases = {}
+        self.stack = []
+
+        phase = exporter.report.phase
+        preprocess = exporter._preprocess
+        end_render = exporter._end_render
+
+        @contextlib.contextmanager
+        def traced_phase(name):
+            with phase(name):
+                self.begin(name)
+                try:
+                    yield
+                finally:
+                    self.end(name)
+
+        def traced_preprocess(nb, resources):
+            result = preprocess(nb, resources)
+            self.begin('render')
+            return result
+
+        def traced_end_render():
+            rendering = exporter._render_start is not None
+            end_render()
+            if rendering:
+                self.end('render')
+
+        exporter.report.phase = traced_phase
+        exporter._preprocess = traced_preprocess
+        exporter._end_render = traced_end_render
+
+    def begin(self, name):
+        # Phases in worker threads would tangle the stack of nested phases
+        if threading.current_thread() is not threading.main_thread():
+            return
+        if self.stack:
+            self.stack[-1]['peak'] = max(self.stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot().filter_traces(self.FILTERS)
+        self.stack.append({'name': name, 'peak': 0, 'before': before})
+
+    def end(self, name):
+        if threading.current_thread() is not threading.main_thread():
+            return
+        frame = self.stack.pop()
+        peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+        if self.stack:
+            self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+        stats = tracemalloc.take_snapshot().filter_traces(self.FILTERS).compare_to(frame['before'],
+                                                                                   'lineno')
+        phase = self.phases.setdefault(name, {'peak_traced_bytes': 0, 'top_allocators': []})
+        phase['peak_traced_bytes'] = max(phase['peak_traced_bytes'], peak)
+        phase['top_allocators'] = [{'location': '{}:{}'.format(stat.traceback[0].filename,
+                                                               stat.traceback[0].lineno),
+                                    'size_diff': stat.size_diff, 'count_diff': stat.count_diff}
+                                   for stat in stats[:self.top] if stat.size_diff > 0]
+
+
+def run_worker(path, trace, top):
+    """Publishes a notebook offline and gets its memory use."""
+    from nbconflux.api import create_exporter
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        exporter = create_exporter(PAGE_URL, 'benchmark', 'benchmark', cache_dir=cache_dir)
+        exporter.session = OfflineSession()
+        report = exporter.report
+        tracer = PhaseTracer(exporter, top) if trace else None
+        if trace:
+            tracemalloc.start()
+        baseline = rss_bytes()
+        sampler = RSSSampler()
+        sampler.start()
+        start = time.perf_counter()
+        exporter.from_filename(path)
+        seconds = time.perf_counter() - start
+        sampler.stop()
+
+    result = {'seconds': seconds, 'baseline_rss_bytes': baseline, 'peak_rss_bytes': max_rss_bytes()}
+    phases = {}
+    for name, offset, duration, _ in report.spans:
+        begin = report.origin + offset
+        peak = sampler.peak(begin, begin + duration + SAMPLE_INTERVAL)
+        phase = phases.setdefault(name, {'seconds': 0.0, 'peak_rss_bytes': None})
+        phase['seconds'] += duration
+        if peak is not None:
+            phase['peak_rss_bytes'] = max(peak, phase['peak_rss_bytes'] or 0)
+    if trace:
+        tracemalloc.stop()
+        for name, traced_phase in tracer.phases.items():
+            phases.setdefault(name, {}).update(traced_phase)
+    result['phases'] = phases
+    return result
+
+
+def measure(path, trace, top):
+    """Runs the worker for a notebook in a fresh process."""
+    command = [sys.executable, os.path.abspath(__file__), '--worker', path, '--top', str(top)]
+    if trace:
+        command.append('--trace')
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+def exponent(previous, point):
+    """Gets the log-log slope of peak RSS above the baseline against notebook
+    size between two scales.
+    """
+    grown = [p['peak_rss_bytes'] - (p['baseline_rss_bytes'] or 0) for p in (previous, point)]
+    if min(grown) <= 0 or point['notebook_bytes'] == previous['notebook_bytes']:
+        return None
+    return (math.log(grown[1] / grown[0]) /
+            math.log(point['notebook_bytes'] / previous['notebook_bytes']))
+
+
+def mb(size):
+    return '{:8.1f}'.format(size / 2 ** 20) if size is not None else '       -'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 2, 4, 8],
+                        help='Multiples of the base notebook to measure')
+    parser.add_argument('--vary', choices=['all', 'images', 'image-kb', 'text', 'cells'],
+                        default='all', help='Notebook dimension the scales multiply')
+    parser.add_argument('--images', type=int, default=20, help='Images in the base notebook')
+    parser.add_argument('--image-kb', type=int, default=200, help='Kilobytes per image')
+    parser.add_argument('--text-kb', type=int, default=200, help='Kilobytes of stream output text')
+    parser.add_argument('--cells', type=int, default=100, help='Code cells in the base notebook')
+    parser.add_argument('--top', type=int, default=5, help='Top allocators to report per phase')
+    parser.add_argument('--no-trace', action='store_true', help='Skip the tracemalloc runs')
+    parser.add_argument('--json', metavar='PATH', help='Write the scaling curve as JSON')
+    parser.add_argument('--max-exponent', type=float,
+                        help='Exit with an error if memory grows faster than this between any '
+                        'two scales')
+    parser.add_argument('--worker', metavar='NOTEBOOK', help=argparse.SUPPRESS)
+    parser.add_argument('--trace', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.trace, args.top)))
+        return
+
+    import nbformat
+
+    curve = []
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scales:
+            size = {'images': args.images, 'image_kb': args.image_kb, 'text_kb': args.text_kb,
+                    'cells': args.cells}
+            for key in DIMENSIONS[args.vary]:
+                size[key] = max(1, int(round(size[key] * scale)))
+            path = os.path.join(directory, 'scale-{}.ipynb'.format(scale))
+            nbformat.write(make_notebook(**size), path)
+
+            point = dict(size, scale=scale, notebook_bytes=os.path.getsize(path))
+            point.update(measure(path, trace=False, top=args.top))
+            if not args.no_trace:
+                traced = measure(path, trace=True, top=args.top)
+                for name, phase in traced['phases'].items():
+                    point['phases'].setdefault(name, {}).update(
+                        {key: value for key, value in phase.items()
+                         if key in ('peak_traced_bytes', 'top_allocators')})
+            point['exponent'] = exponent(curve[-1], point) if curve else None
+            curve.append(point)
+            os.remove(path)
+
+            growth = '    -' if point['exponent'] is None else '{:5.2f}'.format(point['exponent'])
+            print('scale {:5g}  notebook {} MB  peak RSS {} MB  baseline {} MB  {:6.2f}s  '
+                  'exponent {}'.format(scale, mb(point['notebook_bytes']),
+                                       mb(point['peak_rss_bytes']),
+                                       mb(point['baseline_rss_bytes']), point['seconds'], growth))
+            phases = sorted(point['phases'].items(),
+                            key=lambda item: -(item[1].get('peak_rss_bytes') or 0))
+            for name, phase in phases:
+                print('    {:20} peak RSS {} MB  traced {} MB'.format(
+                    name, mb(phase.get('peak_rss_bytes')), mb(phase.get('peak_traced_bytes'))))
+                for stat in phase.get('top_allocators', []):
+                    print('        {:>10,} B  {}'.format(stat['size_diff'], stat['location']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(curve, f, indent=2)
+
+    exponents = [point['exponent'] for point in curve if point['exponent'] is not None]
+    if args.max_exponent is not None and exponents and max(exponents) > args.max_exponent:
+        sys.exit('Memory grew with exponent {:.2f}, above {:.2f}'.format(max(exponents),
+                                                                         args.max_exponent))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Conversion of ANSI escape codes in stream and text outputs to HTML that
+renders exactly like nbconvert's ansi2html filter in a single pass.
+"""
+import functools
+
+from markupsafe import escape
+from nbconvert.filters.ansi import _ANSI_RE, _get_extended_color, _htmlconverter
+
+# Foreground, background, bold, underline, and inverse of unstyled text
+PLAIN_STYLE = (None, None, False, False, False)
+
+
+@functools.lru_cache(maxsize=1024)
+def next_style(style, params):
+    """Gets the style of the text that follows an SGR escape code.
+
+    Parameters
+    ----------
+    style: tuple
+        Foreground, background, bold, underline, and inverse of the text
+        before the code
+    params: str
+        Semicolon separated parameters of the code
+
+    Returns
+    -------
+    tuple
+    """
+    try:
+        # Empty code is same as code 0
+        numbers = [int(n) if n else 0 for n in params.split(';')]
+    except ValueError:
+        # Invalid color specification
+        return style
+
+    fg, bg, bold, underline, inverse = style
+    while numbers:
+        n = numbers.pop(0)
+        if n == 0:
+            fg = bg = None
+            bold = underline = inverse = False
+        elif n in (1, 5):
+            # Code 5 is blinking, which shows as bold
+            bold = True
+        elif n == 4:
+            underline = True
+        elif n == 7:
+            inverse = True
+        elif n in (21, 22):
+            bold = False
+        elif n == 24:
+            underline = False
+        elif n == 27:
+            inverse = False
+        elif 30 <= n <= 37:
+            fg = n - 30
+        elif n == 38:
+            try:
+                fg = _get_extended_color(numbers)
+            except ValueError:
+                numbers.clear()
+        elif n == 39:
+            fg = None
+        elif 40 <= n <= 47:
+            bg = n - 40
+        elif n == 48:
+            try:
+                bg = _get_extended_color(numbers)
+            except ValueError:
+                numbers.clear()
+        elif n == 49:
+            bg = None
+        elif 90 <= n <= 97:
+            fg = n - 90 + 8
+        elif 100 <= n <= 107:
+            bg = n - 100 + 8
+    return fg, bg, bold, underline, inverse
+
+
+@functools.lru_cache(maxsize=1024)
+def style_tags(style):
+    """Gets the HTML start and end tags that wrap text in a style.
+
+    Returns
+    -------
+    tuple
+        Start and end tag strings, empty for unstyled text
+    """
+    fg, bg, bold, underline, inverse = style
+    # Bold standard colors show as their intense variants
+    return _htmlconverter(fg + 8 if bold and fg in range(8) else fg, bg, bold, underline, inverse)
+
+
+def ansi2html(text):
+    """Converts ANSI colors to HTML colors like nbconvert's ansi2html.
+
+    Text without escape codes is only HTML escaped. Other text is converted
+    in one scan, looking up the style changes of repeated codes and the tags
+    of repeated styles instead of working them out again.
+
+    Parameters
+    ----------
+    text: str
+        Text containing ANSI colors to convert to HTML
+
+    Returns
+    -------
+    str
+    """
+    text = str(escape(text))
+    if '\x1b' not in text:
+        return text
+
+    out = []
+    style = PLAIN_STYLE
+    start = 0
+    for match in _ANSI_RE.finditer(text):
+        if match.start() > start:
+            starttag, endtag = style_tags(style)
+            out.extend((starttag, text[start:match.start()], endtag))
+        start = match.end()
+        # Non-color escape sequences are dropped
+        if match.group(2) == 'm':
+            style = next_style(style, match.group(1))
+    if start < len(text):
+        starttag, endtag = style_tags(style)
+        out.extend((starttag, text[start:], endtag))
+    return ''.join(out)
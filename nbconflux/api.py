@@ -1,13 +1,50 @@
 import getpass
 
-from .exporter import ConfluenceExporter
-from traitlets.config import Config
+
+def create_exporter(confluence_url, username=None, password=None, **options):
+    """Creates an exporter that publishes to the given Confluence URL.
+
+    Parameters
+    ----------
+    confluence_url: str
+        Page URL to update with notebook content. The page must already exist.
+    username: str, optional
+        Confluence username. Uses the current username if not specified.
+    password: str, optional
+        Confluence password. Prompts for the password if not given.
+    options: dict
+        ConfluenceExporter configuration option values by name
+
+    Returns
+    -------
+    nbconflux.exporter.ConfluenceExporter
+    """
+    # Import the exporter stack on first use so that importing the package and
+    # running the command line interface stay fast
+    from .exporter import ConfluenceExporter
+    from traitlets.config import Config
+
+    if username is None:
+        username = getpass.getuser()
+    if password is None:
+        password = getpass.getpass('Confluence password for {}:'.format(username))
+
+    c = Config()
+    c.ConfluenceExporter.url = confluence_url
+    c.ConfluenceExporter.username = username
+    c.ConfluenceExporter.password = password
+    for name, value in options.items():
+        setattr(c.ConfluenceExporter, name, value)
+    return ConfluenceExporter(c)
 
 
 def notebook_to_page(notebook_file, confluence_url, username=None, password=None,
                      generate_toc=True, attach_ipynb=True, enable_style=True, enable_mathjax=False,
-                     extra_labels=None):
-    """Transforms the given notebook file into Confluence storage format and
+                     extra_labels=None, content_addressed_attachments=False, render_processes=1,
+                     profile_render=False, request_budget=0, resume=False, prune_attachments=False,
+                     transport='requests', split_threshold=0, notebook_name=None,
+                     skip_unchanged=False, rate_limit=0.0, max_concurrency=8):
+    """Transforms the given notebook into Confluence storage format and
     updates the given Confluence URL with its content.
 
     Attaches images to the page and links to pinned versions to preserve
@@ -16,8 +53,9 @@ def notebook_to_page(notebook_file, confluence_url, username=None, password=None
 
     Parameters
     ----------
-    notebook_file: str
-        Relative or absolute path to the notebook to transform and post
+    notebook_file: str, bytes, or nbformat.notebooknode.NotebookNode
+        Relative or absolute path to the notebook to transform and post, the
+        notebook in the ipynb format, or the notebook itself
     confluence_url: str
         Page URL to update with the notebook content. The page must
         already exist.
@@ -35,25 +73,194 @@ def notebook_to_page(notebook_file, confluence_url, username=None, password=None
         Include the MathJax script and configuration (default: False)
     extra_labels: list, optional
         Additional labels to add to the page (default: None)
+    content_addressed_attachments: bool, optional
+        Name output attachments after a digest of their content so that
+        unchanged outputs are not uploaded again (default: False)
+    render_processes: int, optional
+        Number of worker processes rendering cells in parallel (default: 1)
+    profile_render: bool, optional
+        Capture a cProfile profile of the render phase in the publish report
+        (default: False)
+    request_budget: int, optional
+        Maximum number of Confluence API requests the publish may make, or 0
+        for no limit (default: 0)
+    resume: bool, optional
+        Skip the operations that an interrupted publish to the same page
+        completed (default: False)
+    prune_attachments: bool, optional
+        Delete output attachments that no page version from the last 30 days
+        references after publishing (default: False)
+    transport: str, optional
+        HTTP client library carrying the requests: requests, or httpx to
+        multiplex them over HTTP/2 (default: requests)
+    split_threshold: int, optional
+        Page body size in bytes above which the notebook sections publish as
+        child pages of the page, or 0 to never split (default: 0)
+    notebook_name: str, optional
+        Filename to attach a notebook given as bytes or a NotebookNode as,
+        required unless attach_ipynb is False (default: None)
+    skip_unchanged: bool, optional
+        Skip the publish when the same notebook was last published to the
+        page with the same options and nobody changed the page since
+        (default: False)
+    rate_limit: float, optional
+        Requests per second to the Confluence server, shared with other
+        publishes on the machine, or 0 to follow the rate limits the server
+        advertises (default: 0)
+    max_concurrency: int, optional
+        Most requests in flight to the Confluence server, shared like
+        rate_limit, or 0 for no limit (default: 8)
+
+    Returns
+    -------
+    2-tuple
+        Published Confluence storage format HTML, or None when the publish
+        was skipped, and nbconvert resources, including a
+        nbconflux.report.PublishReport of the phase timings under
+        resources['report'] and nbconflux.metrics.RequestMetrics of the
+        Confluence API traffic under resources['metrics']
     """
-    if username is None:
-        username = getpass.getuser()
-    if password is None:
-        password = getpass.getpass('Confluence password for {}:'.format(username))
     if extra_labels is None:
         extra_labels = []
 
-    c = Config()
-    c.ConfluenceExporter.url = confluence_url
-    c.ConfluenceExporter.username = username
-    c.ConfluenceExporter.password = password
-    c.ConfluenceExporter.generate_toc = generate_toc
-    c.ConfluenceExporter.attach_ipynb = attach_ipynb
-    c.ConfluenceExporter.enable_style = enable_style
-    c.ConfluenceExporter.enable_mathjax = enable_mathjax
-    c.ConfluenceExporter.extra_labels = extra_labels
-
-    exporter = ConfluenceExporter(c)
-    result = exporter.from_filename(notebook_file)
-    print('Updated', confluence_url)
-    return result
\ No newline at end of file
+    exporter = create_exporter(confluence_url, username, password, generate_toc=generate_toc,
+                               attach_ipynb=attach_ipynb, enable_style=enable_style,
+                               enable_mathjax=enable_mathjax, extra_labels=extra_labels,
+                               content_addressed_attachments=content_addressed_attachments,
+                               render_processes=render_processes, profile_render=profile_render,
+                               request_budget=request_budget, resume=resume,
+                               prune_attachments=prune_attachments, transport=transport,
+                               split_threshold=split_threshold, skip_unchanged=skip_unchanged,
+                               rate_limit=rate_limit, max_concurrency=max_concurrency)
+    if isinstance(notebook_file, bytes):
+        result = exporter.from_bytes(notebook_file, notebook_name=notebook_name)
+    elif isinstance(notebook_file, dict):
+        result = exporter.from_notebook_node(notebook_file, notebook_name=notebook_name)
+    else:
+        result = exporter.from_filename(notebook_file)
+    print('Unchanged' if result[1].get('skipped') else 'Updated', confluence_url)
+    return result
+
+
+def watch_notebook(notebook_file, confluence_url, username=None, password=None, interval=1.0,
+                   debounce=1.0, on_publish=None, **kwargs):
+    """Publishes a notebook file to Confluence now and again after every
+    settled save until interrupted.
+
+    Keeps a single exporter, its HTTP connections, and the page attachment
+    index warm between publishes, and only uploads outputs whose bytes
+    changed since the previous publish.
+
+    Parameters
+    ----------
+    notebook_file: str
+        Relative or absolute path to the notebook to transform and post
+    confluence_url: str
+        Page URL to update with the notebook content. The page must
+        already exist.
+    username: str, optional
+        Confluence username. Uses the current username if not specified.
+    password: str, optional
+        Confluence password. Prompts for the password if not given.
+    interval: float, optional
+        Seconds between checks for a change (default: 1.0)
+    debounce: float, optional
+        Seconds the file must stay unchanged before republishing (default: 1.0)
+    on_publish: callable, optional
+        Function called with the nbconvert resources of every publish, like
+        the ones notebook_to_page returns (default: None)
+    kwargs: dict
+        Additional notebook_to_page options
+    """
+    from .watch import watch
+
+    if kwargs.get('extra_labels') is None:
+        kwargs['extra_labels'] = []
+    exporter = create_exporter(confluence_url, username, password, reuse_attachment_index=True,
+                               **kwargs)
+
+    def publish():
+        _, resources = exporter.from_filename(notebook_file)
+        print('Updated', confluence_url)
+        if on_publish is not None:
+            on_publish(resources)
+
+    watch(notebook_file, publish, interval=interval, debounce=debounce)
+
+
+def publish_tree(directory, confluence_url, username=None, password=None, max_workers=4, **kwargs):
+    """Publishes a directory of notebooks as a tree of pages under a parent
+    page, creating any missing pages.
+
+    Subdirectories become pages titled after the subdirectory and notebooks
+    become pages titled after the notebook filename. Page titles must be
+    unique within the space.
+
+    Parameters
+    ----------
+    directory: str
+        Relative or absolute path to the directory of notebooks
+    confluence_url: str
+        URL of the parent page. The page must already exist.
+    username: str, optional
+        Confluence username. Uses the current username if not specified.
+    password: str, optional
+        Confluence password. Prompts for the password if not given.
+    max_workers: int, optional
+        Maximum number of pages created or published at the same time
+        (default: 4)
+    kwargs: dict
+        Additional notebook_to_page options
+
+    Returns
+    -------
+    list
+        Summary of each published notebook page
+    """
+    from .tree import TreePublisher
+
+    if kwargs.get('extra_labels') is None:
+        kwargs['extra_labels'] = []
+    publisher = TreePublisher(confluence_url, username, password, max_workers=max_workers, **kwargs)
+    return publisher.publish(directory)
+
+
+def prune_page_attachments(confluence_url, username=None, password=None, retention_days=30,
+                           dry_run=False, max_workers=8, unique_key='output'):
+    """Deletes the output attachments that earlier publishes left on a page
+    and that neither the current page nor any page version within the
+    retention window references.
+
+    Only attachments named like nbconflux cell outputs that were last uploaded
+    before the retention window are deleted. Confluence moves deleted
+    attachments to the space trash.
+
+    Parameters
+    ----------
+    confluence_url: str
+        Page URL to prune
+    username: str, optional
+        Confluence username. Uses the current username if not specified.
+    password: str, optional
+        Confluence password. Prompts for the password if not given.
+    retention_days: int, optional
+        Days of page history whose attachments are kept (default: 30)
+    dry_run: bool, optional
+        Only list the orphaned attachments (default: False)
+    max_workers: int, optional
+        Maximum number of requests made at the same time (default: 8)
+    unique_key: str, optional
+        Prefix of the output attachment filenames (default: output)
+
+    Returns
+    -------
+    list
+        Attachment ID and filename 2-tuples of the orphaned attachments
+    """
+    exporter = create_exporter(confluence_url, username, password,
+                               attachment_retention_days=retention_days,
+                               attachment_lookup_workers=max_workers, unique_key=unique_key)
+    orphans = exporter.prune(dry_run=dry_run)
+    for _, filename in orphans:
+        print('Would delete' if dry_run else 'Deleted', filename)
+    return orphans
@@ -0,0 +1,105 @@
+"""Persistent caches that let short-lived nbconflux processes reuse work done
+by earlier ones.
+"""
+import os
+import tempfile
+
+import jinja2
+import nbconvert
+
+from jinja2.bccache import BytecodeCache
+
+
+def default_cache_dir():
+    """Gets the root directory for nbconflux caches.
+
+    Uses the NBCONFLUX_CACHE_DIR environment variable if set, or an nbconflux
+    folder under the XDG cache home otherwise.
+
+    Returns
+    -------
+    str
+        Absolute path of the cache root, which may not exist yet
+    """
+    path = os.getenv('NBCONFLUX_CACHE_DIR')
+    if not path:
+        root = os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        path = os.path.join(root, 'nbconflux')
+    return os.path.abspath(path)
+
+
+def write_atomic(path, data):
+    """Writes bytes to a file so that concurrent readers never see a partial
+    file. Creates the parent directory if needed.
+
+    Parameters
+    ----------
+    path: str
+        Destination path
+    data: bytes
+        File content
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class TemplateBytecodeCache(BytecodeCache):
+    """Jinja bytecode cache backed by a process-wide map of compiled template
+    code and, optionally, a directory shared by all processes.
+
+    Jinja rejects cached code when the checksum of the template source
+    changes. The directory name includes the nbconvert and Jinja versions so
+    that upgrading either one never reuses stale code.
+
+    Parameters
+    ----------
+    directory: str, optional
+        Root directory for persistent bytecode, or None to only keep compiled
+        code in memory
+    """
+    # Compiled code by bucket key and template source checksum, shared by every
+    # exporter in the process
+    _compiled = {}
+
+    def __init__(self, directory=None):
+        if directory is not None:
+            directory = os.path.join(directory, 'templates',
+                                     'nbconvert-{}-jinja2-{}'.format(nbconvert.__version__,
+                                                                     jinja2.__version__))
+        self.directory = directory
+
+    def _path(self, bucket):
+        return os.path.join(self.directory, bucket.key + '.cache')
+
+    def load_bytecode(self, bucket):
+        code = self._compiled.get((bucket.key, bucket.checksum))
+        if code is not None:
+            bucket.code = code
+            return
+        if self.directory is None:
+            return
+        try:
+            with open(self._path(bucket), 'rb') as f:
+                bucket.load_bytecode(f)
+        except OSError:
+            return
+        if bucket.code is not None:
+            self._compiled[(bucket.key, bucket.checksum)] = bucket.code
+
+    def dump_bytecode(self, bucket):
+        self._compiled[(bucket.key, bucket.checksum)] = bucket.code
+        if self.directory is None:
+            return
+        try:
+            write_atomic(self._path(bucket), bucket.bytecode_to_string())
+        except OSError:
+            # A read-only or full cache directory only costs a recompile next time
+            pass
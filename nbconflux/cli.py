@@ -3,27 +3,18 @@ import getpass
 import os
 import sys
 
-from .api import notebook_to_page
+from .api import notebook_to_page, prune_page_attachments, publish_tree, watch_notebook
 
 
-def main(argv=None):
-    """Command line interface."""
-    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
-        description='Converts Jupyter Notebooks to Atlassian Confluence pages using nbconvert',
-        epilog="Collects credentials from the following locations:\n"
-        "1. CONFLUENCE_USERNAME and CONFLUENCE_PASSWORD environment variables\n"
-        "2. ~/.nbconflux file in the format username:password\n"
-        "3. User prompts")
-    parser.add_argument('notebook', type=str, help='Path to local notebook (ipynb)')
-    parser.add_argument('url', type=str, help='URL of Confluence page to update')
-    parser.add_argument('--exclude-toc', action='store_true', help='Do not generate a table of contents')
-    parser.add_argument('--exclude-ipynb', action='store_true', help='Do not attach the notebook to the page')
-    parser.add_argument('--exclude-style', action='store_true', help='Do not include the Jupyter base stylesheet')
-    parser.add_argument('--include-mathjax', action='store_true', help='Enable MathJax on the page')
-    parser.add_argument('--extra-labels', nargs='+', type=str, help='Additional labels to add to the page')
-
-    args = parser.parse_args(argv or sys.argv[1:])
+def get_credentials():
+    """Collects Confluence credentials from the environment, the ~/.nbconflux
+    file, or user prompts, in that order of preference.
 
+    Returns
+    -------
+    2-tuple of str
+        Confluence username and password
+    """
     username = os.getenv('CONFLUENCE_USERNAME')
     password = os.getenv('CONFLUENCE_PASSWORD')
     cfg = os.path.expanduser('~/.nbconflux')
@@ -51,10 +42,204 @@ def main(argv=None):
     if password is None:
         password = getpass.getpass('Confluence password: ')
 
-    notebook_to_page(args.notebook, args.url, username, password,
-                     generate_toc=not args.exclude_toc, attach_ipynb=not args.exclude_ipynb,
-                     enable_style=not args.exclude_style, enable_mathjax=args.include_mathjax,
-                     extra_labels=args.extra_labels)
+    return username, password
+
+
+def add_page_options(parser):
+    """Adds the arguments that control how notebooks render and publish."""
+    parser.add_argument('--exclude-toc', action='store_true',
+                        help='Do not generate a table of contents')
+    parser.add_argument('--exclude-ipynb', action='store_true',
+                        help='Do not attach the notebook to the page')
+    parser.add_argument('--exclude-style', action='store_true',
+                        help='Do not include the Jupyter base stylesheet')
+    parser.add_argument('--include-mathjax', action='store_true', help='Enable MathJax on the page')
+    parser.add_argument('--extra-labels', nargs='+', type=str,
+                        help='Additional labels to add to the page')
+    parser.add_argument('--content-addressed-attachments', action='store_true',
+                        help='Name output attachments after their content to skip unchanged '
+                        'uploads')
+    parser.add_argument('--render-processes', type=int, default=1,
+                        help='Number of worker processes rendering cells in parallel')
+    parser.add_argument('--resume', action='store_true',
+                        help='Only perform the steps an interrupted publish to the same page did '
+                        'not complete')
+    parser.add_argument('--prune-attachments', action='store_true',
+                        help='Delete output attachments no page version from the last 30 days '
+                        'references')
+    parser.add_argument('--transport', choices=['requests', 'httpx'], default='requests',
+                        help='HTTP client library carrying the requests; httpx multiplexes them '
+                        'over HTTP/2')
+    parser.add_argument('--split-threshold', type=int, default=0, metavar='BYTES',
+                        help='Publish the notebook sections as child pages when the page would '
+                        'exceed this size')
+    parser.add_argument('--skip-unchanged', action='store_true',
+                        help='Skip notebooks unchanged since their last publish to a page nobody '
+                        'edited since')
+    parser.add_argument('--rate-limit', type=float, default=0.0, metavar='REQUESTS_PER_SECOND',
+                        help='Pace requests to the Confluence server across all publishes on this '
+                        'machine')
+    parser.add_argument('--max-concurrency', type=int, default=8,
+                        help='Most requests in flight to the Confluence server across all '
+                        'publishes on this machine')
+
+
+def page_options(args):
+    """Gets the publish options for the arguments added by add_page_options."""
+    return dict(generate_toc=not args.exclude_toc, attach_ipynb=not args.exclude_ipynb,
+                enable_style=not args.exclude_style, enable_mathjax=args.include_mathjax,
+                extra_labels=args.extra_labels,
+                content_addressed_attachments=args.content_addressed_attachments,
+                render_processes=args.render_processes, resume=args.resume,
+                prune_attachments=args.prune_attachments, transport=args.transport,
+                split_threshold=args.split_threshold, skip_unchanged=args.skip_unchanged,
+                rate_limit=args.rate_limit, max_concurrency=args.max_concurrency)
+
+
+def tree_main(argv):
+    """Command line interface of the directory tree publisher."""
+    parser = argparse.ArgumentParser(prog='nbconflux tree',
+                                     description='Publishes a directory of notebooks as a tree of '
+                                     'pages under a parent page, creating missing pages')
+    parser.add_argument('directory', type=str, help='Path to local directory of notebooks')
+    parser.add_argument('url', type=str,
+                        help='URL of the existing Confluence page to publish under')
+    add_page_options(parser)
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Maximum number of pages created or published at once')
+
+    args = parser.parse_args(argv)
+
+    username, password = get_credentials()
+
+    publish_tree(args.directory, args.url, username, password, max_workers=args.workers,
+                 **page_options(args))
+
+
+def gc_main(argv):
+    """Command line interface of the orphaned attachment collector."""
+    parser = argparse.ArgumentParser(prog='nbconflux gc',
+                                     description='Deletes output attachments that no version of a '
+                                     'page within the retention window references anymore')
+    parser.add_argument('url', type=str, help='URL of Confluence page to prune')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only list the attachments to delete')
+    parser.add_argument('--retention-days', type=int, default=30,
+                        help='Keep attachments referenced by page versions from this many days')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Maximum number of requests made at once')
+    parser.add_argument('--unique-key', type=str, default='output',
+                        help='Prefix of the output attachment filenames')
+
+    args = parser.parse_args(argv)
+
+    username, password = get_credentials()
+
+    prune_page_attachments(args.url, username, password, retention_days=args.retention_days,
+                           dry_run=args.dry_run, max_workers=args.workers,
+                           unique_key=args.unique_key)
+
+
+def serve_main(argv):
+    """Command line interface of the publish daemon."""
+    parser = argparse.ArgumentParser(prog='nbconflux serve',
+                                     description='Runs a daemon that publishes notebooks posted to '
+                                     'it as JSON jobs, keeping exporters warm between jobs')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    parser.add_argument('--socket', type=str,
+                        help='Unix domain socket path to listen on instead of a port')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Maximum number of pages published at once')
+    parser.add_argument('--server', dest='servers', action='append', default=[], metavar='URL',
+                        help='Confluence server that jobs without credentials may publish to '
+                        'with the daemon credentials; repeat for several')
+    parser.add_argument('--token-file', type=str,
+                        help='File to write the token that jobs posted to the port must carry to '
+                        '(default: serve-token in the cache directory)')
+
+    args = parser.parse_args(argv)
+
+    username, password = get_credentials()
+
+    from .server import serve
+    serve(username, password, host=args.host, port=args.port, socket_path=args.socket,
+          max_workers=args.workers, servers=args.servers, token_path=args.token_file)
+
+
+def write_reports(args, resources):
+    """Writes the profile, trace, and metrics files requested on the command
+    line for a publish."""
+    if args.metrics:
+        resources['metrics'].write(args.metrics, prometheus=args.metrics_format == 'prometheus')
+    if args.profile or args.trace or args.profile_render:
+        report = resources['report']
+        if args.profile:
+            report.write(args.profile)
+        if args.trace:
+            report.write(args.trace, trace=True)
+        if args.profile_render and report.render_profile is not None:
+            report.render_profile.dump_stats(args.profile_render)
+
+
+def main(argv=None):
+    """Command line interface."""
+    argv = argv or sys.argv[1:]
+    if argv and argv[0] == 'serve':
+        return serve_main(argv[1:])
+    if argv and argv[0] == 'tree':
+        return tree_main(argv[1:])
+    if argv and argv[0] == 'gc':
+        return gc_main(argv[1:])
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description='Converts Jupyter Notebooks to Atlassian Confluence pages using nbconvert',
+        epilog="Collects credentials from the following locations:\n"
+               "1. CONFLUENCE_USERNAME and CONFLUENCE_PASSWORD environment variables\n"
+               "2. ~/.nbconflux file in the format username:password\n"
+               "3. User prompts\n\n"
+               "Run 'nbconflux serve -h' for help on the publish daemon,\n"
+               "'nbconflux tree -h' for help on publishing a directory of notebooks, and\n"
+               "'nbconflux gc -h' for help on deleting orphaned attachments.")
+    parser.add_argument('notebook', type=str, help='Path to local notebook (ipynb)')
+    parser.add_argument('url', type=str, help='URL of Confluence page to update')
+    add_page_options(parser)
+    parser.add_argument('--profile', type=str, metavar='PATH',
+                        help='Write a JSON report of the time spent in each publish phase')
+    parser.add_argument('--trace', type=str, metavar='PATH',
+                        help='Write the publish phases as a Chrome trace JSON file')
+    parser.add_argument('--profile-render', type=str, metavar='PATH',
+                        help='Write cProfile stats of the render phase')
+    parser.add_argument('--metrics', type=str, metavar='PATH',
+                        help='Write Confluence API request metrics for the publish')
+    parser.add_argument('--metrics-format', choices=['json', 'prometheus'], default='json',
+                        help='Format of the --metrics file')
+    parser.add_argument('--request-budget', type=int, default=0,
+                        help='Fail if the publish needs more Confluence API requests than this')
+    parser.add_argument('--watch', action='store_true',
+                        help='Republish the notebook every time it is saved until interrupted')
+    parser.add_argument('--watch-interval', type=float, default=1.0,
+                        help='Seconds between checks for notebook changes in watch mode')
+    parser.add_argument('--debounce', type=float, default=1.0,
+                        help='Seconds a notebook must stay unchanged before republishing in '
+                        'watch mode')
+
+    args = parser.parse_args(argv)
+
+    username, password = get_credentials()
+
+    options = dict(page_options(args), profile_render=bool(args.profile_render),
+                   request_budget=args.request_budget)
+    if args.watch:
+        # Every publish overwrites the reports of the previous one
+        watch_notebook(args.notebook, args.url, username, password, interval=args.watch_interval,
+                       debounce=args.debounce, on_publish=lambda r: write_reports(args, r),
+                       **options)
+        return
+
+    _, resources = notebook_to_page(args.notebook, args.url, username, password, **options)
+    write_reports(args, resources)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
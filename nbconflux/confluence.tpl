@@ -2,7 +2,7 @@
 {% from 'mathjax.tpl' import mathjax %}
 
 {%- block header -%}
-{%- if resources.generate_toc %}
+{%- if resources.generate_toc and not resources.cells_only %}
 <ac:structured-macro ac:macro-id="dca3b6c0-062d-415e-bfcd-67ea8153e627" ac:name="toc" ac:schema-version="1">
     <ac:parameter ac:name="maxLevel">3</ac:parameter>
     <ac:parameter ac:name="indent">15px</ac:parameter>
@@ -10,6 +10,26 @@
 {%- endif %}
 {%- endblock header %}
 
+{#
+  cells rendered ahead of time by worker processes replace the cell loop, and
+  workers render only the cell loop. The page of a split notebook links to the
+  child pages of its sections after its own cells.
+#}
+{%- block body -%}
+{%- if resources.render_cells -%}
+{{ resources.render_cells(nb.cells, resources) }}
+{%- else -%}
+{{ super() }}
+{%- endif -%}
+{%- if resources.child_pages %}
+<ol>
+{%- for child_page in resources.child_pages %}
+<li><ac:link><ri:page ri:content-title="{{ child_page.title | e }}" /></ac:link></li>
+{%- endfor %}
+</ol>
+{%- endif -%}
+{%- endblock body -%}
+
 {% block codecell %}
 <p class="border-box-sizing code_cell rendered">
 {{ super() }}
@@ -196,6 +216,7 @@ unknown type  {{ cell.type }}
 {%- endblock data_widget_view -%}
 
 {%- block footer %}
+{%- if not resources.cells_only %}
 {{ super() }}
 {%- if 'notebook_filename' in resources %}
 <hr />
@@ -231,5 +252,6 @@ unknown type  {{ cell.type }}
     ]]>
 </ac:plain-text-body></ac:structured-macro>
 {%- endif %}
+{%- endif %}
 
 {%- endblock footer-%}
\ No newline at end of file
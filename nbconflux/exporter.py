@@ -1,20 +1,148 @@
 """Confluence page exporter that transforms notebook content into Confluence
 XML storage format and posts it to an existing page.
 """
+import copy
+import cProfile
+import hashlib
 import os
+import time
 import urllib.parse as urlparse
+import warnings
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import nbformat
 import requests
 
+from .ansi import ansi2html
+from .cache import TemplateBytecodeCache, default_cache_dir
 from .filter import sanitize_html
+from .governor import RateGovernor
+from .highlight import CachedHighlight2HTML
+from .journal import PublishJournal, journal_path
+from .ledger import PublishLedger, fingerprint
 from .markdown import ConfluenceMarkdownRenderer
-from .preprocessor import ConfluencePreprocessor
+from .metrics import RequestMetrics, endpoint
+from .pages import create_page, existing_page, find_pages, get_page, page_url
+from .payload import TEXT, JSONTextStream, dumps, text_digest
+from .preprocessor import (Attachment, CoalesceStreamsPreprocessor, ConfluencePreprocessor,
+                           StripUnrenderablePreprocessor)
+from .prune import AttachmentPruner
+from .report import PublishReport
+from .split import part_notebook, part_titles, split_notebook
+from .transport import TRANSPORTS, create_transport
 from nbconvert import HTMLExporter
+from nbconvert.filters.highlight import Highlight2HTML
 from nbconvert.filters.markdown_mistune import MarkdownWithMath
-from traitlets import Bool, List, Unicode
+from traitlets import Bool, Dict, Enum, Float, Integer, List, Unicode, default
 from traitlets.config import Config
 
 
+# Template filters timed in the publish report
+TIMED_FILTERS = ('markdown2html', 'sanitize_html', 'highlight_code', 'ansi2html')
+
+# Jinja markers for filters that take the context, eval context, or environment
+JINJA_FILTER_MARKERS = ('jinja_pass_arg', 'contextfilter', 'evalcontextfilter', 'environmentfilter')
+
+# Response statuses that ask the client to back off and try again
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Longest wait between retries in seconds
+MAX_RETRY_DELAY = 60.0
+
+# Options left out of publish fingerprints because they do not shape the page
+UNFINGERPRINTED_OPTIONS = ('url', 'username', 'password', 'cache_dir', 'resume', 'skip_unchanged')
+
+# Exporter used to render cells in a worker process of the render pool
+_worker_exporter = None
+
+
+def _init_render_worker(config):
+    """Creates the exporter that renders cells in a render pool worker.
+
+    Parameters
+    ----------
+    config: traitlets.config.Config
+        Configuration of the exporter in the parent process
+    """
+    global _worker_exporter
+    config = config.copy()
+    # Workers only render, they never need to talk to the server
+    config.ConfluenceExporter.url = ''
+    config.ConfluenceExporter.render_processes = 1
+    config.ConfluenceExporter.transport = 'requests'
+    _worker_exporter = ConfluenceExporter(config)
+
+
+def _render_cells(cells, resources, lexer):
+    """Renders a contiguous run of preprocessed cells in a render pool worker.
+
+    Parameters
+    ----------
+    cells: list
+        Preprocessed notebook cells
+    resources: dict
+        Additional nbconvert resources used by the template
+    lexer: str
+        Pygments lexer name for the notebook language
+
+    Returns
+    -------
+    str
+        Confluence storage format for the cells alone
+    """
+    exporter = _worker_exporter
+    highlight = exporter.filters.get('highlight_code',
+                                     Highlight2HTML(pygments_lexer=lexer, parent=exporter))
+    exporter.register_filter('highlight_code', highlight)
+    resources['cells_only'] = True
+    return exporter.template.render(nb={'cells': cells}, resources=resources)
+
+
+def batch_uploads(uploads, max_bytes, max_files):
+    """Groups attachment uploads into batches to send one request each.
+
+    Parameters
+    ----------
+    uploads: list
+        Filename and data of each attachment, in upload order
+    max_bytes: int
+        Most bytes of data per batch, or 0 for no limit, except that larger
+        attachments get a batch of their own
+    max_files: int
+        Most attachments per batch
+
+    Yields
+    ------
+    list
+        Filename and data of the attachments in the batch
+    """
+    batch = []
+    size = 0
+    for filename, data in uploads:
+        if batch and (len(batch) >= max_files or max_bytes and size + len(data) > max_bytes):
+            yield batch
+            batch = []
+            size = 0
+        batch.append((filename, data))
+        size += len(data)
+    if batch:
+        yield batch
+
+
+def _body_size(request):
+    """Gets the size of a sent request body in bytes."""
+    body = request.body
+    if isinstance(body, JSONTextStream):
+        return body.size
+    if body is None:
+        # Streamed bodies are only known by their declared length
+        return int(request.headers.get('Content-Length', 0))
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    return len(body)
+
+
 class ConfluenceExporter(HTMLExporter):
     """Converts a notebook into Confluence storage format XHTML and the
     notebook binary output cell assets into page attachments, and updates
@@ -23,14 +151,42 @@ class ConfluenceExporter(HTMLExporter):
     Attributes
     ----------
     server: str
-        Base URL of the confluence server
+        Base URL of the confluence server of the page being published
     page_id: int
-        Page ID to update
+        Page ID being published
     notebook_filename: str
-        Local filename of the notebook to be attached to the page
+        Local filename of the notebook being published, or None when
+        publishing from memory
+    notebook_name: str
+        Attachment filename of the notebook being published
+    notebook_data: str or bytes
+        Serialized notebook being published, attached to the page as is
+    page_targets: dict
+        Confluence server base URL and page ID by page URL, for every page
+        URL this exporter has resolved
+    session: requests.Session or nbconflux.transport.HttpxTransport
+        HTTP transport that pools connections to the Confluence server
+    attachment_index: dict
+        Attachments on each page by page ID and filename, kept up to date
+        between publishes when reuse_attachment_index is enabled
+    attachment_digests: dict
+        Digest and version of each attachment this exporter uploaded, by page
+        ID and filename
+    report: nbconflux.report.PublishReport
+        Timings of the publish in progress, handed off in resources['report']
+        when the publish completes
+    metrics: nbconflux.metrics.RequestMetrics
+        Confluence API traffic of the publish in progress, handed off in
+        resources['metrics'] when the publish completes
+    journal: nbconflux.journal.PublishJournal
+        Operations completed by the publish in progress, or None when
+        cache_dir is empty
+    governors: dict
+        nbconflux.governor.RateGovernor pacing the requests to each host
 
     url: traitlets.Unicode
-        Human-readable Confluence page URL to convert to lookup page_id
+        Human-readable Confluence page URL to convert to lookup page_id, used
+        as the target of publishes that do not name a page of their own
     username: traitlets.Unicode
         Basic auth username
     password: traitlets.Unicode
@@ -43,6 +199,101 @@ class ConfluenceExporter(HTMLExporter):
         Add the Jupyter base stylesheet to the page (default: True)
     enable_mathjax: traitlets.Bool
         Add MathJax to the page to render equations (default: False)
+    extra_labels: traitlets.List
+        Additional labels to add to the page (default: [])
+    content_addressed_attachments: traitlets.Bool
+        Name output attachments after a digest of their content instead of their
+        cell position, and upload each unique output only once (default: False)
+    render_processes: traitlets.Integer
+        Number of worker processes rendering cells in parallel, or 1 to render
+        in the current process (default: 1)
+    reuse_attachment_index: traitlets.Bool
+        Keep the attachments on the page in memory between publishes instead
+        of listing them before every publish (default: False)
+    attachment_lookup: traitlets.Enum
+        How to find the existing attachments the notebook needs: list every
+        attachment on the page, look up each filename, or auto to list pages
+        that fit a single listing request and look up filenames on larger
+        pages (default: auto)
+    attachment_lookup_workers: traitlets.Integer
+        Number of attachment listing pages or filenames fetched at the same
+        time (default: 8)
+    prune_attachments: traitlets.Bool
+        Delete output attachments that no page version within the retention
+        window references after publishing (default: False)
+    attachment_batch_files: traitlets.Integer
+        Most new attachments created by a single multi-file upload request,
+        or 1 to upload each on its own; updates of existing attachments always
+        take a request each (default: 50)
+    attachment_batch_bytes: traitlets.Integer
+        Most bytes of attachment data in a single multi-file upload request,
+        or 0 for no limit (default: 8388608)
+    attachment_retention_days: traitlets.Integer
+        Days of page history whose output attachments pruning keeps
+        (default: 30)
+    unique_key: traitlets.Unicode
+        Prefix of the output attachment filenames, unless the resources of
+        a publish set their own, and of the attachments pruning considers
+        (default: output)
+    strip_unrenderable: traitlets.Bool
+        Remove output MIME types the page never shows and notebook widget
+        state before any other preprocessing (default: True)
+    coalesce_streams: traitlets.Bool
+        Merge consecutive outputs to the same stream and keep only the text
+        that carriage returns and backspaces leave visible (default: True)
+    profile_render: traitlets.Bool
+        Capture a cProfile profile of the render phase in the publish report
+        (default: False)
+    transport: traitlets.Enum
+        HTTP client library carrying the requests: requests for HTTP/1.1, or
+        httpx to multiplex requests over HTTP/2 when the server supports it
+        (default: requests)
+    max_retries: traitlets.Integer
+        Number of times to retry a request that the server asks to back off
+        with a 429, 502, 503, or 504 status (default: 3)
+    retry_backoff: traitlets.Float
+        Seconds to wait before the first retry when the server does not say,
+        doubling on every further retry (default: 0.5)
+    request_budget: traitlets.Integer
+        Maximum number of requests a publish may make, or 0 for no limit
+        (default: 0)
+    rate_limit: traitlets.Float
+        Requests per second to each Confluence host, shared by the exporters
+        of the process and, with a cache_dir, every process on the machine, or
+        0 to only follow the rate limits the server advertises (default: 0)
+    max_concurrency: traitlets.Integer
+        Most requests in flight to each Confluence host at the same time,
+        shared like rate_limit, which halves while the server throttles or
+        slows down and recovers one request at a time, or 0 for no limit
+        (default: 8)
+    host_rate_limits: traitlets.Dict
+        rate_limit by host and port, for hosts that need their own
+        (default: {})
+    host_max_concurrency: traitlets.Dict
+        max_concurrency by host and port, for hosts that need their own
+        (default: {})
+    cache_dir: traitlets.Unicode
+        Directory for caches shared across processes, such as compiled
+        templates, highlighted code cells, and publish journals, or empty to
+        disable them (default: NBCONFLUX_CACHE_DIR or ~/.cache/nbconflux)
+    resume: traitlets.Bool
+        Skip the operations that the journal of an interrupted publish to the
+        same page shows as completed (default: False)
+    split_threshold: traitlets.Integer
+        Size in bytes of the page body above which the notebook publishes as
+        child pages, one per section at its top headings, under a page that
+        links to them, or 0 to never split (default: 0)
+    split_workers: traitlets.Integer
+        Number of child pages published at the same time (default: 4)
+    stream_put_threshold: traitlets.Integer
+        Page body size in characters from which the page update is JSON
+        encoded a slice at a time while it is sent instead of all at once, or
+        0 to always encode it all at once (default: 1048576)
+    skip_unchanged: traitlets.Bool
+        Skip publishing notebook bytes when the ledger in cache_dir shows the
+        same bytes were last published to the page with the same options and
+        library versions, and the page version is still the one that publish
+        left (default: False)
     """
     url = Unicode(config=True, help='Confluence URL to update with notebook content')
     username = Unicode(config=True, help='Confluence username')
@@ -52,6 +303,71 @@ class ConfluenceExporter(HTMLExporter):
     enable_style = Bool(config=True, default_value=True, help='Add basic Jupyter stylesheet?')
     enable_mathjax = Bool(config=True, default_value=False, help='Add MathJax to the page to render equations?')
     extra_labels = List(config=True, trait=Unicode(), help='List of additional labels to add to the page')
+    content_addressed_attachments = Bool(config=True, default_value=False,
+                                         help='Name output attachments after a digest of their '
+                                         'content?')
+    render_processes = Integer(config=True, default_value=1,
+                               help='Number of worker processes rendering cells in parallel')
+    reuse_attachment_index = Bool(config=True, default_value=False,
+                                  help='Keep the page attachment index in memory between '
+                                  'publishes?')
+    attachment_lookup = Enum(['auto', 'list', 'filename'], config=True, default_value='auto',
+                             help='How to find existing attachments: auto, list, or filename')
+    attachment_lookup_workers = Integer(config=True, default_value=8,
+                                        help='Number of attachment lookups made at the same time')
+    prune_attachments = Bool(config=True, default_value=False,
+                             help='Delete output attachments no recent page version references?')
+    attachment_batch_files = Integer(config=True, default_value=50,
+                                     help='Most new attachments created per upload request')
+    attachment_batch_bytes = Integer(config=True, default_value=8 << 20,
+                                     help='Most bytes of attachment data per upload request, or 0 '
+                                     'for no limit')
+    attachment_retention_days = Integer(config=True, default_value=30,
+                                        help='Days of page history whose output attachments '
+                                        'pruning keeps')
+    unique_key = Unicode(config=True, default_value='output',
+                         help='Prefix of output attachment filenames')
+    strip_unrenderable = Bool(config=True, default_value=True,
+                              help='Remove output data the page never shows before preprocessing?')
+    coalesce_streams = Bool(config=True, default_value=True,
+                            help='Merge stream outputs and collapse overwritten progress text?')
+    profile_render = Bool(config=True, default_value=False,
+                          help='Capture a cProfile profile of the render phase?')
+    transport = Enum(TRANSPORTS, config=True, default_value='requests',
+                     help='HTTP client library carrying the requests: requests or httpx')
+    max_retries = Integer(config=True, default_value=3,
+                          help='Number of times to retry requests the server asks to back off')
+    retry_backoff = Float(config=True, default_value=0.5,
+                          help='Seconds to wait before the first retry')
+    request_budget = Integer(config=True, default_value=0,
+                             help='Maximum number of requests per publish, or 0 for no limit')
+    rate_limit = Float(config=True, default_value=0.0,
+                       help='Requests per second to each Confluence host, or 0 to follow the '
+                       'server')
+    max_concurrency = Integer(config=True, default_value=8,
+                              help='Most requests in flight to each Confluence host, or 0 for no '
+                              'limit')
+    host_rate_limits = Dict(config=True, help='Requests per second by Confluence host')
+    host_max_concurrency = Dict(config=True, help='Most requests in flight by Confluence host')
+    cache_dir = Unicode(config=True,
+                        help='Directory for caches shared across processes, or empty to disable')
+    resume = Bool(config=True, default_value=False,
+                  help='Skip operations an interrupted publish to the same page completed?')
+    split_threshold = Integer(config=True, default_value=0,
+                              help='Page body bytes above which to publish sections as child '
+                              'pages, or 0')
+    split_workers = Integer(config=True, default_value=4,
+                            help='Number of child pages published at the same time')
+    stream_put_threshold = Integer(config=True, default_value=1 << 20,
+                                   help='Page body characters from which to encode the page '
+                                   'update as it is sent')
+    skip_unchanged = Bool(config=True, default_value=False,
+                          help='Skip publishing notebooks unchanged since their last publish to '
+                          'the page?')
+
+    @default('cache_dir')
+    def _cache_dir_default(self):
+        return default_cache_dir()
 
     @property
     def default_config(self):
@@ -84,11 +400,19 @@ class ConfluenceExporter(HTMLExporter):
     def __init__(self, config, **kwargs):
         config.HTMLExporter.preprocessors = [ConfluencePreprocessor]
         config.HTMLExporter.filters = {
+            'ansi2html': ansi2html,
             'sanitize_html': sanitize_html,
         }
 
         super(ConfluenceExporter, self).__init__(config=config, **kwargs)
         self._preprocessors[-1].exporter = self
+        # Ahead of the default preprocessors, so that none of them walks or copies data the
+        # page drops
+        self._preprocessors[0:0] = [
+            StripUnrenderablePreprocessor(parent=self, exporter=self,
+                                          enabled=self.strip_unrenderable),
+            CoalesceStreamsPreprocessor(parent=self, exporter=self, enabled=self.coalesce_streams),
+        ]
 
         self.template_path = [os.path.abspath(os.path.dirname(__file__))]
         self.template_file = 'confluence'
@@ -97,8 +421,113 @@ class ConfluenceExporter(HTMLExporter):
         # sanitization
         self.anchor_link_text = ' '
 
-        self.server, self.page_id = self.get_server_info(self.url)
+        self.session = create_transport(self.transport)
+        self.report = PublishReport()
+        self.metrics = RequestMetrics(self.request_budget)
+        self.journal = None
+        self.governors = {}
+        self._render_start = None
+        # Whether from_bytes already ran the preprocessors that drop data
+        self._dropped_early = False
+        self.page_targets = {}
+        # Exporters in render pool workers have no page to look up
+        self.server, self.page_id = self.resolve_page(self.url) if self.url else (None, None)
         self.notebook_filename = None
+        self.notebook_name = None
+        self.notebook_data = None
+        self.page_version = None
+        self.attachment_index = {}
+        self.attachment_digests = {}
+
+    def _create_environment(self):
+        """Override the base class implementation to reuse compiled template
+        code from earlier exporters in this process and from earlier processes.
+        """
+        environment = super(ConfluenceExporter, self)._create_environment()
+        environment.bytecode_cache = TemplateBytecodeCache(self.cache_dir or None)
+        return environment
+
+    def register_filter(self, name, jinja_filter):
+        """Override the base class implementation to swap the nbconvert code
+        highlighter for one that caches lexers and highlighted cells.
+        """
+        if name == 'highlight_code' and type(jinja_filter) is Highlight2HTML:
+            jinja_filter = CachedHighlight2HTML(pygments_lexer=jinja_filter.pygments_lexer,
+                                                cache_dir=self.cache_dir or None, parent=self)
+        return super(ConfluenceExporter, self).register_filter(name, jinja_filter)
+
+    def _register_filter(self, environ, name, jinja_filter):
+        """Override the base class implementation to time the filters that
+        dominate rendering in the publish report.
+        """
+        result = super(ConfluenceExporter, self)._register_filter(environ, name, jinja_filter)
+        registered = environ.filters[name]
+        # Filters registered by class or name come back through here once constructed
+        if name in TIMED_FILTERS and not getattr(registered, 'nbconflux_timed', False):
+            environ.filters[name] = self._timed_filter(name, registered)
+        return result
+
+    def _timed_filter(self, name, func):
+        """Wraps a template filter so that every call adds to the totals of
+        the current publish report.
+        """
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.report.add(name, time.perf_counter() - start)
+        for marker in JINJA_FILTER_MARKERS:
+            if hasattr(func, marker):
+                setattr(timed, marker, getattr(func, marker))
+        # render_cells hands the notebook lexer of the code highlighter to its workers
+        if hasattr(func, 'pygments_lexer'):
+            timed.pygments_lexer = func.pygments_lexer
+        timed.nbconflux_timed = True
+        return timed
+
+    def _preprocess(self, nb, resources):
+        """Override the base class implementation to time preprocessing, skip
+        the preprocessors from_bytes already ran, mark the start of the render
+        phase that follows it, and hand the template the parallel cell
+        renderer when enabled.
+        """
+        preprocessors = self._preprocessors
+        if self._dropped_early:
+            self._preprocessors = preprocessors[2:]
+        try:
+            with self.report.phase('preprocess'):
+                nb, resources = super(ConfluenceExporter, self)._preprocess(nb, resources)
+        finally:
+            self._preprocessors = preprocessors
+        # Added after preprocessing, which deep copies the resources
+        if self.render_processes > 1:
+            resources['render_cells'] = self.render_cells
+        if self.profile_render:
+            self.report.render_profile = cProfile.Profile()
+            self.report.render_profile.enable()
+        self._render_start = time.perf_counter()
+        return nb, resources
+
+    def resolve_page(self, url):
+        """Gets the Confluence server base URL and page ID for a page URL,
+        looking up each URL only once per exporter.
+
+        Parameters
+        ----------
+        url: str
+            Human readable URL
+
+        Returns
+        -------
+        2-tuple of str, int
+            Confluence server base URL and programmatic page ID
+        """
+        target = self.page_targets.get(url)
+        if target is None:
+            with self.report.phase('resolve_url'):
+                target = self.page_targets[url] = self.get_server_info(url)
+        return target
 
     def get_server_info(self, url):
         """Given a human visitable Confluence URL copy/pasted from the browser
@@ -156,11 +585,8 @@ class ConfluenceExporter(HTMLExporter):
             space = segs[2]
             title = segs[3]
 
-            resp = requests.get('{server}/rest/api/content?title={title}&spaceKey={space}'.format(server=server,
-                                                                                                  title=title,
-                                                                                                  space=space),
-                                auth=(self.username, self.password)
-                               )
+            resp = self.request('GET', '{server}/rest/api/content?title={title}&spaceKey={space}'
+                                .format(server=server, title=title, space=space))
             resp.raise_for_status()
             results = resp.json()['results']
             if not results:
@@ -172,6 +598,106 @@ class ConfluenceExporter(HTMLExporter):
 
         raise RuntimeError('Unknown URL format: ' + url)
 
+    def request(self, method, url, **kwargs):
+        """Sends a request to the Confluence server with the exporter
+        credentials, and records it in the publish metrics.
+
+        Retries requests that the server asks to back off, waiting as long as
+        its Retry-After header says or with exponential backoff otherwise.
+        Every attempt waits its turn with the rate governor of the host.
+
+        Parameters
+        ----------
+        method: str
+            HTTP method
+        url: str
+            Request URL
+        kwargs: dict
+            Additional requests.Session.request arguments, which every
+            transport accepts
+
+        Returns
+        -------
+        requests.Response
+            Final response from the Confluence server
+
+        Raises
+        ------
+        nbconflux.metrics.RequestBudgetExceeded
+            When the request would exceed the publish request budget
+        """
+        kwargs.setdefault('auth', (self.username, self.password))
+        governor = self.governor(url)
+        key = '{} {}'.format(method, endpoint(url))
+        attempt = 0
+        backed_off_until = 0.0
+        while True:
+            self.metrics.check_budget(method, url)
+            waited = governor.acquire(backed_off_until)
+            if waited:
+                self.report.add('throttle', waited)
+            start = time.perf_counter()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except BaseException as e:
+                elapsed = time.perf_counter() - start
+                governor.release(key, elapsed)
+                if isinstance(e, requests.RequestException):
+                    self.metrics.observe(method, url, 0, elapsed)
+                raise
+            elapsed = time.perf_counter() - start
+            # The retry below waits out a block its own response sets
+            backed_off_until = max(backed_off_until,
+                                   governor.release(key, elapsed, resp.status_code, resp.headers))
+            self.metrics.observe(method, url, resp.status_code, elapsed,
+                                 _body_size(resp.request), len(resp.content))
+            if resp.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                return resp
+            attempt += 1
+            self.metrics.retry(method, url)
+            time.sleep(self.retry_delay(resp, attempt))
+
+    def governor(self, url):
+        """Gets the rate governor pacing the requests to the host of a URL.
+
+        Parameters
+        ----------
+        url: str
+            Request URL
+
+        Returns
+        -------
+        nbconflux.governor.RateGovernor
+        """
+        host = urlparse.urlparse(url).netloc
+        governor = self.governors.get(host)
+        if governor is None:
+            governor = self.governors[host] = RateGovernor(
+                host, rate=self.host_rate_limits.get(host, self.rate_limit),
+                max_concurrency=self.host_max_concurrency.get(host, self.max_concurrency),
+                directory=self.cache_dir or None)
+        return governor
+
+    def retry_delay(self, resp, attempt):
+        """Gets the number of seconds to wait before retrying a request.
+
+        Parameters
+        ----------
+        resp: requests.Response
+            Response asking the client to back off
+        attempt: int
+            Number of the retry about to be made, starting at 1
+
+        Returns
+        -------
+        float
+        """
+        try:
+            delay = float(resp.headers['Retry-After'])
+        except (KeyError, ValueError):
+            delay = self.retry_backoff * 2 ** (attempt - 1)
+        return min(max(delay, 0.0), MAX_RETRY_DELAY)
+
     def update_page(self, page_id, body):
         """Updates the body of the page with new content.
 
@@ -187,34 +713,55 @@ class ConfluenceExporter(HTMLExporter):
         ------
         Exception
             When Confluence API returns an error
+
+        Note
+        ----
+        Skips the update when the publish journal shows that an interrupted
+        publish already wrote the same body and the page has not changed since.
         """
+        digest = text_digest(body) if self.journal is not None else None
         # Fetch version number from the existing page so that we can increment it by 1.
-        resp = requests.get('{server}/rest/api/content/{page_id}'.format(server=self.server,
-                                                                         page_id=page_id),
-                            auth=(self.username, self.password))
-        resp.raise_for_status()
+        with self.report.phase('page_version'):
+            resp = self.request('GET', '{server}/rest/api/content/{page_id}'
+                                .format(server=self.server, page_id=page_id))
+            resp.raise_for_status()
         content = resp.json()
         version = content['version']['number']
         # Newer Confluence requires title when posting the page back
         title = content['title']
 
+        # An interrupted publish already wrote this body and nobody changed the page since
+        written = self.journal.page() if self.journal is not None else None
+        if written is not None and written == {'op': 'page', 'version': version, 'digest': digest}:
+            self.page_version = version
+            return
+
         # Update the page with the new content.
-        resp = requests.put('{server}/rest/api/content/{page_id}'.format(server=self.server,
-                                                                         page_id=page_id),
-                            json={
-                               'version': {"number":version + 1},
-                               'title': title,
-                               'type': 'page',
-                               'body': {
-                                   'storage': {
-                                       'representation': 'storage',
-                                       'value': body
-                                   }
-                               }
-                            },
-                            auth=(self.username, self.password)
-                           )
-        resp.raise_for_status()
+        document = {
+            'version': {"number": version + 1},
+            'title': title,
+            'type': 'page',
+            'body': {
+                'storage': {
+                    'representation': 'storage',
+                    'value': TEXT
+                }
+            }
+        }
+        with self.report.phase('page_put'):
+            if self.stream_put_threshold and len(body) >= self.stream_put_threshold:
+                # Never holds the escaped body or its bytes whole, only a slice at a time
+                data = JSONTextStream(document, body)
+            else:
+                document['body']['storage']['value'] = body
+                data = dumps(document)
+            resp = self.request('PUT', '{server}/rest/api/content/{page_id}'
+                                .format(server=self.server, page_id=page_id),
+                                data=data, headers={'Content-Type': 'application/json'})
+            resp.raise_for_status()
+        self.page_version = version + 1
+        if self.journal is not None:
+            self.journal.record('page', version=version + 1, digest=digest)
 
     def add_label(self, page_id, label):
         """Adds a label with global prefix to the page.
@@ -232,10 +779,9 @@ class ConfluenceExporter(HTMLExporter):
             When Confluence API returns an error
         """
         # Add the nbconflux label to the set of labels. OK if it already exists.
-        resp = requests.post('{server}/rest/api/content/{page_id}/label'.format(server=self.server,
-                                                                                page_id=page_id),
-                             json=[dict(prefix='global', name=label)],
-                             auth=(self.username, self.password))
+        resp = self.request('POST', '{server}/rest/api/content/{page_id}/label'
+                            .format(server=self.server, page_id=page_id),
+                            json=[dict(prefix='global', name=label)])
         resp.raise_for_status()
 
     def add_or_update_attachment(self, filename, data, resources):
@@ -253,24 +799,120 @@ class ConfluenceExporter(HTMLExporter):
         Returns
         -------
         request.Response
-            Response from the Confluence server
+            Response from the Confluence server, or None if the attachment
+            does not need to be uploaded
         """
         basename = os.path.basename(filename)
         attachment = resources.get('attachments', {}).get(basename)
-        if attachment is None:
+        if attachment is None or attachment.upload_url is None:
             return
         files = {
             'file': (basename, data)
         }
-        resp = requests.post(attachment.upload_url,
-                             headers={
-                                 'X-Atlassian-Token': 'nocheck'
-                             },
-                             files=files,
-                             auth=(self.username, self.password))
+        resp = self.request('POST', attachment.upload_url,
+                            headers={
+                                'X-Atlassian-Token': 'nocheck'
+                            },
+                            files=files)
+        resp.raise_for_status()
+        return resp
+
+    def add_attachments(self, uploads, resources):
+        """Creates several page attachments with a single request.
+
+        Parameters
+        ----------
+        uploads: list
+            Local filename and data to post of each new attachment
+        resources: dict
+            Additional nbconvert resources
+
+        Returns
+        -------
+        request.Response
+            Response from the Confluence server
+        """
+        files = [('file', (os.path.basename(filename), data)) for filename, data in uploads]
+        upload_url = resources['attachments'][files[0][1][0]].upload_url
+        resp = self.request('POST', upload_url,
+                            headers={
+                                'X-Atlassian-Token': 'nocheck'
+                            },
+                            files=files)
         resp.raise_for_status()
         return resp
 
+    def upload_attachments(self, uploads, resources):
+        """Creates and updates page attachments, creating new attachments in
+        batches of several per request.
+
+        Parameters
+        ----------
+        uploads: list
+            Local filename and data of each attachment
+        resources: dict
+            Additional nbconvert resources
+        """
+        attachments = resources.get('attachments', {})
+        new = []
+        for filename, data in uploads:
+            attachment = attachments.get(os.path.basename(filename))
+            if attachment is None or attachment.upload_url is None:
+                continue
+            if attachment.id is None:
+                new.append((filename, data))
+                continue
+            # Updates need the data endpoint of their attachment
+            resp = self.add_or_update_attachment(filename, data, resources)
+            self.record_attachment(filename, data, resp, resources)
+
+        for batch in batch_uploads(new, self.attachment_batch_bytes,
+                                   max(1, self.attachment_batch_files)):
+            resp = self.add_attachments(batch, resources)
+            for filename, data in batch:
+                self.record_attachment(filename, data, resp, resources)
+
+    def record_attachment(self, filename, data, resp, resources):
+        """Remembers the content and new version of an uploaded attachment so
+        that later publishes from this exporter can skip uploading the same
+        bytes again.
+
+        Parameters
+        ----------
+        filename: str
+            Local filename
+        data: bytes or str
+            Data posted
+        resp: requests.Response
+            Response from the Confluence server to the upload
+        resources: dict
+            Additional nbconvert resources
+        """
+        basename = os.path.basename(filename)
+        attachment = resources['attachments'][basename]
+        version = attachment.version + 1
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        self.attachment_digests[(self.page_id, basename)] = (digest, version)
+        if self.journal is not None:
+            self.journal.record('attachment', filename=basename, digest=digest, version=version)
+
+        index = self.attachment_index.get(self.page_id)
+        if index is None:
+            return
+        attachment_id = attachment.id
+        if attachment_id is None:
+            # New attachments only learn their ID from the upload response
+            try:
+                attachment_id = next(result['id'] for result in resp.json()['results']
+                                     if result['title'] == basename)
+            except (ValueError, KeyError, TypeError, StopIteration):
+                # List the attachments again on the next publish
+                del self.attachment_index[self.page_id]
+                return
+        index[basename] = Attachment(attachment_id, version, None, None)
+
     def markdown2html(self, source):
         """Override the base class implementation to force empty tags to be
         XHTML compliant for compatibility with Confluence storage format.
@@ -280,7 +922,45 @@ class ConfluenceExporter(HTMLExporter):
                                               anchor_link_text=self.anchor_link_text)
         return MarkdownWithMath(renderer=renderer).render(source)
 
-    def from_notebook_node(self, nb, resources=None, **kw):
+    def render_cells(self, cells, resources):
+        """Renders preprocessed cells across a pool of worker processes.
+
+        Splits the cells into contiguous chunks, renders each chunk with the
+        page template in a worker, and joins the results in notebook order.
+        The output is identical to rendering the cells in this process.
+
+        Parameters
+        ----------
+        cells: list
+            Preprocessed notebook cells
+        resources: dict
+            Additional nbconvert resources
+
+        Returns
+        -------
+        str
+            Confluence storage format for all of the cells
+        """
+        # Workers need everything the template reads for cells, but not the extracted
+        # outputs, this callback, or the child page links that follow the cells
+        worker_resources = {key: value for key, value in resources.items()
+                            if key not in ('outputs', 'render_cells', 'child_pages')}
+        lexer = getattr(self.environment.filters['highlight_code'], 'pygments_lexer', None)
+
+        # Several chunks per worker balance out cells that are slow to render
+        chunk_count = min(len(cells), self.render_processes * 4) or 1
+        chunk_size = -(-len(cells) // chunk_count)
+        chunks = [list(cells[i:i + chunk_size]) for i in range(0, len(cells), chunk_size)]
+
+        with ProcessPoolExecutor(max_workers=self.render_processes,
+                                 initializer=_init_render_worker,
+                                 initargs=(self.config,)) as pool:
+            futures = [pool.submit(_render_cells, chunk, worker_resources, lexer)
+                       for chunk in chunks]
+            return ''.join(future.result() for future in futures)
+
+    def from_notebook_node(self, nb, resources=None, url=None, notebook_name=None,
+                           notebook_data=None, **kw):
         """Publishes a notebook to Confluence given a notebook object
         from nbformat.
 
@@ -290,58 +970,359 @@ class ConfluenceExporter(HTMLExporter):
             Root of a notebook
         resources: dict
             Additional nbconvert resources
+        url: str, optional
+            Human-readable Confluence page URL to publish to instead of the
+            configured url
+        notebook_name: str, optional
+            Filename to attach the notebook to the page as, required when
+            attach_ipynb is enabled
+        notebook_data: str or bytes, optional
+            Serialized notebook to attach, or None to serialize nb
 
         Returns
         -------
         2-tuple
             Published Confluence storage format HTML and nbconvert resources
         """
-        if self.notebook_filename is None:
-            raise ValueError('only from_filename is supported')
+        if self.attach_ipynb and not notebook_name:
+            raise ValueError('A notebook_name is required to attach the notebook to the page')
+        url = url or self.url
+        if not url:
+            raise ValueError('No Confluence page url to publish to')
+        self.server, self.page_id = self.resolve_page(url)
 
         # Seed resources with option flags
         resources = resources if resources is not None else {}
         resources['generate_toc'] = self.generate_toc
         resources['enable_mathjax'] = self.enable_mathjax
         resources['enable_style'] = self.enable_style
+        resources.setdefault('unique_key', self.unique_key)
+        # Child pages of a split notebook start over from the same resources
+        initial = copy.deepcopy(resources) if self.split_threshold else None
+
+        if self.attach_ipynb and notebook_data is None:
+            notebook_data = nbformat.writes(nb)
+        # Stash the notebook attachment for the preprocessor
+        self.notebook_name = notebook_name
+        self.notebook_data = notebook_data
 
-        # Convert the notebook to Confluence storage format, which is XHTML-like
-        html, resources = super(ConfluenceExporter, self).from_notebook_node(nb, resources, **kw)
+        completed = False
+        try:
+            self.journal = self.open_journal()
+            # Convert the notebook to Confluence storage format, which is XHTML-like
+            try:
+                html, resources = super(ConfluenceExporter, self).from_notebook_node(nb, resources,
+                                                                                     **kw)
+            finally:
+                self._end_render()
+            resources.pop('render_cells', None)
 
-        # Update the page with the new content
-        self.update_page(self.page_id, html)
-        # Add the nbconflux label to the page for tracking
-        self.add_label(self.page_id, 'nbconflux')
-        # If requested, add any extra labels to the page
-        if self.extra_labels:
-            for label in self.extra_labels:
-                self.add_label(self.page_id, label)
+            if self.split_threshold and len(html.encode('utf-8')) > self.split_threshold:
+                preamble, parts = split_notebook(nb)
+                if parts:
+                    with self.report.phase('split'):
+                        child_pages = self.publish_parts(nb, parts, initial)
+                    # The page keeps the cells before the first section and links to the rest
+                    try:
+                        html, resources = super(ConfluenceExporter, self).from_notebook_node(
+                            part_notebook(nb, preamble),
+                            dict(copy.deepcopy(initial), child_pages=child_pages), **kw)
+                    finally:
+                        self._end_render()
+                    resources.pop('render_cells', None)
+                else:
+                    warnings.warn('Notebook exceeds the split threshold but has no headings to '
+                                  'split at')
 
-        # Create or update all attachments on the page
-        for filename, data in resources.get('outputs', {}).items():
-            self.add_or_update_attachment(filename, data, resources)
+            # Update the page with the new content
+            self.update_page(self.page_id, html)
+            with self.report.phase('labels'):
+                labeled = self.journal.labels() if self.journal is not None else set()
+                # Add the nbconflux label to the page for tracking, and if
+                # requested, any extra labels
+                for label in ['nbconflux'] + list(self.extra_labels or []):
+                    if label in labeled:
+                        continue
+                    self.add_label(self.page_id, label)
+                    if self.journal is not None:
+                        self.journal.record('label', name=label)
 
-        # Create or update the notebook document attachment on the page
-        if self.attach_ipynb:
-            with open(self.notebook_filename, encoding='utf-8') as f:
-                self.add_or_update_attachment(self.notebook_filename, f.read(), resources)
+            with self.report.phase('attachments'):
+                # Create or update all attachments on the page, and if requested, the
+                # notebook document attachment
+                uploads = list(resources.get('outputs', {}).items())
+                if self.attach_ipynb:
+                    uploads.append((self.notebook_name, self.notebook_data))
+                self.upload_attachments(uploads, resources)
+
+            if self.prune_attachments:
+                with self.report.phase('prune'):
+                    resources['pruned'] = self.prune(html, unique_key=resources['unique_key'])
+
+            resources['report'] = self.report
+            resources['metrics'] = self.metrics
+            completed = True
+        finally:
+            if self.journal is not None:
+                self.journal.close(complete=completed)
+                self.journal = None
+            self.notebook_name = self.notebook_data = None
+            # Start a fresh report and metrics for the next publish
+            self.report = PublishReport()
+            self.metrics = RequestMetrics(self.request_budget)
 
         return html, resources
 
-    def from_filename(self, filename, *args, **kwargs):
+    def publish_parts(self, nb, parts, resources):
+        """Publishes the parts of a split notebook as child pages of the
+        current page, several at once, creating the child pages that do not
+        exist yet.
+
+        Parameters
+        ----------
+        nb: nbformat.notebooknode.NotebookNode
+            Root of the whole notebook
+        parts: list
+            nbconflux.split.NotebookPart instances
+        resources: dict
+            Additional nbconvert resources to publish every part with
+
+        Returns
+        -------
+        list
+            Title, URL, and page ID dicts of the child pages in notebook order
+
+        Raises
+        ------
+        nbconflux.pages.PageTitleConflict
+            If a part has the title of a page that is not a child of the page
+        """
+        server, parent_id = self.server, self.page_id
+        title, space = get_page(self, parent_id)
+        titles = part_titles(title, parts)
+        found = find_pages(self, space, titles)
+        # Check every title before creating or publishing any child page
+        page_ids = [existing_page(found, part_title, parent_id) for part_title in titles]
+
+        def publish(part, part_title, page_id):
+            if page_id is None:
+                page_id = create_page(self, space, part_title, parent_id)
+            url = page_url(server, page_id)
+            exporter = self.part_exporter()
+            exporter.from_notebook_node(part_notebook(nb, part.cells), copy.deepcopy(resources),
+                                        url=url)
+            return {'title': part_title, 'url': url, 'page_id': page_id}
+
+        with ThreadPoolExecutor(max_workers=self.split_workers) as pool:
+            return list(pool.map(publish, parts, titles, page_ids))
+
+    def part_exporter(self):
+        """Creates an exporter with the same configuration that publishes a
+        part of a split notebook to a child page.
+
+        Returns
+        -------
+        ConfluenceExporter
+        """
+        config = self.config.copy()
+        config.ConfluenceExporter.url = ''
+        config.ConfluenceExporter.username = self.username
+        config.ConfluenceExporter.password = self.password
+        # The notebook attaches to the page that links to its parts, and parts never split again
+        config.ConfluenceExporter.attach_ipynb = False
+        config.ConfluenceExporter.split_threshold = 0
+        return ConfluenceExporter(config)
+
+    def prune(self, body=None, dry_run=False, unique_key=None):
+        """Deletes the output attachments on the current page that no page
+        version within the retention window references.
+
+        Parameters
+        ----------
+        body: str, optional
+            Current page body, fetched if not given
+        dry_run: bool, optional
+            Only find the orphaned attachments (default: False)
+        unique_key: str, optional
+            Prefix of the output attachment filenames (default: the
+            unique_key option)
+
+        Returns
+        -------
+        list
+            Attachment ID and filename 2-tuples of the orphaned attachments
+        """
+        pruner = AttachmentPruner(self, retention_days=self.attachment_retention_days,
+                                  max_workers=self.attachment_lookup_workers,
+                                  unique_key=unique_key or self.unique_key)
+        orphans = pruner.prune(self.page_id, body, dry_run=dry_run)
+        if not dry_run:
+            for _, filename in orphans:
+                self.attachment_digests.pop((self.page_id, filename), None)
+                self.attachment_index.get(self.page_id, {}).pop(filename, None)
+        return orphans
+
+    def open_journal(self):
+        """Starts the journal of a publish to the current page.
+
+        When resuming, keeps the operations journaled by an interrupted
+        publish to the page and seeds the uploaded attachment digests from
+        them, so that attachments uploaded before the interruption link to
+        the version they were uploaded as instead of being uploaded again.
+
+        Returns
+        -------
+        nbconflux.journal.PublishJournal
+            Journal, or None when cache_dir is empty or cannot hold journals
+        """
+        if not self.cache_dir:
+            return None
+        try:
+            journal = PublishJournal(journal_path(self.cache_dir, self.server, self.page_id),
+                                     resume=self.resume)
+        except OSError:
+            # A read-only or misplaced cache directory only costs resuming an interrupted publish
+            return None
+        for filename, uploaded in journal.attachments().items():
+            self.attachment_digests[(self.page_id, filename)] = uploaded
+        return journal
+
+    def _end_render(self):
+        """Records the render phase that started when preprocessing ended."""
+        if self._render_start is None:
+            return
+        if self.report.render_profile is not None:
+            self.report.render_profile.disable()
+        self.report.add('render', time.perf_counter() - self._render_start, self._render_start)
+        self._render_start = None
+
+    def from_bytes(self, data, notebook_name=None, resources=None, url=None, **kw):
+        """Publishes a serialized notebook to Confluence, attaching the same
+        bytes to the page.
+
+        Parameters
+        ----------
+        data: bytes or str
+            Notebook in the ipynb JSON format
+        notebook_name: str, optional
+            Filename to attach the notebook to the page as, required when
+            attach_ipynb is enabled
+        resources: dict
+            Additional nbconvert resources
+        url: str, optional
+            Human-readable Confluence page URL to publish to instead of the
+            configured url
+
+        Returns
+        -------
+        2-tuple
+            Published Confluence storage format HTML and nbconvert resources,
+            or None and resources with skipped set when skip_unchanged skips
+            the publish
+        """
+        digest = None
+        if self.skip_unchanged and self.cache_dir:
+            url = url or self.url
+            if not url:
+                raise ValueError('No Confluence page url to publish to')
+            self.server, self.page_id = self.resolve_page(url)
+            digest = fingerprint(data, self.publish_options())
+            if self.page_unchanged(digest):
+                skipped = dict(resources or {}, skipped=True, report=self.report,
+                               metrics=self.metrics)
+                self.report = PublishReport()
+                self.metrics = RequestMetrics(self.request_budget)
+                return None, skipped
+
+        with self.report.phase('read_notebook'):
+            text = data.decode('utf-8') if isinstance(data, bytes) else data
+            nb = nbformat.reads(text, as_version=4)
+            # Nobody else holds the notebook yet, so drop unrenderable data before the
+            # conversion copies it
+            for preprocessor in self._preprocessors[:2]:
+                nb, resources = preprocessor(nb, resources)
+        self.page_version = None
+        self._dropped_early = True
+        try:
+            result = self.from_notebook_node(nb, resources=resources, url=url,
+                                             notebook_name=notebook_name, notebook_data=data, **kw)
+        finally:
+            self._dropped_early = False
+        if digest is not None and self.page_version is not None:
+            try:
+                PublishLedger(self.cache_dir).record(self.server, self.page_id, digest,
+                                                     self.page_version)
+            except OSError as ex:
+                # The page is published, and the next publish only cannot skip it
+                self.log.warning('Could not record the publish to page %s: %s', self.page_id, ex)
+        return result
+
+    def publish_options(self):
+        """Gets the options that shape the published page, for fingerprinting
+        publishes.
+
+        Returns
+        -------
+        dict
+            Exporter option values by name, and the configuration of the
+            preprocessors and other classes under config
+        """
+        options = {name: getattr(self, name) for name in self.trait_names(config=True)
+                   if name not in UNFINGERPRINTED_OPTIONS}
+        options['config'] = {section: values for section, values in self.config.items()
+                             if section not in ('ConfluenceExporter', 'HTMLExporter')}
+        return options
+
+    def page_unchanged(self, digest):
+        """Checks whether the last publish to the current page had the same
+        fingerprint and left the page at its current version.
+
+        Parameters
+        ----------
+        digest: str
+            Fingerprint of the publish about to happen
+
+        Returns
+        -------
+        bool
+        """
+        entry = PublishLedger(self.cache_dir).lookup(self.server, self.page_id)
+        if entry is None or entry.get('fingerprint') != digest:
+            return False
+        with self.report.phase('page_version'):
+            resp = self.request('GET', '{server}/rest/api/content/{page_id}'
+                                .format(server=self.server, page_id=self.page_id))
+            resp.raise_for_status()
+        return resp.json()['version']['number'] == entry.get('version')
+
+    def from_file(self, file_stream, resources=None, **kw):
+        """Override the base class implementation to read the notebook once
+        for both parsing and attaching it.
+        """
+        return self.from_bytes(file_stream.read(), resources=resources, **kw)
+
+    def from_filename(self, filename, resources=None, url=None, **kw):
         """Publishes a notebook to Confluence given a local notebook filename.
 
         Parameters
         ----------
         filename: str
             Path to a local ipynb
+        resources: dict
+            Additional nbconvert resources
+        url: str, optional
+            Human-readable Confluence page URL to publish to instead of the
+            configured url
 
         Returns
         -------
         2-tuple
             Published Confluence storage format HTML and nbconvert resources
         """
-        # Preprocessor needs the filename to attach the notebook source file properly
-        # so stash it here for later lookup
         self.notebook_filename = filename
-        return super(ConfluenceExporter, self).from_filename(filename, *args, **kwargs)
+        try:
+            return super(ConfluenceExporter, self).from_filename(
+                filename, resources=resources, url=url, notebook_name=os.path.basename(filename),
+                **kw)
+        finally:
+            self.notebook_filename = None
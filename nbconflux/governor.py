@@ -0,0 +1,349 @@
+"""Client-side rate governor that paces the requests to each Confluence host
+with a token bucket and adapts how many run at the same time, shared by the
+threads of a process and, through a locked state file, by the processes on a
+host.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Longest wait for the server to lift throttling in seconds
+MAX_BLOCK = 60.0
+
+# Seconds between checks for a free request slot
+POLL_INTERVAL = 0.02
+
+# Seconds without requests after which the learned state starts over
+IDLE_RESET = 60.0
+
+# Statuses that ask clients to send fewer requests
+THROTTLE_STATUSES = (429, 503)
+
+# Latency above this multiple of the endpoint average counts as a spike
+LATENCY_SPIKE_FACTOR = 4.0
+
+# Latency in seconds below which no response counts as a spike
+MIN_SPIKE_LATENCY = 0.5
+
+# Weight of the latest response in the endpoint latency averages
+LATENCY_WEIGHT = 0.2
+
+# Seconds between two decreases of the concurrency limit, so that the
+# requests in flight when the server pushes back count as one signal
+DECREASE_INTERVAL = 1.0
+
+# Factor applied to the concurrency limit on every decrease
+DECREASE_FACTOR = 0.5
+
+# Shortfall of a token that counts as rounding of the refill arithmetic
+TOKEN_EPSILON = 1e-9
+
+
+def governor_path(directory, host):
+    """Gets the state file path for the governor of a host.
+
+    Parameters
+    ----------
+    directory: str
+        Root cache directory
+    host: str
+        Host and port of the Confluence server
+
+    Returns
+    -------
+    str
+    """
+    host_key = hashlib.sha256(host.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(directory, 'governor', '{}.json'.format(host_key))
+
+
+def _float_header(headers, *names):
+    """Gets the first of the named headers that holds a number."""
+    for name in names:
+        try:
+            return float(headers[name])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+class MemoryState:
+    """Governor state shared by the threads of a process."""
+    def __init__(self):
+        self.state = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            yield self.state
+
+
+class FileState:
+    """Governor state shared by the processes on a host through a file that
+    every change locks.
+
+    Parameters
+    ----------
+    path: str
+        State file path
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Fails here rather than in every transaction when the file cannot be written
+        open(path, 'a').close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with open(self.path, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or '{}')
+                except ValueError:
+                    state = {}
+                # Requests of processes that died without finishing them are not in flight
+                state['in_flight'] = {pid: n for pid, n in state.get('in_flight', {}).items()
+                                      if int(pid) == os.getpid() or _pid_alive(int(pid))}
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# State of the governors without a state file, by host
+_memory_states = {}
+_memory_states_lock = threading.Lock()
+
+
+def _memory_state(host):
+    with _memory_states_lock:
+        return _memory_states.setdefault(host, MemoryState())
+
+
+class RateGovernor:
+    """Paces the requests to one Confluence host.
+
+    Requests wait for a token from a bucket that refills at the configured
+    rate, or at the rate the server advertises in its rate limit headers when
+    that is lower. The number of requests in flight is limited with additive
+    increase and multiplicative decrease: every response raises the limit by
+    about one per limit's worth of responses, up to max_concurrency, and a
+    throttling response or a latency spike halves it. A Retry-After header
+    on a throttling response holds back every request to the host.
+
+    Parameters
+    ----------
+    host: str
+        Host and port of the Confluence server
+    rate: float, optional
+        Requests per second, or 0 to only follow the server (default: 0)
+    max_concurrency: int, optional
+        Most requests in flight, or 0 for no limit (default: 8)
+    directory: str, optional
+        Root cache directory holding state shared with other processes, or
+        None to share state with the threads of this process only, as when
+        the directory cannot be created
+    """
+    def __init__(self, host, rate=0.0, max_concurrency=8, directory=None):
+        self.host = host
+        self.rate = rate
+        self.max_concurrency = max_concurrency
+        self.store = None
+        if directory and fcntl is not None:
+            try:
+                self.store = FileState(governor_path(directory, host))
+            except OSError:
+                # A read-only or misplaced cache directory only stops sharing state with other
+                # processes
+                pass
+        if self.store is None:
+            self.store = _memory_state(host)
+        self.pid = str(os.getpid())
+
+    def _current(self, state, now):
+        """Starts the state over after it has been idle, and fills in what is
+        missing.
+        """
+        if now - state.get('stamp', 0.0) > IDLE_RESET:
+            in_flight = state.get('in_flight', {})
+            state.clear()
+            state['in_flight'] = in_flight
+        state.setdefault('in_flight', {})
+        state.setdefault('limit', float(self.max_concurrency))
+        state.setdefault('blocked_until', 0.0)
+        state.setdefault('decreased_at', 0.0)
+        state.setdefault('latency', {})
+        return state
+
+    def request_rate(self, state):
+        """Gets the requests per second to pace requests at.
+
+        Parameters
+        ----------
+        state: dict
+            Governor state
+
+        Returns
+        -------
+        float
+            Lower of the configured and advertised rates, or 0 for no pacing
+        """
+        rates = [rate for rate in (self.rate, state.get('server_rate')) if rate]
+        return min(rates) if rates else 0.0
+
+    def _take(self, state, now, backed_off_until):
+        """Takes a request slot if one is free.
+
+        Returns
+        -------
+        float
+            0 if the slot was taken, or the seconds to wait before trying
+            again otherwise
+        """
+        blocked = state['blocked_until'] - now
+        if blocked > 0 and state['blocked_until'] > backed_off_until:
+            return blocked
+        if self.max_concurrency and sum(state['in_flight'].values()) >= int(state['limit']):
+            return POLL_INTERVAL
+
+        rate = self.request_rate(state)
+        if rate:
+            capacity = max(1.0, min(rate, state.get('server_capacity') or rate))
+            # Refilled separately from the idle stamp, which finished requests also move
+            refilled = state.get('tokens', capacity) + (now - state.get('refilled', now)) * rate
+            tokens = min(capacity, refilled)
+            state['refilled'] = now
+            if tokens < 1.0 - TOKEN_EPSILON:
+                state['tokens'] = tokens
+                return (1.0 - tokens) / rate
+            state['tokens'] = max(0.0, tokens - 1.0)
+        state['stamp'] = now
+        state['in_flight'][self.pid] = state['in_flight'].get(self.pid, 0) + 1
+        return 0.0
+
+    def acquire(self, backed_off_until=0.0):
+        """Waits until a request to the host may start.
+
+        Parameters
+        ----------
+        backed_off_until: float, optional
+            End of a block that the caller waits out by itself, like a retry
+            honoring the Retry-After of its own response (default: 0)
+
+        Returns
+        -------
+        float
+            Seconds waited
+        """
+        start = None
+        while True:
+            with self.store.transaction() as state:
+                now = time.time()
+                wait = self._take(self._current(state, now), now, backed_off_until)
+            if not wait:
+                return now - start if start is not None else 0.0
+            if start is None:
+                start = now
+            time.sleep(min(wait, MAX_BLOCK))
+
+    def release(self, key, latency, status=None, headers=None):
+        """Finishes a request started after acquire, adapting to the response.
+
+        Parameters
+        ----------
+        key: str
+            Endpoint of the request, averaging latency with the requests to the
+            same endpoint
+        latency: float
+            Seconds the request took
+        status: int, optional
+            Response status, or None when no response arrived
+        headers: dict, optional
+            Response headers
+
+        Returns
+        -------
+        float
+            time.time() until which the response holds back requests to the
+            host, or 0 if it does not
+        """
+        with self.store.transaction() as state:
+            now = time.time()
+            state = self._current(state, now)
+            state['stamp'] = now
+            count = state['in_flight'].get(self.pid, 0) - 1
+            if count > 0:
+                state['in_flight'][self.pid] = count
+            else:
+                state['in_flight'].pop(self.pid, None)
+            if status is None:
+                return 0.0
+
+            average = state['latency'].get(key)
+            spike = (average is not None and latency > MIN_SPIKE_LATENCY and
+                     latency > LATENCY_SPIKE_FACTOR * average)
+            state['latency'][key] = latency if average is None else \
+                (1 - LATENCY_WEIGHT) * average + LATENCY_WEIGHT * latency
+
+            blocked_until = 0.0
+            if headers is not None:
+                blocked_until = self._read_headers(state, now, status, headers)
+
+            if status in THROTTLE_STATUSES or spike:
+                if now - state['decreased_at'] >= DECREASE_INTERVAL:
+                    state['limit'] = max(1.0, state['limit'] * DECREASE_FACTOR)
+                    state['decreased_at'] = now
+            elif self.max_concurrency:
+                state['limit'] = min(float(self.max_concurrency),
+                                     state['limit'] + 1.0 / state['limit'])
+        return blocked_until
+
+    def _read_headers(self, state, now, status, headers):
+        """Adopts the rate limits a response advertises, and returns the end of
+        the block it asks for or 0.
+        """
+        fill_rate = _float_header(headers, 'X-RateLimit-FillRate')
+        interval = _float_header(headers, 'X-RateLimit-Interval-Seconds') or 1.0
+        if fill_rate:
+            state['server_rate'] = fill_rate / interval
+        capacity = _float_header(headers, 'X-RateLimit-Limit', 'RateLimit-Limit')
+        if capacity:
+            state['server_capacity'] = capacity
+        remaining = _float_header(headers, 'X-RateLimit-Remaining', 'RateLimit-Remaining')
+        if remaining is not None and 'tokens' in state:
+            state['tokens'] = min(state['tokens'], remaining)
+
+        delay = None
+        if status in THROTTLE_STATUSES:
+            delay = _float_header(headers, 'Retry-After')
+        elif remaining is not None and remaining < 1:
+            delay = _float_header(headers, 'X-RateLimit-Reset', 'RateLimit-Reset')
+        if delay is None or delay <= 0:
+            return 0.0
+        blocked_until = now + min(delay, MAX_BLOCK)
+        state['blocked_until'] = max(state['blocked_until'], blocked_until)
+        return blocked_until
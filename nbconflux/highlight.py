@@ -0,0 +1,237 @@
+"""Syntax highlighting of code cells that reuses lexers within a process and
+highlighted cells across processes.
+"""
+import functools
+import hashlib
+import json
+import os
+import time
+import warnings
+
+import pygments
+
+from nbconvert.filters.highlight import Highlight2HTML
+from pygments.util import ClassNotFound
+
+from .cache import write_atomic
+
+# Seconds after their last use that highlighted cells leave the cache
+MAX_AGE = 30 * 24 * 60 * 60
+
+# Seconds between two sweeps of the cache for cells older than MAX_AGE
+SWEEP_INTERVAL = 24 * 60 * 60
+
+
+def highlight_language(language, metadata=None):
+    """Gets the language to highlight a cell as, which is the cell magic
+    language for IPython cells that use one.
+
+    Parameters
+    ----------
+    language: str
+        Notebook or requested language
+    metadata: dict, optional
+        Cell metadata
+
+    Returns
+    -------
+    str
+    """
+    if language.startswith('ipython') and metadata and 'magics_language' in metadata:
+        return metadata['magics_language']
+    return language
+
+
+@functools.lru_cache(maxsize=None)
+def get_lexer(language):
+    """Gets the Pygments lexer for a language, falling back the same way
+    nbconvert does when a lexer is unavailable.
+
+    Parameters
+    ----------
+    language: str
+        Language name
+
+    Returns
+    -------
+    pygments.lexer.Lexer
+        Lexer shared by every caller in the process
+    """
+    if language == 'ipython2':
+        try:
+            from IPython.lib.lexers import IPythonLexer
+        except ImportError:
+            warnings.warn('IPython lexer unavailable, falling back on Python')
+            language = 'python'
+        else:
+            return IPythonLexer()
+    elif language == 'ipython3':
+        try:
+            from IPython.lib.lexers import IPython3Lexer
+        except ImportError:
+            warnings.warn('IPython3 lexer unavailable, falling back on Python 3')
+            language = 'python3'
+        else:
+            return IPython3Lexer()
+
+    from pygments.lexers import get_lexer_by_name
+    try:
+        return get_lexer_by_name(language, stripall=True)
+    except ClassNotFound:
+        warnings.warn('No lexer found for language %r. Treating as plain text.' % language)
+        from pygments.lexers.special import TextLexer
+        return TextLexer()
+
+
+@functools.lru_cache(maxsize=None)
+def get_formatter(cssclass):
+    """Gets the Pygments HTML formatter for a CSS class.
+
+    Parameters
+    ----------
+    cssclass: str
+        CSS class of the highlighted block
+
+    Returns
+    -------
+    pygments.formatters.HtmlFormatter
+        Formatter shared by every caller in the process
+    """
+    from pygments.formatters import HtmlFormatter
+    return HtmlFormatter(cssclass=cssclass)
+
+
+@functools.lru_cache(maxsize=None)
+def _lexer_versions():
+    """Gets the versions of the libraries whose lexers shape highlighted code."""
+    try:
+        import IPython
+    except ImportError:
+        return [pygments.__version__, None]
+    return [pygments.__version__, IPython.__version__]
+
+
+def sweep_cache(directory, max_age=MAX_AGE):
+    """Removes the highlighted cells that were last used longer ago than
+    max_age from a cache directory, unless it was swept within
+    SWEEP_INTERVAL.
+
+    Parameters
+    ----------
+    directory: str
+        Directory of persistent highlighted cells
+    max_age: float, optional
+        Seconds since the last use after which a cell is removed
+
+    Returns
+    -------
+    int
+        Number of files removed
+    """
+    marker = os.path.join(directory, '.swept')
+    now = time.time()
+    try:
+        if now - os.stat(marker).st_mtime < SWEEP_INTERVAL:
+            return 0
+    except FileNotFoundError:
+        if not os.path.isdir(directory):
+            return 0
+    except OSError:
+        return 0
+    try:
+        # Claims the sweep before it runs so that concurrent processes skip it
+        with open(marker, 'a'):
+            pass
+        os.utime(marker)
+    except OSError:
+        return 0
+
+    removed = 0
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            try:
+                if path != marker and now - os.stat(path).st_mtime > max_age:
+                    os.unlink(path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+class CachedHighlight2HTML(Highlight2HTML):
+    """Highlights code cells like nbconvert's Highlight2HTML, looking up each
+    lexer and formatter once per process and keeping the highlighted HTML
+    of every cell in a directory shared by all processes.
+
+    Cached HTML is keyed by the cell source, highlight language, formatter
+    options, and the Pygments and IPython versions. Every use of a cached
+    cell renews it, and cells unused for MAX_AGE seconds are swept from the
+    directory about once a day.
+
+    Parameters
+    ----------
+    pygments_lexer: str, optional
+        Default language of the notebook
+    cache_dir: str, optional
+        Root directory for persistent highlighted cells, or None to always
+        highlight
+    """
+    def __init__(self, pygments_lexer=None, cache_dir=None, **kwargs):
+        super(CachedHighlight2HTML, self).__init__(pygments_lexer=pygments_lexer, **kwargs)
+        self.directory = os.path.join(cache_dir, 'highlight') if cache_dir else None
+        if self.directory:
+            sweep_cache(self.directory)
+
+    def _path(self, source, language, cssclass):
+        key = json.dumps([source, language, cssclass] + _lexer_versions())
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.html')
+
+    def __call__(self, source, language=None, metadata=None):
+        """Gets the syntax highlighted HTML of a cell.
+
+        Parameters
+        ----------
+        source: str
+            Source of the cell to highlight
+        language: str, optional
+            Language to highlight the source as, or None for the notebook
+            language
+        metadata: dict, optional
+            Cell metadata
+
+        Returns
+        -------
+        str
+        """
+        if not language:
+            language = self.pygments_lexer
+        source = source if len(source) > 0 else ' '
+        # Help post processors like nbconvert does
+        cssclass = ' highlight hl-' + language
+        language = highlight_language(language, metadata)
+
+        path = self._path(source, language, cssclass) if self.directory else None
+        if path is not None:
+            try:
+                with open(path, 'rb') as f:
+                    html = f.read().decode('utf-8')
+            except OSError:
+                pass
+            else:
+                try:
+                    # Keeps the cell from being swept as unused
+                    os.utime(path)
+                except OSError:
+                    pass
+                return html
+
+        html = pygments.highlight(source, get_lexer(language), get_formatter(cssclass))
+        if path is not None:
+            try:
+                write_atomic(path, html.encode('utf-8'))
+            except OSError:
+                # A read-only or full cache directory only costs highlighting again next time
+                pass
+        return html
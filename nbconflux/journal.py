@@ -0,0 +1,135 @@
+"""On-disk journal of the operations a publish has completed, so that an
+interrupted publish can resume where it stopped.
+"""
+import hashlib
+import json
+import os
+
+
+def journal_path(directory, server, page_id):
+    """Gets the journal path for publishes to a page.
+
+    Parameters
+    ----------
+    directory: str
+        Root cache directory
+    server: str
+        Base URL of the Confluence server
+    page_id: int
+        Confluence page ID
+
+    Returns
+    -------
+    str
+    """
+    server_key = hashlib.sha256(server.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(directory, 'journals', '{}-{}.jsonl'.format(server_key, page_id))
+
+
+class PublishJournal:
+    """Appends one JSON line per completed operation of a publish to a file.
+
+    A journal left behind by a publish that did not complete tells the next
+    publish to the same page which operations it can skip. A publish that
+    completes removes its journal.
+
+    Parameters
+    ----------
+    path: str
+        Journal file path
+    resume: bool, optional
+        Keep the operations journaled by an earlier, interrupted publish
+        instead of starting an empty journal (default: False)
+    """
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.entries = self.load(path) if resume else []
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    @staticmethod
+    def load(path):
+        """Reads the operations in a journal file.
+
+        Parameters
+        ----------
+        path: str
+            Journal file path
+
+        Returns
+        -------
+        list
+            Journaled operations as dicts, or an empty list if there is no
+            journal
+        """
+        entries = []
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # A line cut short by the interruption
+                        break
+        except OSError:
+            pass
+        return entries
+
+    def record(self, op, **fields):
+        """Journals a completed operation.
+
+        Parameters
+        ----------
+        op: str
+            Operation name: page, label, or attachment
+        fields: dict
+            Operation details
+        """
+        entry = dict(fields, op=op)
+        self._file.write(json.dumps(entry, sort_keys=True) + '\n')
+        # Visible to the next publish even if this process dies right after
+        self._file.flush()
+        self.entries.append(entry)
+
+    def page(self):
+        """Gets the last journaled page write.
+
+        Returns
+        -------
+        dict
+            Page version and digest of the body written, or None
+        """
+        pages = [entry for entry in self.entries if entry['op'] == 'page']
+        return pages[-1] if pages else None
+
+    def labels(self):
+        """Gets the journaled labels.
+
+        Returns
+        -------
+        set
+        """
+        return {entry['name'] for entry in self.entries if entry['op'] == 'label'}
+
+    def attachments(self):
+        """Gets the journaled attachment uploads.
+
+        Returns
+        -------
+        dict
+            Content digest and version of each uploaded attachment by filename
+        """
+        return {entry['filename']: (entry['digest'], entry['version'])
+                for entry in self.entries if entry['op'] == 'attachment'}
+
+    def close(self, complete=False):
+        """Closes the journal.
+
+        Parameters
+        ----------
+        complete: bool, optional
+            Remove the journal because the publish completed (default: False)
+        """
+        self._file.close()
+        if complete:
+            os.unlink(self.path)
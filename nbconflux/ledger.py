@@ -0,0 +1,138 @@
+"""Ledger of what each page was last published from, so that publishing the
+same notebook bytes with the same options and libraries again can be
+skipped while nobody changes the page.
+"""
+import functools
+import glob
+import hashlib
+import json
+import os
+
+from .cache import write_atomic
+
+
+def ledger_path(directory, server, page_id):
+    """Gets the ledger entry path for publishes to a page.
+
+    Parameters
+    ----------
+    directory: str
+        Root cache directory
+    server: str
+        Base URL of the Confluence server
+    page_id: int
+        Confluence page ID
+
+    Returns
+    -------
+    str
+    """
+    server_key = hashlib.sha256(server.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(directory, 'ledger', '{}-{}.json'.format(server_key, page_id))
+
+
+@functools.lru_cache(maxsize=None)
+def library_versions():
+    """Gets the versions of the libraries and templates that shape a page.
+
+    Returns
+    -------
+    dict
+        nbconflux and nbconvert versions, and a digest of the nbconflux
+        templates
+    """
+    import nbconvert
+    from . import __version__
+
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__), '*.tpl'))):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return {'nbconflux': __version__, 'nbconvert': nbconvert.__version__,
+            'templates': digest.hexdigest()}
+
+
+def _describe(value):
+    """Names option values that are not JSON serializable, like filter
+    functions and preprocessor classes, the same way in every process.
+    """
+    if hasattr(value, '__qualname__'):
+        return '{}.{}'.format(getattr(value, '__module__', ''), value.__qualname__)
+    return type(value).__name__
+
+
+def fingerprint(data, options):
+    """Fingerprints a publish of a notebook.
+
+    Parameters
+    ----------
+    data: bytes or str
+        Notebook in the ipynb format
+    options: dict
+        Options that shape the page, by name
+
+    Returns
+    -------
+    str
+        Hex digest of the notebook, options, and library versions
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    digest = hashlib.sha256(json.dumps([library_versions(), options], sort_keys=True,
+                                       default=_describe).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class PublishLedger:
+    """Keeps the fingerprint of the last publish to each page and the page
+    version it left the page at, one file per page.
+
+    Parameters
+    ----------
+    directory: str
+        Root cache directory
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def lookup(self, server, page_id):
+        """Gets the last publish to a page.
+
+        Parameters
+        ----------
+        server: str
+            Base URL of the Confluence server
+        page_id: int
+            Confluence page ID
+
+        Returns
+        -------
+        dict
+            Fingerprint and page version, or None if the ledger has no
+            publish to the page
+        """
+        try:
+            with open(ledger_path(self.directory, server, page_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def record(self, server, page_id, fingerprint, version):
+        """Records a completed publish to a page.
+
+        Parameters
+        ----------
+        server: str
+            Base URL of the Confluence server
+        page_id: int
+            Confluence page ID
+        fingerprint: str
+            Fingerprint of the publish
+        version: int
+            Page version after the publish
+        """
+        entry = {'fingerprint': fingerprint, 'version': version}
+        write_atomic(ledger_path(self.directory, server, page_id),
+                     json.dumps(entry).encode('utf-8'))
@@ -0,0 +1,217 @@
+"""Request, byte, latency, and retry metrics for Confluence API traffic."""
+import json
+import re
+import threading
+import urllib.parse as urlparse
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+# Path segments that identify a single page, attachment, or file
+ID_SEGMENT_REGEX = re.compile(r'^\d+$')
+
+
+class RequestBudgetExceeded(RuntimeError):
+    """Raised when a publish tries to make more requests than its budget."""
+
+
+def endpoint(url):
+    """Groups a request URL with every other URL for the same API endpoint.
+
+    Parameters
+    ----------
+    url: str
+        Request URL
+
+    Returns
+    -------
+    str
+        URL path with IDs and attachment filenames replaced by placeholders,
+        and without the server or query string
+    """
+    segs = urlparse.urlparse(url).path.split('/')
+    segs = ['{id}' if ID_SEGMENT_REGEX.match(seg) else seg for seg in segs]
+    if 'download' in segs and len(segs) > 1:
+        # /download/attachments/{id}/<filename>
+        segs[-1] = '{filename}'
+    return '/'.join(segs)
+
+
+def _format_labels(**labels):
+    return ','.join('{}="{}"'.format(key, str(value).replace('"', '\\"'))
+                    for key, value in sorted(labels.items()))
+
+
+class RequestMetrics:
+    """Counts requests by endpoint and status, latency distribution, bytes
+    sent and received, and retries.
+
+    Parameters
+    ----------
+    budget: int, optional
+        Maximum number of requests allowed, or 0 for no limit (default: 0)
+    """
+    def __init__(self, budget=0):
+        self.budget = budget
+        self.requests = {}
+        self.latency = {}
+        self.bytes_out = {}
+        self.bytes_in = {}
+        self.retries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def total_requests(self):
+        """Number of requests made so far, including retries."""
+        return sum(self.requests.values())
+
+    def check_budget(self, method, url):
+        """Raises RequestBudgetExceeded if one more request would exceed the
+        budget.
+
+        Parameters
+        ----------
+        method: str
+            HTTP method of the request about to be made
+        url: str
+            URL of the request about to be made
+        """
+        if self.budget and self.total_requests >= self.budget:
+            raise RequestBudgetExceeded('Request budget of {} exhausted before {} {}'
+                                        .format(self.budget, method, endpoint(url)))
+
+    def observe(self, method, url, status, seconds, bytes_out=0, bytes_in=0):
+        """Records a completed request.
+
+        Parameters
+        ----------
+        method: str
+            HTTP method
+        url: str
+            Request URL
+        status: int
+            Response status code, or 0 when no response arrived
+        seconds: float
+            Time from sending the request to receiving the response
+        bytes_out: int, optional
+            Size of the request body
+        bytes_in: int, optional
+            Size of the response body
+        """
+        key = (method, endpoint(url))
+        with self._lock:
+            self.requests[key + (status,)] = self.requests.get(key + (status,), 0) + 1
+            histogram = self.latency.setdefault(key, {'buckets': [0] * len(LATENCY_BUCKETS),
+                                                      'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+            self.bytes_out[key] = self.bytes_out.get(key, 0) + bytes_out
+            self.bytes_in[key] = self.bytes_in.get(key, 0) + bytes_in
+
+    def retry(self, method, url):
+        """Records a retried request.
+
+        Parameters
+        ----------
+        method: str
+            HTTP method
+        url: str
+            Request URL
+        """
+        key = (method, endpoint(url))
+        with self._lock:
+            self.retries[key] = self.retries.get(key, 0) + 1
+
+    def to_dict(self):
+        """Gets the metrics as JSON serializable data.
+
+        Returns
+        -------
+        dict
+            One entry per endpoint with its counters and latency histogram
+        """
+        endpoints = {}
+        for (method, path, status), count in self.requests.items():
+            entry = endpoints.setdefault((method, path), {'method': method, 'endpoint': path,
+                                                          'status': {}})
+            entry['status'][str(status)] = count
+        for key, entry in endpoints.items():
+            histogram = self.latency[key]
+            entry['latency'] = {
+                'buckets': {str(bound): count
+                            for bound, count in zip(LATENCY_BUCKETS, histogram['buckets'])},
+                'sum': histogram['sum'],
+                'count': histogram['count'],
+            }
+            entry['bytes_out'] = self.bytes_out.get(key, 0)
+            entry['bytes_in'] = self.bytes_in.get(key, 0)
+            entry['retries'] = self.retries.get(key, 0)
+        return {
+            'total_requests': self.total_requests,
+            'bytes_out': sum(self.bytes_out.values()),
+            'bytes_in': sum(self.bytes_in.values()),
+            'retries': sum(self.retries.values()),
+            'endpoints': sorted(endpoints.values(),
+                                key=lambda entry: (entry['endpoint'], entry['method'])),
+        }
+
+    def to_prometheus(self):
+        """Gets the metrics in the Prometheus text exposition format.
+
+        Returns
+        -------
+        str
+        """
+        lines = [
+            '# HELP nbconflux_requests_total Confluence API requests by endpoint and status.',
+            '# TYPE nbconflux_requests_total counter',
+        ]
+        for (method, path, status), count in sorted(self.requests.items()):
+            lines.append('nbconflux_requests_total{{{}}} {}'.format(
+                _format_labels(method=method, endpoint=path, status=status), count))
+
+        lines += [
+            '# HELP nbconflux_request_duration_seconds Confluence API request latency.',
+            '# TYPE nbconflux_request_duration_seconds histogram',
+        ]
+        for (method, path), histogram in sorted(self.latency.items()):
+            for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('nbconflux_request_duration_seconds_bucket{{{}}} {}'.format(
+                    _format_labels(method=method, endpoint=path, le=le), count))
+            labels = _format_labels(method=method, endpoint=path)
+            lines.append('nbconflux_request_duration_seconds_sum{{{}}} {}'.format(
+                labels, histogram['sum']))
+            lines.append('nbconflux_request_duration_seconds_count{{{}}} {}'.format(
+                labels, histogram['count']))
+
+        for name, values, help_text in (
+                ('nbconflux_request_bytes_total', self.bytes_out,
+                 'Bytes sent in Confluence API request bodies.'),
+                ('nbconflux_response_bytes_total', self.bytes_in,
+                 'Bytes received in Confluence API response bodies.'),
+                ('nbconflux_retries_total', self.retries, 'Retried Confluence API requests.')):
+            lines += ['# HELP {} {}'.format(name, help_text), '# TYPE {} counter'.format(name)]
+            for (method, path), value in sorted(values.items()):
+                lines.append('{}{{{}}} {}'.format(
+                    name, _format_labels(method=method, endpoint=path), value))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, prometheus=False):
+        """Writes the metrics to a file as JSON or Prometheus text.
+
+        Parameters
+        ----------
+        path: str
+            Destination path
+        prometheus: bool, optional
+            Write the Prometheus text format instead of JSON (default: False)
+        """
+        with open(path, 'w') as f:
+            if prometheus:
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=2)
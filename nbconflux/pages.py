@@ -0,0 +1,155 @@
+"""Looks up and creates Confluence pages with the credentials and request
+method of an exporter.
+"""
+
+# Titles looked up per CQL query, few enough to keep the query URL short
+TITLES_PER_QUERY = 50
+
+
+class PageTitleConflict(ValueError):
+    """Raised when a page to publish has the title of a page elsewhere in the
+    space, which Confluence does not allow twice in a space.
+    """
+
+
+def cql_string(value):
+    """Quotes a value for use as a string in a CQL query."""
+    return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def page_url(server, page_id):
+    """Gets the URL of a page by ID."""
+    return '{server}/pages/viewpage.action?pageId={page_id}'.format(server=server, page_id=page_id)
+
+
+def get_page(exporter, page_id):
+    """Gets the title and space key of a page.
+
+    Parameters
+    ----------
+    exporter: nbconflux.exporter.ConfluenceExporter
+        Exporter whose server, credentials, and request method to use
+    page_id: int
+        Confluence page ID
+
+    Returns
+    -------
+    2-tuple of str
+        Page title and space key
+    """
+    resp = exporter.request('GET', '{server}/rest/api/content/{page_id}'
+                            .format(server=exporter.server, page_id=page_id),
+                            params={'expand': 'space'})
+    resp.raise_for_status()
+    content = resp.json()
+    return content['title'], content['space']['key']
+
+
+def find_pages(exporter, space, titles):
+    """Looks up the IDs and parents of existing pages by title with a few bulk
+    CQL queries.
+
+    Parameters
+    ----------
+    exporter: nbconflux.exporter.ConfluenceExporter
+        Exporter whose server, credentials, and request method to use
+    space: str
+        Space key
+    titles: list
+        Page titles
+
+    Returns
+    -------
+    dict
+        Page ID and parent page ID 2-tuples by title, for the titles of pages
+        that exist, with a parent of None for pages at the top of the space
+    """
+    titles = list(titles)
+    found = {}
+    for i in range(0, len(titles), TITLES_PER_QUERY):
+        chunk = titles[i:i + TITLES_PER_QUERY]
+        cql = 'space = {} and type = page and title in ({})'.format(
+            cql_string(space), ', '.join(cql_string(title) for title in chunk))
+        url = '{server}/rest/api/content/search'.format(server=exporter.server)
+        params = {'cql': cql, 'limit': len(chunk), 'expand': 'ancestors'}
+        while url:
+            resp = exporter.request('GET', url, params=params)
+            resp.raise_for_status()
+            page = resp.json()
+            for result in page['results']:
+                # Ancestors run from the top of the space down to the parent
+                ancestors = result.get('ancestors') or []
+                parent_id = int(ancestors[-1]['id']) if ancestors else None
+                found[result['title']] = (int(result['id']), parent_id)
+            # The next link carries the query parameters along with the path
+            path = page.get('_links', {}).get('next')
+            url = '{server}{path}'.format(server=exporter.server, path=path) if path else None
+            params = None
+    return found
+
+
+def existing_page(found, title, parent_id):
+    """Gets the ID of the page to reuse for a title under a parent page.
+
+    Parameters
+    ----------
+    found: dict
+        Pages found by find_pages
+    title: str
+        Page title
+    parent_id: int
+        ID of the parent page, or None if the parent page does not exist yet
+
+    Returns
+    -------
+    int
+        ID of the existing page, or None if no page has the title
+
+    Raises
+    ------
+    PageTitleConflict
+        If a page with the title exists under another parent
+    """
+    if title not in found:
+        return None
+    page_id, found_parent_id = found[title]
+    if parent_id is None or found_parent_id != int(parent_id):
+        raise PageTitleConflict('Page {} titled {} exists elsewhere in the space'
+                                .format(page_id, title))
+    return page_id
+
+
+def create_page(exporter, space, title, parent_id):
+    """Creates an empty page under a parent page.
+
+    Parameters
+    ----------
+    exporter: nbconflux.exporter.ConfluenceExporter
+        Exporter whose server, credentials, and request method to use
+    space: str
+        Space key
+    title: str
+        Page title
+    parent_id: int
+        ID of the parent page
+
+    Returns
+    -------
+    int
+        ID of the new page
+    """
+    resp = exporter.request('POST', '{server}/rest/api/content'.format(server=exporter.server),
+                            json={
+                                'type': 'page',
+                                'title': title,
+                                'space': {'key': space},
+                                'ancestors': [{'id': parent_id}],
+                                'body': {
+                                    'storage': {
+                                        'representation': 'storage',
+                                        'value': ''
+                                    }
+                                }
+                            })
+    resp.raise_for_status()
+    return int(resp.json()['id'])
@@ -0,0 +1,126 @@
+"""Encodes the JSON payloads of Confluence API requests, piece by piece for
+documents carrying a large text value such as a page body.
+
+Uses orjson when it is installed, and the json module otherwise.
+"""
+import hashlib
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Characters of a large text value escaped and encoded at a time
+CHUNK_CHARS = 1 << 20
+
+# Stands in for the large text value while encoding the rest of the document
+TEXT = '\x00nbconflux-text\x00'
+
+
+def dumps(value):
+    """Encodes a value as JSON.
+
+    Parameters
+    ----------
+    value: object
+        JSON serializable value
+
+    Returns
+    -------
+    bytes
+        UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value).encode('utf-8')
+
+
+def iter_utf8(text, chunk_chars=CHUNK_CHARS):
+    """Encodes text as UTF-8 a slice at a time.
+
+    Parameters
+    ----------
+    text: str
+        Text to encode
+    chunk_chars: int, optional
+        Characters per slice
+
+    Yields
+    ------
+    bytes
+    """
+    for start in range(0, len(text), chunk_chars):
+        yield text[start:start + chunk_chars].encode('utf-8')
+
+
+def text_digest(text):
+    """Gets the SHA-256 hex digest of the UTF-8 encoding of text without
+    encoding it whole.
+
+    Parameters
+    ----------
+    text: str
+        Text to hash
+
+    Returns
+    -------
+    str
+    """
+    digest = hashlib.sha256()
+    for chunk in iter_utf8(text):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _escape(chunk):
+    """Encodes a slice of a JSON string value without its quotes."""
+    if orjson is not None:
+        return orjson.dumps(chunk)[1:-1]
+    return json.dumps(chunk, ensure_ascii=False)[1:-1].encode('utf-8')
+
+
+class JSONTextStream:
+    """JSON document with one large text value, encoded a slice of the text
+    at a time as it is sent.
+
+    Iterating yields the encoded document in chunks and can start over, so
+    that a retried request sends the whole document again. Requests sends
+    iterable bodies with chunked transfer encoding.
+
+    Parameters
+    ----------
+    document: dict
+        JSON serializable document holding TEXT in place of the text value
+    text: str
+        Text value
+    chunk_chars: int, optional
+        Characters of the text encoded per chunk
+
+    Attributes
+    ----------
+    size: int
+        Bytes yielded by the last iteration
+    """
+    def __init__(self, document, text, chunk_chars=CHUNK_CHARS):
+        encoded = dumps(document)
+        head, placeholder, tail = encoded.partition(dumps(TEXT))
+        if not placeholder:
+            raise ValueError('document does not hold the TEXT placeholder')
+        self.head = head + b'"'
+        self.tail = b'"' + tail
+        self.text = text
+        self.chunk_chars = chunk_chars
+        self.size = 0
+
+    def __iter__(self):
+        self.size = 0
+        for chunk in self._chunks():
+            self.size += len(chunk)
+            yield chunk
+
+    def _chunks(self):
+        yield self.head
+        for start in range(0, len(self.text), self.chunk_chars):
+            yield _escape(self.text[start:start + self.chunk_chars])
+        yield self.tail
@@ -1,11 +1,12 @@
 """Confluence page preprocessor that handles image and notebook
 attachment versioning.
 """
+import hashlib
+import json
 import os
 
 from collections import namedtuple
-
-import requests
+from concurrent.futures import ThreadPoolExecutor
 
 from nbconvert.preprocessors import Preprocessor
 from traitlets import Instance, Any
@@ -13,6 +14,194 @@ from traitlets import Instance, Any
 
 Attachment = namedtuple('Attachment', 'id version download_url upload_url')
 
+# Attachments requested per listing request. Servers may cap it lower.
+ATTACHMENT_PAGE_SIZE = 1000
+
+# Most attachments the auto lookup strategy looks up by filename, once the
+# attachments do not fit a single listing request, before listing them all
+MAX_FILENAME_LOOKUPS = 64
+
+
+def content_address(data, unique_key='output', extension=''):
+    """Builds an attachment filename from a short digest of its content.
+
+    Parameters
+    ----------
+    data: bytes
+        Attachment content
+    unique_key: str, optional
+        Filename prefix (default: output)
+    extension: str, optional
+        Filename extension including the leading dot
+
+    Returns
+    -------
+    str
+        Filename that only changes when the content changes
+    """
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    return '{unique_key}_{digest}{extension}'.format(unique_key=unique_key, digest=digest,
+                                                     extension=extension)
+
+
+def _data_size(value):
+    """Gets the approximate serialized size of a MIME bundle value."""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, list) and all(isinstance(line, str) for line in value):
+        return sum(len(line) for line in value)
+    return len(json.dumps(value))
+
+
+class StripUnrenderablePreprocessor(Preprocessor):
+    """Drops notebook data the page template never renders, so that the
+    preprocessors and copies that follow handle less of it.
+
+    The template renders only the first MIME type of each output in the
+    display priority. Every other MIME type in the output bundle, its output
+    metadata, and the widget state in the notebook metadata are removed.
+
+    Attributes
+    ----------
+    exporter: ConfluenceExporter
+        Exporter with the report to record removed data in
+    """
+    exporter = Instance(klass='nbconflux.exporter.ConfluenceExporter', config=True, allow_none=True)
+
+    def preprocess(self, nb, resources):
+        """Removes the unrenderable output bundles and widget state.
+
+        Parameters
+        ----------
+        nb: nbformat.notebooknode.NotebookNode
+            Root of a notebook
+        resources: dict
+            Additional nbconvert resources
+
+        Returns
+        -------
+        2-tuple
+            Modified nb and resources per the nbconvert Preprocessor API
+            contract
+        """
+        removed = {}
+        widgets = nb.metadata.pop('widgets', None)
+        if widgets is not None:
+            removed['metadata.widgets'] = [_data_size(widgets)]
+
+        for cell in nb.cells:
+            for output in cell.get('outputs', []):
+                data = output.get('data')
+                if not data:
+                    continue
+                shown = next((mime_type for mime_type in self.display_data_priority
+                              if mime_type in data), None)
+                for mime_type in [mime_type for mime_type in data if mime_type != shown]:
+                    removed.setdefault(mime_type, []).append(_data_size(data.pop(mime_type)))
+                    output.get('metadata', {}).pop(mime_type, None)
+
+        if self.exporter is not None:
+            for name, sizes in removed.items():
+                for size in sizes:
+                    self.exporter.report.strip(name, size)
+        return nb, resources
+
+
+def collapse_overwrites(text):
+    """Applies the backspaces and carriage returns in stream text, leaving
+    only the text that Jupyter shows for it.
+
+    A backspace erases the character before it and a carriage return starts
+    overwriting its line from the first column, like progress bars expect.
+
+    Parameters
+    ----------
+    text: str
+        Stream output text
+
+    Returns
+    -------
+    str
+    """
+    if '\r' not in text and '\b' not in text:
+        return text
+    lines = []
+    for line in text.split('\n'):
+        if '\b' in line:
+            chars = []
+            for char in line:
+                if char == '\b' and chars:
+                    chars.pop()
+                else:
+                    chars.append(char)
+            line = ''.join(chars)
+        if '\r' in line:
+            segments = line.split('\r')
+            line = segments[0]
+            for segment in segments[1:]:
+                line = segment + line[len(segment):]
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+class CoalesceStreamsPreprocessor(Preprocessor):
+    """Merges consecutive stream outputs of a cell that write to the same
+    stream and collapses the text they overwrite, so that a cell printing
+    thousands of progress bar updates renders as the final progress bar.
+
+    Attributes
+    ----------
+    exporter: ConfluenceExporter
+        Exporter with the report to record removed text in
+    """
+    exporter = Instance(klass='nbconflux.exporter.ConfluenceExporter', config=True, allow_none=True)
+
+    def preprocess_cell(self, cell, resources, index):
+        """Merges and collapses the stream outputs of a cell.
+
+        Parameters
+        ----------
+        cell: nbformat.notebooknode.NotebookNode
+            Notebook cell
+        resources: dict
+            Additional nbconvert resources
+        index: int
+            Cell index
+
+        Returns
+        -------
+        2-tuple
+            Modified cell and resources per the nbconvert Preprocessor API
+            contract
+        """
+        outputs = cell.get('outputs')
+        if not outputs:
+            return cell, resources
+
+        merged = []
+        texts = []
+        for output in outputs:
+            if (output.output_type == 'stream' and merged and merged[-1].output_type == 'stream'
+                    and merged[-1].name == output.name):
+                # Joined once per run of outputs, since appending to the text one output at a
+                # time copies it over and over
+                texts[-1].append(output.text)
+            else:
+                merged.append(output)
+                texts.append([output.text] if output.output_type == 'stream' else None)
+
+        removed = 0
+        for output, pieces in zip(merged, texts):
+            if pieces is not None:
+                text = ''.join(pieces)
+                output.text = collapse_overwrites(text)
+                removed += len(text) - len(output.text)
+        if len(merged) < len(outputs) or removed:
+            cell.outputs = merged
+            if self.exporter is not None:
+                self.exporter.report.strip('stream', removed)
+        return cell, resources
+
 
 class ConfluencePreprocessor(Preprocessor):
     """Builds absolute URLs to versioned page attachments for use
@@ -26,6 +215,194 @@ class ConfluencePreprocessor(Preprocessor):
     """
     exporter = Instance(klass='nbconflux.exporter.ConfluenceExporter', config=True)
 
+    def rename_outputs(self, nb, resources):
+        """Renames the outputs extracted by ExtractOutputPreprocessor after
+        a digest of their content instead of their cell and output indices.
+
+        Identical outputs collapse into a single entry in resources['outputs'],
+        and the output metadata in the notebook is rewritten to point to the
+        new filenames so that the page template resolves them through
+        resources['attachments'] as usual.
+
+        Parameters
+        ----------
+        nb: nbformat.notebooknode.NotebookNode
+            Root of a notebook
+        resources: dict
+            Additional nbconvert resources
+        """
+        outputs = resources.get('outputs', {})
+        unique_key = resources.get('unique_key', 'output')
+        renamed = {}
+        for filename, data in outputs.items():
+            extension = os.path.splitext(filename)[1]
+            renamed[filename] = content_address(data, unique_key, extension)
+
+        for cell in nb.cells:
+            for output in cell.get('outputs', []):
+                filenames = output.get('metadata', {}).get('filenames', {})
+                for mime_type, filename in filenames.items():
+                    if filename in renamed:
+                        filenames[mime_type] = renamed[filename]
+
+        resources['outputs'] = {renamed[filename]: data for filename, data in outputs.items()}
+
+    def list_attachments(self, filenames=()):
+        """Gets the names and versions of the attachments on the page.
+
+        The exporter attachment_lookup option picks how:
+
+        * list: lists every attachment on the page, fetching the listing pages
+          after the first one concurrently
+        * filename: looks up each of the given filenames concurrently
+        * auto: lists the first page of attachments, and when there are more,
+          looks up the remaining filenames one by one if there are at most
+          MAX_FILENAME_LOOKUPS of them or lists the rest otherwise
+
+        Parameters
+        ----------
+        filenames: iterable, optional
+            Names of the attachments the publish needs
+
+        Returns
+        -------
+        dict
+            Attachment instances without URLs keyed by attachment filename,
+            including at least the given filenames that exist on the page
+
+        Note
+        ----
+        When the exporter reuses its attachment index, only the first call for
+        a page queries the Confluence API, listing every attachment. Later calls
+        return the index the exporter kept up to date as it uploaded
+        attachments.
+        """
+        reuse = self.exporter.reuse_attachment_index
+        if reuse and self.exporter.page_id in self.exporter.attachment_index:
+            return dict(self.exporter.attachment_index[self.exporter.page_id])
+
+        # The index must know every attachment to serve later publishes
+        strategy = 'list' if reuse else self.exporter.attachment_lookup
+        filenames = set(filenames)
+        if strategy == 'filename':
+            attachments = self.find_attachments(filenames)
+        else:
+            attachments, count, more = self.list_attachment_page(0)
+            missing = filenames - set(attachments)
+            if more and strategy == 'auto' and len(missing) <= MAX_FILENAME_LOOKUPS:
+                attachments.update(self.find_attachments(missing))
+            elif more:
+                attachments.update(self.list_remaining_attachments(count))
+
+        if reuse:
+            self.exporter.attachment_index[self.exporter.page_id] = dict(attachments)
+        return attachments
+
+    def list_attachment_page(self, start):
+        """Gets one page of the attachment listing.
+
+        Parameters
+        ----------
+        start: int
+            Offset of the first attachment in the listing
+
+        Returns
+        -------
+        3-tuple of dict, int, bool
+            Attachment instances without URLs keyed by attachment filename,
+            number of attachments in the page, and whether more pages follow
+        """
+        url = ('{server}/rest/api/content/{page_id}/child/attachment?expand=version&limit={limit}'
+               .format(server=self.exporter.server, page_id=self.exporter.page_id,
+                       limit=ATTACHMENT_PAGE_SIZE))
+        if start:
+            url += '&start={}'.format(start)
+        resp = self.exporter.request('GET', url)
+        resp.raise_for_status()
+        page = resp.json()
+        # Build a map from attachment filename to attachment ID and attachment version
+        attachments = {result['title']: Attachment(result['id'], result['version']['number'],
+                                                   None, None)
+                       for result in page['results']}
+        more = bool(page['results']) and 'next' in page.get('_links', {})
+        return attachments, len(page['results']), more
+
+    def list_remaining_attachments(self, step):
+        """Lists the attachments after the first page of the listing, fetching
+        several pages at once.
+
+        Parameters
+        ----------
+        step: int
+            Number of attachments in the first page, which is the page size the
+            server honors
+
+        Returns
+        -------
+        dict
+            Attachment instances without URLs keyed by attachment filename
+        """
+        attachments = {}
+        workers = self.exporter.attachment_lookup_workers
+        start = step
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                pages = list(pool.map(self.list_attachment_page,
+                                      [start + i * step for i in range(workers)]))
+                for page, _, _ in pages:
+                    attachments.update(page)
+                # Stop after the first wave that reaches the end of the listing
+                if not all(more and count == step for _, count, more in pages):
+                    return attachments
+                start += workers * step
+
+    def find_attachments(self, filenames):
+        """Looks up attachments on the page by filename, several at once.
+
+        Parameters
+        ----------
+        filenames: iterable
+            Attachment filenames
+
+        Returns
+        -------
+        dict
+            Attachment instances without URLs keyed by attachment filename,
+            for the filenames that exist on the page
+        """
+        filenames = sorted(filenames)
+        if not filenames:
+            return {}
+        workers = min(len(filenames), self.exporter.attachment_lookup_workers)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            found = pool.map(self.find_attachment, filenames)
+            return {attachment_filename: attachment
+                    for attachment_filename, attachment in zip(filenames, found)
+                    if attachment is not None}
+
+    def find_attachment(self, filename):
+        """Looks up a single attachment on the page by filename.
+
+        Parameters
+        ----------
+        filename: str
+            Attachment filename
+
+        Returns
+        -------
+        Attachment
+            Attachment without URLs, or None if the page has no attachment
+            with the filename
+        """
+        url = ('{server}/rest/api/content/{page_id}/child/attachment'
+               .format(server=self.exporter.server, page_id=self.exporter.page_id))
+        resp = self.exporter.request('GET', url, params={'filename': filename, 'expand': 'version'})
+        resp.raise_for_status()
+        for result in resp.json()['results']:
+            if result['title'] == filename:
+                return Attachment(result['id'], result['version']['number'], None, None)
+        return None
+
     def preprocess(self, nb, resources):
         """Adds Attachment instances under resources['attachments']
         for every notebook output extracted by ExtractOutputPreprocessor
@@ -50,36 +427,30 @@ class ConfluencePreprocessor(Preprocessor):
 
         Note
         ----
-        Uses the Confluence API to page through all attachments on the page in
-        order to fetch their names and versions. This information is necessary
-        to retain stable page-to-attachment version links in the page history.
+        Uses the Confluence API to fetch the names and versions of the
+        attachments the notebook needs. This information is necessary to retain
+        stable page-to-attachment version links in the page history.
+
+        Outputs that already exist on the page with the same bytes link to the
+        existing attachment version and get no upload URL.
         """
-        # Get the attachments on the page, following ._links.next URLs until we know all attachment
-        # names and versions.
-        path = ('/rest/api/content/{page_id}/child/attachment?expand=version'
-                .format(page_id=self.exporter.page_id))
-        resources['attachments'] = {}
-        while path:
-            url = '{server}{path}'.format(server=self.exporter.server, path=path)
-            resp = requests.get(url, auth=(self.exporter.username, self.exporter.password))
-            resp.raise_for_status()
-            attachments = resp.json()
-            # Build a map from attachment filename to attachment ID and attachment version
-            resources['attachments'].update(
-                {result['title']: Attachment(result['id'], result['version']['number'], None, None)
-                 for result in attachments['results']}
-            )
-            # Try to fetch the path (unfortunately, not full URL) of the next page of links
-            path = attachments.get('_links', {}).get('next')
+        # Name outputs after their content so that unchanged images keep their names
+        if self.exporter.content_addressed_attachments:
+            self.rename_outputs(nb, resources)
 
         # Notebook extreacted files to be attached to the page
         to_be_attached = dict(resources.get('outputs', {}))
+        content_addressed = set()
+        if self.exporter.content_addressed_attachments:
+            content_addressed = set(to_be_attached)
 
         # consider the notebook itself an attachment that needs to be versioned
         if self.exporter.attach_ipynb:
-            notebook_filename = os.path.basename(self.exporter.notebook_filename)
-            to_be_attached[notebook_filename] = None
-            resources['notebook_filename'] = notebook_filename
+            to_be_attached[self.exporter.notebook_name] = None
+            resources['notebook_filename'] = self.exporter.notebook_name
+
+        with self.exporter.report.phase('list_attachments'):
+            resources['attachments'] = self.list_attachments(to_be_attached)
 
         for filename in to_be_attached:
             try:
@@ -96,10 +467,34 @@ class ConfluencePreprocessor(Preprocessor):
                               .format(server=self.exporter.server, page_id=self.exporter.page_id,
                                       attachment_id=attachment_id))
 
+            if attachment_id is None:
+                unchanged = False
+            elif filename in content_addressed:
+                # A content addressed attachment with the same name already holds the same bytes
+                unchanged = True
+            else:
+                # This exporter uploaded the same bytes as the current version before
+                data = to_be_attached[filename]
+                uploaded = self.exporter.attachment_digests.get((self.exporter.page_id, filename))
+                if data is None and uploaded is not None and self.exporter.resume:
+                    # The notebook itself, which an interrupted publish may have uploaded
+                    # already, encoded the same way it is uploaded
+                    data = self.exporter.notebook_data
+                    if isinstance(data, str):
+                        data = data.encode('utf-8')
+                unchanged = (data is not None and uploaded is not None and
+                             uploaded == (hashlib.sha256(data).hexdigest(), attachment_version))
+
+            next_version = attachment_version + 1
+            if unchanged:
+                # Link to the existing version and skip the upload
+                next_version = attachment_version
+                upload_url = None
+
             # Populate the download url template
             download_url = ('{server}/download/attachments/{page_id}/{filename}?version={version}'
                             .format(server=self.exporter.server, page_id=self.exporter.page_id,
-                                    filename=filename, version=attachment_version+1))
+                                    filename=filename, version=next_version))
 
             # Keep the URL in the resources for later lookup in the page template
             resources['attachments'][filename] = Attachment(attachment_id, attachment_version, download_url, upload_url)
@@ -0,0 +1,261 @@
+"""Finds and deletes the output attachments that earlier publishes left on a
+page and that no recent version of the page references anymore.
+"""
+import datetime
+import html
+import re
+import urllib.parse as urlparse
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Attachments nbconflux names after cell outputs, by cell position or content
+# digest, after a prefix
+OUTPUT_ATTACHMENT_PATTERN = r'^{}_(\d+_\d+|[0-9a-f]{{16}})\.[A-Za-z0-9]+$'
+
+# Attachment references in storage format bodies
+DOWNLOAD_URL_REGEX = re.compile(r'/download/attachments/\d+/([^?"\'<>\s]+)')
+ATTACHMENT_MACRO_REGEX = re.compile(r'ri:filename="([^"]+)"')
+
+
+def parse_when(when):
+    """Parses a Confluence API timestamp.
+
+    Parameters
+    ----------
+    when: str
+        ISO 8601 timestamp, like 2018-01-31T12:00:00.000Z
+
+    Returns
+    -------
+    datetime.datetime
+        Timezone aware timestamp
+    """
+    when = re.sub(r'Z$', '+0000', when)
+    # Drop the colon from the UTC offset, which %z does not accept before Python 3.7
+    when = re.sub(r'([+-]\d\d):(\d\d)$', r'\1\2', when)
+    fmt = '%Y-%m-%dT%H:%M:%S.%f%z' if '.' in when else '%Y-%m-%dT%H:%M:%S%z'
+    return datetime.datetime.strptime(when, fmt)
+
+
+def output_attachment_regex(unique_key='output'):
+    """Gets the regex that matches the output attachment filenames with a
+    prefix.
+
+    Parameters
+    ----------
+    unique_key: str, optional
+        Prefix of the output attachment filenames (default: output)
+
+    Returns
+    -------
+    re.Pattern
+    """
+    return re.compile(OUTPUT_ATTACHMENT_PATTERN.format(re.escape(unique_key)))
+
+
+def referenced_attachments(body):
+    """Gets the filenames of the attachments a page body links to or embeds.
+
+    Parameters
+    ----------
+    body: str
+        Confluence storage format content
+
+    Returns
+    -------
+    set
+    """
+    body = html.unescape(body)
+    filenames = {urlparse.unquote(name) for name in DOWNLOAD_URL_REGEX.findall(body)}
+    filenames.update(ATTACHMENT_MACRO_REGEX.findall(body))
+    return filenames
+
+
+class AttachmentPruner:
+    """Deletes orphaned output attachments from a page.
+
+    An output attachment is orphaned when neither the current page body nor
+    any page version within the retention window references it, and it was
+    last uploaded before the window. Only attachments named like nbconflux
+    cell outputs are ever considered.
+
+    Parameters
+    ----------
+    exporter: nbconflux.exporter.ConfluenceExporter
+        Exporter whose server, credentials, and request method to use
+    retention_days: int, optional
+        Days of page history whose attachments are kept (default: 30)
+    max_workers: int, optional
+        Maximum number of requests made at the same time (default: 8)
+    now: datetime.datetime, optional
+        Current time, for tests
+    unique_key: str, optional
+        Prefix of the output attachment filenames (default: output)
+    """
+    def __init__(self, exporter, retention_days=30, max_workers=8, now=None, unique_key='output'):
+        self.exporter = exporter
+        self.output_regex = output_attachment_regex(unique_key)
+        self.retention_days = retention_days
+        self.max_workers = max_workers
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        self.cutoff = now - datetime.timedelta(days=retention_days)
+
+    def content_url(self, page_id, path=''):
+        """Gets the API URL of a page, or of a resource under it."""
+        return '{server}/rest/api/content/{page_id}{path}'.format(server=self.exporter.server,
+                                                                  page_id=page_id, path=path)
+
+    def get_all(self, url, params):
+        """Gets every result of a paged API listing.
+
+        Returns
+        -------
+        list
+        """
+        results = []
+        while url:
+            resp = self.exporter.request('GET', url, params=params)
+            resp.raise_for_status()
+            page = resp.json()
+            results.extend(page['results'])
+            # The next link carries the query parameters along with the path
+            path = page.get('_links', {}).get('next')
+            url = '{server}{path}'.format(server=self.exporter.server, path=path) if path else None
+            params = None
+        return results
+
+    def page_body(self, page_id, version=None):
+        """Gets the storage format body of the current or a historical
+        version of a page.
+
+        Returns
+        -------
+        str
+        """
+        params = {'expand': 'body.storage'}
+        if version is not None:
+            params.update(status='historical', version=version)
+        resp = self.exporter.request('GET', self.content_url(page_id), params=params)
+        resp.raise_for_status()
+        return resp.json()['body']['storage']['value']
+
+    def retained_versions(self, page_id):
+        """Gets the page versions within the retention window, plus the last
+        version before it, which the page showed when the window opened.
+
+        Returns
+        -------
+        list
+            Version numbers
+        """
+        try:
+            versions = self.get_all(self.content_url(page_id, '/version'), {'limit': 200})
+        except requests.HTTPError as ex:
+            # Older Confluence Server versions have no version listing
+            if ex.response is None or ex.response.status_code != 404:
+                raise
+            return self.walk_versions(page_id)
+        versions = sorted(versions, key=lambda version: version['number'])
+        retained = [version['number'] for version in versions
+                    if parse_when(version['when']) >= self.cutoff]
+        older = [version['number'] for version in versions
+                 if parse_when(version['when']) < self.cutoff]
+        return older[-1:] + retained
+
+    def version_info(self, page_id, version=None):
+        """Gets the number and timestamp of the current or a historical
+        version of a page.
+
+        Returns
+        -------
+        dict
+        """
+        params = {'expand': 'version'}
+        if version is not None:
+            params.update(status='historical', version=version)
+        resp = self.exporter.request('GET', self.content_url(page_id), params=params)
+        resp.raise_for_status()
+        return resp.json()['version']
+
+    def walk_versions(self, page_id):
+        """Gets the same versions as retained_versions by looking up one
+        version after the other, from the current one back to the last
+        version before the retention window.
+
+        Returns
+        -------
+        list
+            Version numbers
+        """
+        version = self.version_info(page_id)
+        retained = []
+        while True:
+            retained.insert(0, version['number'])
+            if parse_when(version['when']) < self.cutoff or version['number'] <= 1:
+                return retained
+            version = self.version_info(page_id, version['number'] - 1)
+
+    def find_orphans(self, page_id, body=None):
+        """Finds the orphaned output attachments on a page.
+
+        Parameters
+        ----------
+        page_id: int
+            Confluence page ID
+        body: str, optional
+            Current page body, fetched if not given
+
+        Returns
+        -------
+        list
+            Attachment ID and filename 2-tuples
+        """
+        attachments = self.get_all(self.content_url(page_id, '/child/attachment'),
+                                   {'expand': 'version', 'limit': 1000})
+        candidates = [attachment for attachment in attachments
+                      if self.output_regex.match(attachment['title'])
+                      and parse_when(attachment['version']['when']) < self.cutoff]
+        if not candidates:
+            return []
+
+        bodies = [body if body is not None else self.page_body(page_id)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            bodies.extend(pool.map(lambda version: self.page_body(page_id, version),
+                                   self.retained_versions(page_id)))
+        referenced = set()
+        for version_body in bodies:
+            referenced.update(referenced_attachments(version_body))
+        return [(attachment['id'], attachment['title']) for attachment in candidates
+                if attachment['title'] not in referenced]
+
+    def delete(self, attachment_id):
+        """Moves an attachment to the trash."""
+        resp = self.exporter.request('DELETE', '{server}/rest/api/content/{attachment_id}'
+                                     .format(server=self.exporter.server,
+                                             attachment_id=attachment_id))
+        resp.raise_for_status()
+
+    def prune(self, page_id, body=None, dry_run=False):
+        """Deletes the orphaned output attachments on a page, several at once.
+
+        Parameters
+        ----------
+        page_id: int
+            Confluence page ID
+        body: str, optional
+            Current page body, fetched if not given
+        dry_run: bool, optional
+            Only find the orphaned attachments (default: False)
+
+        Returns
+        -------
+        list
+            Attachment ID and filename 2-tuples of the orphaned attachments
+        """
+        orphans = self.find_orphans(page_id, body)
+        if orphans and not dry_run:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                list(pool.map(self.delete, [attachment_id for attachment_id, _ in orphans]))
+        return orphans
@@ -0,0 +1,128 @@
+"""Timing report of the phases of a single publish."""
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class PublishReport:
+    """Collects timed spans for the phases of a publish and cumulative times
+    for the template filters called while rendering.
+
+    Attributes
+    ----------
+    spans: list
+        (name, start, duration, thread id) tuples in seconds, relative to the
+        creation of the report
+    totals: dict
+        Cumulative seconds and call counts by phase or filter name
+    render_profile: cProfile.Profile
+        Profile of the render phase, if one was captured
+    stripped: dict
+        Count and approximate bytes of the notebook data removed before
+        rendering because the page never shows it, by MIME type, metadata
+        key, or stream for overwritten stream text
+    """
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.totals = {}
+        self.render_profile = None
+        self.stripped = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, start=None):
+        """Records time spent in a phase or filter.
+
+        Parameters
+        ----------
+        name: str
+            Phase or filter name
+        seconds: float
+            Time spent
+        start: float, optional
+            time.perf_counter() at the start of a phase to also record as a
+            span, or None to only add to the totals
+        """
+        with self._lock:
+            total = self.totals.setdefault(name, {'seconds': 0.0, 'count': 0})
+            total['seconds'] += seconds
+            total['count'] += 1
+            if start is not None:
+                self.spans.append((name, start - self.origin, seconds, threading.get_ident()))
+
+    def strip(self, name, size):
+        """Records notebook data removed before rendering.
+
+        Parameters
+        ----------
+        name: str
+            MIME type or metadata key of the data, or stream
+        size: int
+            Approximate serialized size of the data in bytes
+        """
+        with self._lock:
+            stripped = self.stripped.setdefault(name, {'bytes': 0, 'count': 0})
+            stripped['bytes'] += size
+            stripped['count'] += 1
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times the body of a with statement as a phase of the publish.
+
+        Parameters
+        ----------
+        name: str
+            Phase name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, start)
+
+    def to_dict(self):
+        """Gets the report as JSON serializable data.
+
+        Returns
+        -------
+        dict
+            Totals by name, the list of phase spans, and the stripped data
+        """
+        return {
+            'totals': {name: dict(total) for name, total in self.totals.items()},
+            'stripped': {name: dict(stripped) for name, stripped in self.stripped.items()},
+            'spans': [{'name': name, 'start': start, 'seconds': seconds}
+                      for name, start, seconds, _ in self.spans],
+        }
+
+    def to_chrome_trace(self):
+        """Gets the phase spans in the Chrome trace event format, viewable in
+        chrome://tracing or Perfetto.
+
+        Returns
+        -------
+        dict
+            Trace with one complete event per phase span
+        """
+        pid = os.getpid()
+        return {
+            'traceEvents': [{'name': name, 'cat': 'nbconflux', 'ph': 'X', 'pid': pid, 'tid': tid,
+                             'ts': start * 1e6, 'dur': seconds * 1e6}
+                            for name, start, seconds, tid in self.spans],
+            'displayTimeUnit': 'ms',
+        }
+
+    def write(self, path, trace=False):
+        """Writes the report or its Chrome trace to a JSON file.
+
+        Parameters
+        ----------
+        path: str
+            Destination path
+        trace: bool, optional
+            Write the Chrome trace instead of the report (default: False)
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome_trace() if trace else self.to_dict(), f, indent=2)
@@ -0,0 +1,433 @@
+"""Long-running publish daemon that keeps exporters warm between jobs and
+coalesces concurrent jobs that target the same page.
+"""
+import hmac
+import json
+import os
+import secrets
+import socket
+import socketserver
+import threading
+import urllib.parse as urlparse
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from .api import create_exporter
+from .cache import default_cache_dir
+
+# Options jobs may set, which only shape the page they publish
+JOB_OPTIONS = ('generate_toc', 'attach_ipynb', 'enable_style', 'enable_mathjax', 'extra_labels',
+               'content_addressed_attachments', 'strip_unrenderable', 'coalesce_streams',
+               'split_threshold')
+
+# Most idle exporters the daemon keeps warm for later jobs
+MAX_IDLE_EXPORTERS = 16
+
+
+def default_token_path():
+    """Gets the path of the file holding the token that clients of the
+    daemon port authenticate with.
+
+    Returns
+    -------
+    str
+    """
+    return os.path.join(default_cache_dir(), 'serve-token')
+
+
+def write_token(path):
+    """Writes a new random token to a file only the current user can read.
+
+    Parameters
+    ----------
+    path: str
+        Token file path
+
+    Returns
+    -------
+    str
+        Token
+    """
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        # A file left behind by an older daemon keeps its mode
+        os.fchmod(f.fileno(), 0o600)
+        f.write(token)
+    return token
+
+
+def check_job(job):
+    """Checks that a job is an object with a notebook path, page URL, string
+    credentials, and only the options jobs may set.
+
+    Parameters
+    ----------
+    job: object
+        Job decoded from JSON
+
+    Raises
+    ------
+    ValueError
+        When the job is malformed or sets other options
+    """
+    if not isinstance(job, dict):
+        raise ValueError('Jobs must be JSON objects')
+    if not (isinstance(job.get('notebook'), str) and job['notebook'] and
+            isinstance(job.get('url'), str) and job['url']):
+        raise ValueError('Jobs require a notebook and a url')
+    for name in ('username', 'password'):
+        if not isinstance(job.get(name, ''), str):
+            raise ValueError('Job {} must be a string'.format(name))
+    options = job.get('options', {})
+    if not isinstance(options, dict):
+        raise ValueError('Job options must be a JSON object')
+    unknown = set(options) - set(JOB_OPTIONS)
+    if unknown:
+        raise ValueError('Options not allowed in jobs: ' + ', '.join(sorted(unknown)))
+
+
+def origin(url):
+    """Gets the scheme and host of a URL, which identify its server.
+
+    Parameters
+    ----------
+    url: str
+        Confluence server or page URL
+
+    Returns
+    -------
+    str
+    """
+    pr = urlparse.urlparse(url)
+    return '{}://{}'.format(pr.scheme.lower(), pr.netloc.lower())
+
+
+class PublishQueue:
+    """Runs publish jobs on a thread pool, one job at a time per page.
+
+    A job submitted while another job for the same page is waiting replaces
+    the waiting one: only the newest job runs, and every caller of the
+    replaced jobs receives its result.
+
+    Parameters
+    ----------
+    publish: callable
+        Function that takes a job dict, publishes it, and returns a result
+    max_workers: int, optional
+        Maximum number of pages published at the same time (default: 4)
+    """
+    def __init__(self, publish, max_workers=4):
+        self.publish = publish
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        # Pages with a job running right now
+        self._running = set()
+        # Newest waiting job and the futures of every caller waiting on it, by page
+        self._pending = {}
+
+    def submit(self, key, job):
+        """Queues a publish job.
+
+        Parameters
+        ----------
+        key: hashable
+            Identity of the page the job targets
+        job: dict
+            Job to pass to the publish function
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the result of publishing this job, or of the newer job
+            it was coalesced into
+        """
+        future = Future()
+        with self._lock:
+            _, futures = self._pending.get(key, (None, []))
+            futures.append(future)
+            self._pending[key] = (job, futures)
+            if key not in self._running:
+                self._running.add(key)
+                self._executor.submit(self._drain, key)
+        return future
+
+    def _drain(self, key):
+        """Publishes the newest waiting job for a page until none remain."""
+        while True:
+            with self._lock:
+                if key not in self._pending:
+                    self._running.discard(key)
+                    return
+                job, futures = self._pending.pop(key)
+            try:
+                result = self.publish(job)
+            except Exception as ex:
+                for future in futures:
+                    future.set_exception(ex)
+            else:
+                for future in futures:
+                    future.set_result(dict(result, coalesced=len(futures) - 1))
+
+    def shutdown(self):
+        """Waits for running jobs to finish and stops the pool."""
+        self._executor.shutdown(wait=True)
+
+
+class Publisher:
+    """Publishes jobs with exporters kept warm across jobs.
+
+    Exporters hold the compiled page template, filters, and a pooled HTTP
+    session. An exporter publishes one job at a time, and between jobs waits
+    for the next job to any page of the same server with the same
+    credentials and options. Up to MAX_IDLE_EXPORTERS wait, and the least
+    recently used go first.
+
+    The default credentials only go to the servers the daemon was started
+    for, so that a job cannot send them to a server of its choosing. Jobs to
+    other servers must carry their own.
+
+    Parameters
+    ----------
+    username: str
+        Default Confluence username for jobs that do not carry one
+    password: str
+        Default Confluence password for jobs that do not carry one
+    servers: list, optional
+        URLs of the Confluence servers jobs may publish to with the default
+        credentials (default: None)
+    """
+    def __init__(self, username, password, servers=None):
+        # Pay the exporter stack import cost once, at startup
+        from .exporter import ConfluenceExporter
+        self.exporter_class = ConfluenceExporter
+        self.username = username
+        self.password = password
+        self.servers = {origin(server) for server in servers or []}
+        # Idle exporters by server, credentials, and options, least recently used first
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+
+    def checkout(self, url, username, password, options):
+        """Takes an idle exporter for the server of a page, creating one if
+        none is idle.
+
+        Parameters
+        ----------
+        url: str
+            Confluence page URL
+        username: str
+            Confluence username
+        password: str
+            Confluence password
+        options: dict
+            ConfluenceExporter configuration option values by name, limited
+            to JOB_OPTIONS
+
+        Returns
+        -------
+        2-tuple
+            Key to check the exporter back in with, and the
+            nbconflux.exporter.ConfluenceExporter
+        """
+        key = (origin(url), username, password, json.dumps(options, sort_keys=True))
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                exporter = idle.pop()
+                if not idle:
+                    del self._idle[key]
+                return key, exporter
+        return key, create_exporter(url, username, password, **options)
+
+    def checkin(self, key, exporter):
+        """Keeps an exporter that finished its job warm for the next job,
+        dropping the least recently used idle exporters past
+        MAX_IDLE_EXPORTERS.
+
+        Parameters
+        ----------
+        key: tuple
+            Key the exporter was checked out with
+        exporter: nbconflux.exporter.ConfluenceExporter
+        """
+        with self._lock:
+            self._idle.setdefault(key, []).append(exporter)
+            self._idle.move_to_end(key)
+            while sum(len(idle) for idle in self._idle.values()) > MAX_IDLE_EXPORTERS:
+                oldest = next(iter(self._idle))
+                self._idle[oldest].pop(0).session.close()
+                if not self._idle[oldest]:
+                    del self._idle[oldest]
+
+    def __call__(self, job):
+        """Publishes a job.
+
+        Parameters
+        ----------
+        job: dict
+            notebook path, page url, and optional username, password, and
+            options dict
+
+        Returns
+        -------
+        dict
+            Summary of the published page
+
+        Raises
+        ------
+        ValueError
+            When the job is malformed or sets options jobs may not set
+        PermissionError
+            When a job without credentials targets a server the default
+            credentials are not for
+        """
+        check_job(job)
+        username, password = job.get('username'), job.get('password')
+        if not (username and password):
+            if origin(job['url']) not in self.servers:
+                raise PermissionError('Jobs for {} must carry their own credentials'
+                                      .format(origin(job['url'])))
+            username, password = self.username, self.password
+        key, exporter = self.checkout(job['url'], username, password, job.get('options', {}))
+        exporter.from_filename(job['notebook'], url=job['url'])
+        self.checkin(key, exporter)
+        return {'url': job['url'], 'notebook': job['notebook']}
+
+
+class PublishHandler(BaseHTTPRequestHandler):
+    """Accepts publish jobs as JSON posted to /publish and responds when the
+    page is up to date.
+    """
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/health':
+            return self.send_json(404, {'status': 'error', 'message': 'Not found'})
+        self.send_json(200, {'status': 'ok'})
+
+    def do_POST(self):
+        if self.path != '/publish':
+            return self.send_json(404, {'status': 'error', 'message': 'Not found'})
+        token = self.server.token
+        if token is not None and not hmac.compare_digest(self.headers.get('Authorization', ''),
+                                                         'Bearer ' + token):
+            return self.send_json(401, {'status': 'error', 'message': 'Missing or wrong token'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(length).decode('utf-8'))
+            check_job(job)
+            job['notebook'] = os.path.abspath(job['notebook'])
+        except ValueError as ex:
+            return self.send_json(400, {'status': 'error', 'message': str(ex)})
+
+        future = self.server.queue.submit(job['url'], job)
+        try:
+            result = future.result()
+        except PermissionError as ex:
+            return self.send_json(403, {'status': 'error', 'message': str(ex)})
+        except Exception as ex:
+            self.log_error('Publishing %s failed: %s', job['notebook'], ex)
+            return self.send_json(500, {'status': 'error', 'message': str(ex)})
+        self.send_json(200, dict(result, status='published'))
+
+
+class PublishServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTP server that hands publish jobs to a PublishQueue.
+
+    Parameters
+    ----------
+    server_address: tuple
+        Host and port to listen on
+    queue: PublishQueue
+        Queue that runs the jobs
+    token: str, optional
+        Token that jobs must carry as a Bearer Authorization header, or None
+        to accept jobs from any client (default: None)
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, queue, token=None):
+        self.queue = queue
+        self.token = token
+        HTTPServer.__init__(self, server_address, PublishHandler)
+
+
+class UnixPublishServer(PublishServer):
+    """PublishServer listening on a unix domain socket path."""
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        # Replace a socket left behind by an earlier daemon
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        # Only the user running the daemon may connect
+        umask = os.umask(0o177)
+        try:
+            socketserver.TCPServer.server_bind(self)
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, 0o600)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def serve(username, password, host='127.0.0.1', port=8765, socket_path=None, max_workers=4,
+          servers=None, token_path=None):
+    """Runs the publish daemon until interrupted.
+
+    Jobs posted to the port must carry the token the daemon writes to
+    token_path at startup, readable only by the user running the daemon.
+    Only that user can connect to a unix domain socket, so jobs posted to
+    one need no token.
+
+    Parameters
+    ----------
+    username: str
+        Default Confluence username
+    password: str
+        Default Confluence password
+    host: str, optional
+        Interface to listen on (default: 127.0.0.1)
+    port: int, optional
+        Port to listen on (default: 8765)
+    socket_path: str, optional
+        Unix domain socket path to listen on instead of a port
+    max_workers: int, optional
+        Maximum number of pages published at the same time (default: 4)
+    servers: list, optional
+        URLs of the Confluence servers jobs may publish to with the default
+        credentials (default: None)
+    token_path: str, optional
+        File to write the token for the port to (default: serve-token in
+        the cache directory)
+    """
+    queue = PublishQueue(Publisher(username, password, servers), max_workers=max_workers)
+    if socket_path:
+        server = UnixPublishServer(socket_path, queue)
+        print('Listening on', socket_path)
+    else:
+        token_path = token_path or default_token_path()
+        server = PublishServer((host, port), queue, token=write_token(token_path))
+        print('Listening on http://{}:{}'.format(*server.server_address[:2]))
+        print('Jobs must carry the token in', token_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        queue.shutdown()
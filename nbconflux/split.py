@@ -0,0 +1,122 @@
+"""Partitions a notebook at its headings into parts that publish as child
+pages of the notebook page.
+"""
+import re
+
+from collections import namedtuple
+
+from nbformat import v4
+
+# ATX heading on the first line of a markdown cell
+HEADING_REGEX = re.compile(r'^(#{1,6})[ \t]+(.+?)[ \t#]*$')
+
+# Cells from a heading up to the next heading of the same or a higher level
+NotebookPart = namedtuple('NotebookPart', 'title cells')
+
+
+def cell_heading(cell):
+    """Gets the heading a markdown cell starts with.
+
+    Parameters
+    ----------
+    cell: nbformat.notebooknode.NotebookNode
+        Notebook cell
+
+    Returns
+    -------
+    2-tuple
+        Heading level and text, or None if the cell does not start with a
+        heading
+    """
+    if cell.cell_type != 'markdown':
+        return None
+    lines = cell.source.lstrip('\n').split('\n', 1)
+    match = HEADING_REGEX.match(lines[0].strip())
+    if match is None:
+        return None
+    return len(match.group(1)), match.group(2)
+
+
+def split_notebook(nb):
+    """Partitions the cells of a notebook at the headings of the highest
+    level that occurs in more than one cell, so that a notebook titled with
+    a single top heading splits at its section headings.
+
+    Parameters
+    ----------
+    nb: nbformat.notebooknode.NotebookNode
+        Root of a notebook
+
+    Returns
+    -------
+    2-tuple
+        Cells before the first split heading, and a list of NotebookPart
+        instances in notebook order, which is empty when the notebook has no
+        level of headings to split at
+    """
+    headings = [cell_heading(cell) for cell in nb.cells]
+    levels = [heading[0] for heading in headings if heading is not None]
+    split_levels = [level for level in sorted(set(levels)) if levels.count(level) > 1]
+    if not split_levels:
+        return list(nb.cells), []
+
+    level = split_levels[0]
+    preamble = []
+    parts = []
+    for cell, heading in zip(nb.cells, headings):
+        # Higher level headings before the first section, like the notebook title, stay
+        # with the preamble
+        if heading is not None and (heading[0] == level or parts and heading[0] < level):
+            parts.append(NotebookPart(heading[1], []))
+        (parts[-1].cells if parts else preamble).append(cell)
+    return preamble, parts
+
+
+def part_titles(title, parts):
+    """Gets unique child page titles for the parts of a notebook.
+
+    Page titles are unique within a space, so every title starts with the
+    title of the notebook page, and repeated headings get a number.
+
+    Parameters
+    ----------
+    title: str
+        Title of the notebook page
+    parts: list
+        NotebookPart instances
+
+    Returns
+    -------
+    list
+        Child page titles in the order of the parts
+    """
+    titles = []
+    for part in parts:
+        base = '{} - {}'.format(title, part.title)
+        part_title = base
+        n = 2
+        while part_title in titles:
+            part_title = '{} ({})'.format(base, n)
+            n += 1
+        titles.append(part_title)
+    return titles
+
+
+def part_notebook(nb, cells):
+    """Makes a notebook of some of the cells of another notebook.
+
+    Parameters
+    ----------
+    nb: nbformat.notebooknode.NotebookNode
+        Root of the whole notebook
+    cells: list
+        Cells of the part
+
+    Returns
+    -------
+    nbformat.notebooknode.NotebookNode
+        Notebook sharing the metadata and cells of the whole notebook
+    """
+    part = v4.new_notebook(metadata=nb.metadata, cells=list(cells))
+    part.nbformat_minor = nb.nbformat_minor
+    return part
@@ -0,0 +1,134 @@
+"""HTTP transports that carry Confluence API requests.
+
+A transport has the request and close methods of requests.Session, and its
+responses have the parts of requests.Response that nbconflux uses.
+"""
+import requests
+
+# Names of the available transports
+TRANSPORTS = ('requests', 'httpx')
+
+
+class HttpxResponse:
+    """View of an httpx response with the requests.Response attributes and
+    methods nbconflux uses.
+
+    Parameters
+    ----------
+    response: httpx.Response
+        Response to wrap
+    body: iterable, optional
+        Streamed request body, which httpx does not keep after sending
+    """
+    def __init__(self, response, body=None):
+        import httpx
+
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.content
+        self.url = str(response.url)
+        self.http_version = response.http_version
+        self.request = requests.PreparedRequest()
+        self.request.method = response.request.method
+        self.request.url = str(response.request.url)
+        self.request.headers = response.request.headers
+        try:
+            self.request.body = response.request.content
+        except httpx.RequestNotRead:
+            # Streamed bodies, like multipart uploads, are not kept after sending
+            self.request.body = body
+
+    @property
+    def text(self):
+        return self._response.text
+
+    def json(self):
+        return self._response.json()
+
+    def raise_for_status(self):
+        """Raises requests.HTTPError for 4xx and 5xx responses."""
+        if 400 <= self.status_code < 600:
+            kind = 'Client' if self.status_code < 500 else 'Server'
+            raise requests.HTTPError('{} {} Error: {} for url: {}'.format(
+                self.status_code, kind, self._response.reason_phrase, self.url), response=self)
+
+
+class HttpxTransport:
+    """Transport that multiplexes concurrent requests to a server over a
+    single HTTP/2 connection using httpx.
+
+    Requires httpx with HTTP/2 support: pip install httpx[http2]
+
+    Parameters
+    ----------
+    http1: bool, optional
+        Also speak HTTP/1.1 and negotiate HTTP/2 over TLS (default: True).
+        False speaks HTTP/2 without negotiation, which cleartext servers need.
+    """
+    def __init__(self, http1=True):
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError('The httpx transport requires httpx with HTTP/2 support: '
+                              'pip install httpx[http2]')
+        self._httpx = httpx
+        # No timeout and following redirects, like requests, since large attachment uploads
+        # take as long as they take and servers redirect to https or their context path
+        self.client = httpx.Client(http1=http1, http2=True, timeout=None, follow_redirects=True)
+
+    def request(self, method, url, **kwargs):
+        """Sends a request.
+
+        Parameters
+        ----------
+        method: str
+            HTTP method
+        url: str
+            Request URL
+        kwargs: dict
+            auth, headers, params, json, data, and files arguments in the
+            requests.Session.request format
+
+        Returns
+        -------
+        HttpxResponse
+
+        Raises
+        ------
+        requests.ConnectionError
+            When the request does not get a response
+        """
+        body = None
+        data = kwargs.get('data')
+        if data is not None and not isinstance(data, dict):
+            # httpx takes raw and streamed bodies as content instead of data
+            body = kwargs['content'] = kwargs.pop('data')
+        try:
+            response = self.client.request(method, url, **kwargs)
+        except self._httpx.TransportError as ex:
+            raise requests.ConnectionError(str(ex)) from ex
+        return HttpxResponse(response, body)
+
+    def close(self):
+        """Closes the pooled connections."""
+        self.client.close()
+
+
+def create_transport(name):
+    """Creates a transport by name.
+
+    Parameters
+    ----------
+    name: str
+        requests for a pooled requests.Session or httpx for HttpxTransport
+
+    Returns
+    -------
+    requests.Session or HttpxTransport
+    """
+    if name == 'httpx':
+        return HttpxTransport()
+    if name == 'requests':
+        return requests.Session()
+    raise ValueError('Unknown transport: ' + name)
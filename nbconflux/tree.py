@@ -0,0 +1,177 @@
+"""Publishes a directory of notebooks as a tree of Confluence pages under an
+existing parent page, creating the pages that do not exist yet.
+"""
+import os
+import threading
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .api import create_exporter
+from .pages import create_page, existing_page, find_pages, get_page, page_url
+
+# Page for a notebook or a directory of notebooks. path is the notebook file
+# for notebook pages or None for directory pages, and parent is the key of the
+# parent page or None for pages directly under the root page.
+TreePage = namedtuple('TreePage', 'key title path parent depth')
+
+
+def plan_tree(directory):
+    """Maps a directory of notebooks to the pages of a page tree.
+
+    Every subdirectory that contains notebooks, at any depth, becomes a page
+    titled after the subdirectory, and every notebook becomes a page titled
+    after the notebook filename without its extension. Hidden directories and
+    notebook checkpoints are skipped.
+
+    Parameters
+    ----------
+    directory: str
+        Root directory, which maps to the existing parent page
+
+    Returns
+    -------
+    list
+        TreePage instances ordered so that every page comes after its parent
+
+    Raises
+    ------
+    ValueError
+        When two pages in the tree would have the same title, which Confluence
+        does not allow within a space
+    """
+    directory = os.path.abspath(directory)
+    pages = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        # Visit subdirectories in a stable order and skip hidden ones, including checkpoints
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+        key = os.path.relpath(dirpath, directory)
+        parent = None if key == '.' else key
+        depth = 0 if parent is None else key.count(os.sep) + 1
+        if parent is not None:
+            pages.append(TreePage(key, os.path.basename(dirpath), None,
+                                  os.path.dirname(key) or None, depth - 1))
+        for filename in sorted(filenames):
+            if filename.endswith('.ipynb') and not filename.startswith('.'):
+                pages.append(TreePage(os.path.join(key, filename) if parent else filename,
+                                      os.path.splitext(filename)[0],
+                                      os.path.join(dirpath, filename), parent, depth))
+
+    # Drop directory pages without any notebook below them
+    needed = set()
+    for page in pages:
+        if page.path is not None:
+            parent = page.parent
+            while parent is not None and parent not in needed:
+                needed.add(parent)
+                parent = os.path.dirname(parent) or None
+    pages = [page for page in pages if page.path is not None or page.key in needed]
+
+    titles = {}
+    for page in pages:
+        if page.title in titles:
+            raise ValueError('{} and {} would both publish to a page titled {}'
+                             .format(titles[page.title], page.key, page.title))
+        titles[page.title] = page.key
+    return pages
+
+
+class TreePublisher:
+    """Publishes a directory of notebooks as a page tree under an existing
+    parent page.
+
+    Looks up the titles of all pages in the tree with a few bulk CQL
+    queries, creates the missing pages one tree level at a time so that
+    parents always exist before their children, and publishes the notebooks
+    concurrently. Every worker thread keeps one warm exporter that publishes
+    all the notebooks the thread picks up.
+
+    Parameters
+    ----------
+    confluence_url: str
+        URL of the existing page to publish the tree under
+    username: str, optional
+        Confluence username. Uses the current username if not specified.
+    password: str, optional
+        Confluence password. Prompts for the password if not given.
+    max_workers: int, optional
+        Maximum number of pages created or published at the same time
+        (default: 4)
+    options: dict
+        ConfluenceExporter configuration option values by name
+    """
+    def __init__(self, confluence_url, username=None, password=None, max_workers=4, **options):
+        self.exporter = create_exporter(confluence_url, username, password, **options)
+        self.confluence_url = confluence_url
+        self.options = options
+        self.max_workers = max_workers
+        self._local = threading.local()
+
+    def thread_exporter(self):
+        """Gets the exporter of the current worker thread, creating it on
+        first use.
+        """
+        exporter = getattr(self._local, 'exporter', None)
+        if exporter is None:
+            exporter = create_exporter(self.confluence_url, self.exporter.username,
+                                       self.exporter.password, **self.options)
+            self._local.exporter = exporter
+        return exporter
+
+    def publish_notebook(self, page, page_id):
+        """Publishes the notebook of a page with the exporter of the current
+        worker thread.
+
+        Returns
+        -------
+        dict
+            Summary of the published page
+        """
+        url = page_url(self.exporter.server, page_id)
+        _, resources = self.thread_exporter().from_filename(page.path, url=url)
+        print('Unchanged' if resources.get('skipped') else 'Updated', url)
+        return {'notebook': page.path, 'url': url, 'page_id': page_id}
+
+    def publish(self, directory):
+        """Publishes every notebook in a directory tree.
+
+        Parameters
+        ----------
+        directory: str
+            Root directory, which maps to the parent page
+
+        Returns
+        -------
+        list
+            Summary of each published notebook page in tree order
+
+        Raises
+        ------
+        nbconflux.pages.PageTitleConflict
+            If a page of the tree has the title of a page outside the tree
+        """
+        pages = plan_tree(directory)
+        _, space = get_page(self.exporter, self.exporter.page_id)
+        page_ids = {None: self.exporter.page_id}
+        found = find_pages(self.exporter, space, [page.title for page in pages])
+        # Reuse only the pages already under their parents, checking every
+        # title before creating anything; pages come parents first
+        for page in pages:
+            page_id = existing_page(found, page.title, page_ids.get(page.parent))
+            if page_id is not None:
+                page_ids[page.key] = page_id
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            # Create missing pages level by level so that every parent exists first
+            for depth in sorted({page.depth for page in pages}):
+                missing = [page for page in pages
+                           if page.depth == depth and page.key not in page_ids]
+                created = pool.map(lambda page: create_page(self.exporter, space, page.title,
+                                                            page_ids[page.parent]), missing)
+                for page, page_id in zip(missing, created):
+                    print('Created', page.title)
+                    page_ids[page.key] = page_id
+
+            notebooks = [page for page in pages if page.path is not None]
+            return list(pool.map(lambda page: self.publish_notebook(page, page_ids[page.key]),
+                                 notebooks))
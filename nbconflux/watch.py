@@ -0,0 +1,91 @@
+"""Watches a notebook file and republishes it after every settled save."""
+import os
+import time
+
+
+def file_signature(path):
+    """Gets a value that changes whenever a file is written.
+
+    Parameters
+    ----------
+    path: str
+        Path to the file
+
+    Returns
+    -------
+    tuple or None
+        Modification time and size of the file, or None if it does not exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def wait_for_change(path, signature, interval=1.0, debounce=1.0):
+    """Blocks until a file changes and then stops changing.
+
+    Editors and Jupyter often write a notebook in several steps, so a change
+    only counts once the file has kept the same signature for the debounce
+    period.
+
+    Parameters
+    ----------
+    path: str
+        Path to the file
+    signature: tuple
+        Signature of the file when it was last published
+    interval: float, optional
+        Seconds between checks for a change (default: 1.0)
+    debounce: float, optional
+        Seconds the file must stay unchanged before the change counts (default: 1.0)
+
+    Returns
+    -------
+    tuple
+        Signature of the settled file, once the file exists again if it
+        disappeared
+    """
+    while True:
+        time.sleep(interval)
+        current = file_signature(path)
+        if current is None or current == signature:
+            continue
+        while True:
+            time.sleep(debounce)
+            settled = file_signature(path)
+            # Editors that save to a new file and rename it over the old one
+            # leave no file for a moment, which is not a settled save
+            if settled is not None and settled == current:
+                return current
+            current = settled
+
+
+def watch(path, publish, interval=1.0, debounce=1.0):
+    """Publishes a file now and again after every settled change until
+    interrupted.
+
+    Parameters
+    ----------
+    path: str
+        Path to the file
+    publish: callable
+        Function that publishes the file, called without arguments
+    interval: float, optional
+        Seconds between checks for a change (default: 1.0)
+    debounce: float, optional
+        Seconds the file must stay unchanged before the change counts (default: 1.0)
+    """
+    signature = file_signature(path)
+    try:
+        while True:
+            try:
+                publish()
+            except Exception as ex:
+                # Keep watching: the next save may well fix the problem
+                print('Failed to publish {}: {}'.format(path, ex))
+            print('Watching {} for changes'.format(path))
+            signature = wait_for_change(path, signature, interval, debounce)
+    except KeyboardInterrupt:
+        pass
@@ -33,4 +33,8 @@ setup(
         'traitlets',
         'html5lib',
     ],
+    extras_require={
+        'fastjson': ['orjson'],
+        'http2': ['httpx[http2]'],
+    },
 )
@@ -0,0 +1,9 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmpdir_factory):
+    """Keeps the caches of every test out of the real cache directory."""
+    path = str(tmpdir_factory.mktemp('cache'))
+    monkeypatch.setenv('NBCONFLUX_CACHE_DIR', path)
+    return path
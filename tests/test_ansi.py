@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from nbconflux import ansi
+from nbconflux.exporter import ConfluenceExporter
+from nbconvert.filters.ansi import ansi2html
+from traitlets.config import Config
+
+TEXTS = [
+    '',
+    'plain <b>log</b> & "quotes" \'apostrophes\'\n' * 3,
+    '\x1b[31mred\x1b[0m plain',
+    '\x1b[1;32mbold green\x1b[22m green\x1b[39m plain',
+    '\x1b[1m\x1b[34mintense\x1b[m \x1b[5;94mblink\x1b[0m',
+    '\x1b[4;7mreverse\x1b[27;24m\x1b[7m default inverse',
+    '\x1b[38;5;9mindexed\x1b[38;5;100mcube\x1b[48;5;240mgray\x1b[0m',
+    '\x1b[38;2;10;20;30;48;2;1;2;3mrgb\x1b[49m',
+    '\x1b[38;2;300;0;0mout of range\x1b[38;5;999mtoo',
+    '\x1b[x;1mbad\x1b[2Kerase\x1b[1Aup\x1b[;mempty',
+    '\x1b[41;103mbg\x1b[0m\x1b[31m',
+    'escape \x1b without code \x1b[',
+    '<\x1b[31m>&\x1b[0m<',
+]
+
+
+@pytest.mark.parametrize('text', TEXTS)
+def test_same_as_nbconvert(text):
+    """Should convert exactly like nbconvert."""
+    assert ansi.ansi2html(text) == ansi2html(text)
+
+
+def test_random_same_as_nbconvert():
+    """Should convert random mixes of codes exactly like nbconvert."""
+    rng = random.Random(42)
+    codes = ['0', '1', '4', '5', '7', '21', '22', '24', '27', '31', '37', '39', '42', '49', '91',
+             '107', '38;5;3', '38;5;200', '48;5;250', '38;2;1;2;3', '48;2;9;9;9', '', 'z']
+    pieces = ['text', ' ', '\n', '<', '&', '"']
+    for _ in range(200):
+        text = ''.join(rng.choice(pieces) if rng.random() < 0.6 else
+                       '\x1b[{}m'.format(';'.join(rng.sample(codes, rng.randint(1, 3))))
+                       for _ in range(rng.randint(0, 30)))
+        assert ansi.ansi2html(text) == ansi2html(text)
+
+
+def test_plain_text_skips_scan(monkeypatch):
+    """Should only escape text without escape codes."""
+    monkeypatch.setattr(ansi, '_ANSI_RE', None)
+    assert ansi.ansi2html('a < b') == 'a &lt; b'
+    assert type(ansi.ansi2html('a < b')) is str
+
+
+def test_exporter_filter():
+    """Should render outputs with the fast converter."""
+    exporter = ConfluenceExporter(Config())
+    assert exporter.environment.filters['ansi2html']('\x1b[31mx') == ansi2html('\x1b[31mx')
+    assert exporter.filters['ansi2html'] is ansi.ansi2html
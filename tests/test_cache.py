@@ -0,0 +1,50 @@
+import os
+
+import jinja2
+import pytest
+
+from nbconflux.cache import TemplateBytecodeCache
+from nbconflux.exporter import ConfluenceExporter
+from traitlets.config import Config
+
+
+def load_template(config):
+    exporter = ConfluenceExporter(config)
+    # Registered per notebook language when converting a notebook
+    exporter.register_filter('highlight_code', lambda source, **kwargs: source)
+    return exporter.template
+
+
+@pytest.fixture
+def config(tmpdir):
+    c = Config()
+    c.ConfluenceExporter.cache_dir = str(tmpdir)
+    return c
+
+
+def test_template_bytecode_cache(config, monkeypatch):
+    """Compiled templates should be reused in memory and from disk."""
+    monkeypatch.setattr(TemplateBytecodeCache, '_compiled', {})
+    load_template(config)
+    cached = os.listdir(os.path.join(config.ConfluenceExporter.cache_dir, 'templates'))
+    assert len(cached) == 1
+    assert os.listdir(os.path.join(config.ConfluenceExporter.cache_dir, 'templates', cached[0]))
+
+    def fail_compile(*args, **kwargs):
+        raise AssertionError('template compiled again')
+
+    monkeypatch.setattr(jinja2.Environment, 'compile', fail_compile)
+    # From the process-wide cache
+    load_template(config)
+    # From the cache directory
+    monkeypatch.setattr(TemplateBytecodeCache, '_compiled', {})
+    load_template(config)
+
+
+def test_template_cache_disabled(config, monkeypatch):
+    """Should not write anything to disk without a cache directory."""
+    cache_dir = config.ConfluenceExporter.cache_dir
+    config.ConfluenceExporter.cache_dir = ''
+    monkeypatch.setattr(TemplateBytecodeCache, '_compiled', {})
+    load_template(config)
+    assert not os.listdir(cache_dir)
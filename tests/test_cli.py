@@ -12,12 +12,24 @@ def argv():
         '--exclude-ipynb',
         '--exclude-style',
         '--include-mathjax',
-        '--extra-labels', 'extra-label-1', 'extra-label-2'
+        '--extra-labels', 'extra-label-1', 'extra-label-2',
+        '--content-addressed-attachments',
+        '--render-processes', '4',
+        '--request-budget', '20',
+        '--resume',
+        '--transport', 'httpx',
+        '--split-threshold', '1000000',
+        '--skip-unchanged',
+        '--rate-limit', '2.5',
+        '--max-concurrency', '2'
     ]
 
 
 def mock_notebook_to_page(notebook, url, username, password, generate_toc, attach_ipynb,
-                          enable_style, enable_mathjax, extra_labels):
+                          enable_style, enable_mathjax, extra_labels, content_addressed_attachments,
+                          render_processes, profile_render, request_budget, resume,
+                          prune_attachments, transport, split_threshold, skip_unchanged, rate_limit,
+                          max_concurrency):
     assert notebook == 'fake-notebook.ipynb'
     assert url == 'https://confluence.localhost/some/page'
     assert username == 'fake-username'
@@ -27,6 +39,18 @@ def mock_notebook_to_page(notebook, url, username, password, generate_toc, attac
     assert not enable_style
     assert enable_mathjax
     assert extra_labels == ['extra-label-1', 'extra-label-2']
+    assert content_addressed_attachments
+    assert render_processes == 4
+    assert not profile_render
+    assert request_budget == 20
+    assert resume
+    assert not prune_attachments
+    assert transport == 'httpx'
+    assert split_threshold == 1000000
+    assert skip_unchanged
+    assert rate_limit == 2.5
+    assert max_concurrency == 2
+    return None, {}
 
 
 def test_cli_args(argv, monkeypatch):
@@ -67,3 +91,81 @@ def test_cli_creds_file(argv, tmpdir, monkeypatch):
 
     monkeypatch.setattr('os.path.expanduser', lambda x: str(cfg))
     cli.main(argv)
+
+
+def test_cli_watch(argv, monkeypatch):
+    """Should watch the notebook with the same options."""
+    def mock_watch_notebook(notebook, url, username, password, interval, debounce, on_publish,
+                            **kwargs):
+        assert interval == 0.5
+        assert debounce == 2.0
+        mock_notebook_to_page(notebook, url, username, password, **kwargs)
+
+    monkeypatch.setattr(cli, 'watch_notebook', mock_watch_notebook)
+    monkeypatch.setenv('CONFLUENCE_USERNAME', 'fake-username')
+    monkeypatch.setenv('CONFLUENCE_PASSWORD', 'fake-password')
+    cli.main(argv + ['--watch', '--watch-interval', '0.5', '--debounce', '2'])
+
+
+def test_cli_watch_reports(tmpdir, monkeypatch):
+    """Should write the profile and metrics of every publish in watch mode."""
+    written = []
+
+    class Report:
+        render_profile = None
+
+        def __init__(self, publish):
+            self.publish = publish
+
+        def write(self, path, trace=False, prometheus=False):
+            written.append((self.publish, path, trace, prometheus))
+
+    def mock_watch_notebook(notebook, url, username, password, on_publish, **kwargs):
+        for publish in range(2):
+            on_publish(dict(report=Report(publish), metrics=Report(publish)))
+
+    monkeypatch.setattr(cli, 'watch_notebook', mock_watch_notebook)
+    monkeypatch.setenv('CONFLUENCE_USERNAME', 'fake-username')
+    monkeypatch.setenv('CONFLUENCE_PASSWORD', 'fake-password')
+    profile = str(tmpdir.join('profile.json'))
+    metrics = str(tmpdir.join('metrics.prom'))
+    cli.main(['fake-notebook.ipynb', 'https://confluence.localhost/some/page', '--watch',
+              '--profile', profile, '--metrics', metrics, '--metrics-format', 'prometheus'])
+
+    assert written == [
+        (0, metrics, False, True),
+        (0, profile, False, False),
+        (1, metrics, False, True),
+        (1, profile, False, False),
+    ]
+
+
+def test_cli_tree(monkeypatch):
+    """Should publish a directory tree with the requested options."""
+    calls = []
+    monkeypatch.setenv('CONFLUENCE_USERNAME', 'fake-username')
+    monkeypatch.setenv('CONFLUENCE_PASSWORD', 'fake-password')
+    monkeypatch.setattr(cli, 'publish_tree', lambda *args, **kwargs: calls.append((args, kwargs)))
+    cli.main(['tree', 'notebooks', 'https://confluence.localhost/some/page', '--exclude-toc',
+              '--workers', '8'])
+
+    (args, kwargs), = calls
+    assert args == ('notebooks', 'https://confluence.localhost/some/page', 'fake-username',
+                    'fake-password')
+    assert kwargs['max_workers'] == 8
+    assert not kwargs['generate_toc']
+    assert kwargs['attach_ipynb']
+
+
+def test_cli_gc(monkeypatch):
+    """Should prune the page with the requested options."""
+    calls = []
+    monkeypatch.setenv('CONFLUENCE_USERNAME', 'fake-username')
+    monkeypatch.setenv('CONFLUENCE_PASSWORD', 'fake-password')
+    monkeypatch.setattr(cli, 'prune_page_attachments',
+                        lambda *args, **kwargs: calls.append((args, kwargs)))
+    cli.main(['gc', 'https://confluence.localhost/some/page', '--dry-run', '--retention-days', '7'])
+
+    assert calls == [(('https://confluence.localhost/some/page', 'fake-username', 'fake-password'),
+                      {'retention_days': 7, 'dry_run': True, 'max_workers': 8,
+                       'unique_key': 'output'})]
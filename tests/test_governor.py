@@ -0,0 +1,174 @@
+import json
+import os
+
+import pytest
+import responses
+
+from nbconflux import governor
+from nbconflux.api import create_exporter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(governor, 'time', clock)
+    monkeypatch.setattr(governor, '_memory_states', {})
+    return clock
+
+
+def test_token_bucket(clock):
+    """Should pace requests at the configured rate after a burst of one second's worth."""
+    gov = governor.RateGovernor('c.localhost', rate=4, max_concurrency=0)
+    for _ in range(12):
+        gov.acquire()
+        gov.release('GET /x', 0.01, 200, {})
+    assert clock.sleeps == [0.25] * 8
+
+
+@pytest.mark.parametrize('latency', [0.05, 0.2])
+def test_token_bucket_in_flight(clock, latency):
+    """Should keep earning tokens while requests are in flight."""
+    gov = governor.RateGovernor('c.localhost', rate=5, max_concurrency=1)
+    start = clock.now
+    for _ in range(50):
+        gov.acquire()
+        clock.now += latency
+        gov.release('GET /x', latency, 200, {})
+    # A burst of one second's worth, then 5 requests per second
+    assert (50 - 5) / 5 <= clock.now - start <= 50 / 5 + 1e-6
+
+
+def test_server_rate(clock):
+    """Should pace requests at the rate the server advertises when it is lower."""
+    gov = governor.RateGovernor('c.localhost', rate=100, max_concurrency=0)
+    gov.acquire()
+    gov.release('GET /x', 0.01, 200, {'X-RateLimit-FillRate': '10',
+                                      'X-RateLimit-Interval-Seconds': '5',
+                                      'X-RateLimit-Remaining': '0'})
+    gov.acquire()
+    assert clock.sleeps == [0.5]
+
+
+def test_retry_after(clock):
+    """Should hold back every request to the host until Retry-After passes, except the retry
+    itself.
+    """
+    gov = governor.RateGovernor('c.localhost')
+    other = governor.RateGovernor('c.localhost')
+    gov.acquire()
+    blocked_until = gov.release('POST /x', 0.01, 429, {'Retry-After': '3'})
+    assert blocked_until == clock.now + 3
+
+    gov.acquire(blocked_until)
+    assert clock.sleeps == []
+    assert other.acquire() == 3
+    assert clock.sleeps == [3]
+
+
+def test_adaptive_concurrency(clock):
+    """Should halve the requests in flight on throttling and latency spikes, and add them back
+    one by one.
+    """
+    gov = governor.RateGovernor('c.localhost', max_concurrency=8)
+
+    def limit():
+        with gov.store.transaction() as state:
+            return state['limit']
+
+    for _ in range(8):
+        gov.acquire()
+    # A finished request frees its slot for the next
+    gov.release('GET /x', 0.1, 200, {})
+    gov.acquire()
+    assert clock.sleeps == []
+
+    # Responses to requests in flight together count as one signal
+    gov.release('GET /x', 0.1, 429, {})
+    gov.release('GET /x', 0.1, 429, {})
+    assert limit() == 4
+    clock.now += governor.DECREASE_INTERVAL
+    gov.release('GET /x', 10.0, 200, {})
+    assert limit() == 2
+
+    for _ in range(5):
+        gov.release('GET /x', 0.1, 200, {})
+    assert 3 < limit() < 4
+
+    for _ in range(3):
+        gov.acquire()
+    assert clock.sleeps == []
+
+
+def test_shared_state(clock, tmpdir):
+    """Should share limits and requests in flight with other processes through the state file."""
+    path = governor.governor_path(str(tmpdir), 'c.localhost')
+    gov = governor.RateGovernor('c.localhost', max_concurrency=2, directory=str(tmpdir))
+    gov.acquire()
+    with open(path) as f:
+        state = json.load(f)
+    assert state['in_flight'] == {str(os.getpid()): 1}
+
+    # Another live process holds the second slot, and a dead one leaked a slot
+    state['in_flight'][str(os.getppid())] = 1
+    state['in_flight']['999999999'] = 1
+    with open(path, 'w') as f:
+        json.dump(state, f)
+    clock.sleep = lambda seconds: gov.release('GET /x', 0.1, 200, {})
+    gov.acquire()
+    with open(path) as f:
+        assert json.load(f)['in_flight'] == {str(os.getpid()): 1, str(os.getppid()): 1}
+
+
+def test_unwritable_directory(clock, tmpdir):
+    """Should share state with the threads of this process only when the state file cannot be
+    created.
+    """
+    tmpdir.join('file').write('')
+    gov = governor.RateGovernor('c.localhost', directory=str(tmpdir.join('file')))
+    assert gov.store is governor.RateGovernor('c.localhost').store
+    gov.acquire()
+    gov.release('GET /x', 0.01, 200, {})
+
+
+def test_host_limits():
+    """Should govern each host with its own limits."""
+    exporter = create_exporter('http://confluence.localhost/pages/viewpage.action?pageId=12345',
+                               'fake-username', 'fake-pass', rate_limit=5.0,
+                               host_rate_limits={'other.localhost:8090': 2.0},
+                               host_max_concurrency={'other.localhost:8090': 1})
+    gov = exporter.governor('http://confluence.localhost/rest/api/content/12345')
+    assert (gov.rate, gov.max_concurrency) == (5.0, 8)
+    assert exporter.governor('http://confluence.localhost/rest/api/content/1') is gov
+    gov = exporter.governor('http://other.localhost:8090/rest/api/content/12345')
+    assert (gov.rate, gov.max_concurrency) == (2.0, 1)
+
+
+def test_request_throttled(monkeypatch, tmpdir):
+    """Should halve the requests in flight to a host that throttles publishes."""
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    with responses.RequestsMock() as server:
+        server.add('POST', 'http://confluence.localhost/rest/api/content/12345/label', status=429,
+                   headers={'Retry-After': '0'})
+        server.add('POST', 'http://confluence.localhost/rest/api/content/12345/label', status=200)
+        exporter = create_exporter('http://confluence.localhost/pages/viewpage.action?pageId=12345',
+                                   'fake-username', 'fake-pass', cache_dir=str(tmpdir),
+                                   max_concurrency=4)
+        exporter.add_label(12345, 'nbconflux')
+
+    with open(governor.governor_path(str(tmpdir), 'confluence.localhost')) as f:
+        state = json.load(f)
+    assert state['in_flight'] == {}
+    assert 2 < state['limit'] < 3
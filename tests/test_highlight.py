@@ -0,0 +1,77 @@
+import os
+import time
+import warnings
+
+import pytest
+
+from nbconflux import highlight
+from nbconvert.filters.highlight import Highlight2HTML
+
+CELLS = [
+    ('import os\nprint(os.getcwd())\n', None, None),
+    ('%%sql\nSELECT * FROM t WHERE x > 1', None, {'magics_language': 'sql'}),
+    ('', None, None),
+    ('SELECT 1;', 'sql', None),
+    ('fn main() {}', 'not-a-language', None),
+    ('x <- c(1, 2)', 'r', None),
+]
+
+
+@pytest.mark.parametrize('source,language,metadata', CELLS)
+def test_same_as_nbconvert(source, language, metadata, tmpdir):
+    """Should highlight exactly like nbconvert, with and without a cache hit."""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        expected = Highlight2HTML(pygments_lexer='ipython3')(source, language, metadata)
+        cached = highlight.CachedHighlight2HTML(pygments_lexer='ipython3', cache_dir=str(tmpdir))
+        assert cached(source, language, metadata) == expected
+        assert cached(source, language, metadata) == expected
+        uncached = highlight.CachedHighlight2HTML(pygments_lexer='ipython3')
+        assert uncached(source, language, metadata) == expected
+
+
+def test_persistent_cache(tmpdir, monkeypatch):
+    """Should reuse highlighted cells from earlier processes."""
+    cached = highlight.CachedHighlight2HTML(pygments_lexer='ipython3', cache_dir=str(tmpdir))
+    html = cached('x = 1')
+    assert len(tmpdir.join('highlight').listdir()) == 1
+
+    def fail(*args):
+        raise AssertionError('highlighted again')
+    monkeypatch.setattr('pygments.highlight', fail)
+    fresh = highlight.CachedHighlight2HTML(pygments_lexer='ipython3', cache_dir=str(tmpdir))
+    assert fresh('x = 1') == html
+    # Formatter options are part of the key
+    with pytest.raises(AssertionError):
+        cached('x = 1', language='python')
+
+
+def test_lexer_lookup_cache():
+    """Should look up each lexer once per process."""
+    assert highlight.get_lexer('sql') is highlight.get_lexer('sql')
+    assert highlight.get_formatter(' highlight hl-sql') is \
+        highlight.get_formatter(' highlight hl-sql')
+
+
+def test_sweep_cache(tmpdir):
+    """Should remove the highlighted cells unused for longer than the maximum age about once a day.
+    """
+    cached = highlight.CachedHighlight2HTML(pygments_lexer='ipython3', cache_dir=str(tmpdir))
+    cached('x = 1')
+    cached('y = 2')
+    old = time.time() - highlight.MAX_AGE - 60
+    for path in tmpdir.join('highlight').visit('*.html'):
+        os.utime(str(path), (old, old))
+    # Using a cell renews it
+    cached('x = 1')
+
+    directory = str(tmpdir.join('highlight'))
+    assert highlight.sweep_cache(directory) == 1
+    assert len(list(tmpdir.join('highlight').visit('*.html'))) == 1
+
+    # Swept at most once a day
+    for path in tmpdir.join('highlight').visit('*.html'):
+        os.utime(str(path), (old, old))
+    assert highlight.sweep_cache(directory) == 0
+    os.utime(str(tmpdir.join('highlight', '.swept')), (old, old))
+    assert highlight.sweep_cache(directory) == 1
@@ -0,0 +1,92 @@
+import re
+
+import nbconflux
+import pytest
+import responses
+
+from nbconflux.api import create_exporter
+from nbconflux.metrics import RequestBudgetExceeded, RequestMetrics, endpoint
+
+PAGE_URL = 'http://confluence.localhost/pages/viewpage.action?pageId=12345'
+CONTENT_URL = 'http://confluence.localhost/rest/api/content/12345'
+
+
+@pytest.fixture
+def server():
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as mock:
+        mock.add('GET', CONTENT_URL + '/child/attachment?expand=version&limit=1000',
+                 match_querystring=True,
+                 json={'results': [{'id': 1, 'title': 'output_6_0.png', 'version': {'number': 5}}]})
+        mock.add('GET', CONTENT_URL, json={'title': 'fake-title', 'version': {'number': 100}})
+        mock.add('PUT', CONTENT_URL)
+        mock.add('POST', CONTENT_URL + '/label')
+        mock.add('POST', CONTENT_URL + '/child/attachment/1/data')
+        mock.add('POST', CONTENT_URL + '/child/attachment')
+        yield mock
+
+
+def test_endpoint():
+    """Should group URLs by endpoint."""
+    assert endpoint('http://c.localhost/wiki/rest/api/content/123/child/attachment/45/data') == \
+        '/wiki/rest/api/content/{id}/child/attachment/{id}/data'
+    assert endpoint('http://c.localhost/rest/api/content?title=Page&spaceKey=SPACE') == \
+        '/rest/api/content'
+    assert endpoint('http://c.localhost/download/attachments/123/output_1_0.png?version=2') == \
+        '/download/attachments/{id}/{filename}'
+
+
+def test_publish_metrics(request, server):
+    """Should count every request of a publish by endpoint and status."""
+    notebook_path = request.fspath.dirpath('notebooks', 'nbconflux-test.ipynb')
+    html, resources = nbconflux.notebook_to_page(str(notebook_path), PAGE_URL, 'fake-username',
+                                                 'fake-pass', request_budget=6)
+    metrics = resources['metrics']
+    assert metrics.total_requests == len(server.calls) == 6
+    assert metrics.requests[('POST', '/rest/api/content/{id}/label', 200)] == 1
+    assert metrics.bytes_out[('PUT', '/rest/api/content/{id}')] == len(server.calls[2].request.body)
+
+    data = metrics.to_dict()
+    assert data['total_requests'] == 6
+    assert data['retries'] == 0
+    assert {entry['endpoint'] for entry in data['endpoints']} >= \
+        {'/rest/api/content/{id}/child/attachment'}
+
+    text = metrics.to_prometheus()
+    assert ('nbconflux_requests_total{endpoint="/rest/api/content/{id}",method="PUT",'
+            'status="200"} 1') in text
+    assert re.search(r'nbconflux_request_duration_seconds_bucket\{endpoint='
+                     r'"/rest/api/content/\{id\}",le="\+Inf",method="GET"\} 1', text)
+
+
+def test_request_budget(request, server):
+    """Should fail a publish that makes more requests than its budget."""
+    notebook_path = request.fspath.dirpath('notebooks', 'nbconflux-test.ipynb')
+    with pytest.raises(RequestBudgetExceeded):
+        nbconflux.notebook_to_page(str(notebook_path), PAGE_URL, 'fake-username', 'fake-pass',
+                                   request_budget=5)
+
+
+def test_retry_backoff(monkeypatch):
+    """Should retry requests the server throttles and count the retries."""
+    sleeps = []
+    monkeypatch.setattr('time.sleep', sleeps.append)
+    with responses.RequestsMock() as server:
+        server.add('POST', 'http://confluence.localhost/rest/api/content/12345/label', status=429,
+                   headers={'Retry-After': '2'})
+        server.add('POST', 'http://confluence.localhost/rest/api/content/12345/label', status=503)
+        server.add('POST', 'http://confluence.localhost/rest/api/content/12345/label', status=200)
+        exporter = create_exporter(PAGE_URL, 'fake-username', 'fake-pass')
+        exporter.add_label(12345, 'nbconflux')
+
+    assert sleeps == [2.0, 1.0]
+    assert exporter.metrics.retries == {('POST', '/rest/api/content/{id}/label'): 2}
+    assert exporter.metrics.total_requests == 3
+
+
+def test_metrics_budget_check():
+    """Should allow exactly the budgeted number of requests."""
+    metrics = RequestMetrics(budget=1)
+    metrics.check_budget('GET', 'http://c.localhost/rest/api/content/1')
+    metrics.observe('GET', 'http://c.localhost/rest/api/content/1', 200, 0.01)
+    with pytest.raises(RequestBudgetExceeded):
+        metrics.check_budget('GET', 'http://c.localhost/rest/api/content/1')
@@ -1,3 +1,4 @@
+import contextlib
 import os
 import re
 
@@ -5,6 +6,9 @@ import responses
 import nbconflux
 import pytest
 
+PAGE_URL = 'http://confluence.localhost/pages/viewpage.action?pageId=12345'
+CONTENT_URL = 'http://confluence.localhost/rest/api/content/12345'
+
 
 @pytest.fixture(scope='module')
 def notebook_path(request):
@@ -27,6 +31,32 @@ def server():
         yield mock
 
 
+def add_page(server, page_id=12345, attachments=(), version=100):
+    """Mocks the attachment listing, version lookup, update, labels, and new
+    attachments of a page.
+    """
+    page = 'http://confluence.localhost/rest/api/content/{}'.format(page_id)
+    server.add('GET', page + '/child/attachment?expand=version&limit=1000', match_querystring=True,
+               json={'results': list(attachments)})
+    server.add('GET', page, json={'title': 'fake-title', 'version': {'number': version}})
+    server.add('PUT', page)
+    server.add('POST', page + '/label')
+    server.add('POST', page + '/child/attachment')
+
+
+@pytest.fixture
+def page_server():
+    """Starts a mock Confluence server with a page per with block, taking the
+    add_page options.
+    """
+    @contextlib.contextmanager
+    def page_server(**page):
+        with responses.RequestsMock(assert_all_requests_are_fired=False) as server:
+            add_page(server, **page)
+            yield server
+    return page_server
+
+
 def test_version():
     """Package should have a version defined."""
     version = getattr(nbconflux, '__version__', None)
@@ -46,7 +76,7 @@ def test_post_to_confluence(notebook_path, page_url, server):
             ]
         })
     # Mock current page attachment lookup
-    server.add('GET', 'http://confluence.localhost/rest/api/content/12345/child/attachment?expand=version',
+    server.add('GET', CONTENT_URL + '/child/attachment?expand=version&limit=1000',
         match_querystring=True,
         json={
             'results': [
@@ -154,7 +184,7 @@ def test_optional_components(notebook_path, page_url, server):
             ]
         })
     # Mock current page attachment lookup
-    server.add('GET', 'http://confluence.localhost/rest/api/content/12345/child/attachment?expand=version',
+    server.add('GET', CONTENT_URL + '/child/attachment?expand=version&limit=1000',
         match_querystring=True,
         json={
             'results': [
@@ -202,4 +232,441 @@ def test_post_to_unknown(notebook_path, bad_page_url, server):
     with pytest.raises(ValueError) as ex:
         nbconflux.notebook_to_page(notebook_path, bad_page_url, 'fake-username', 'fake-pass')
 
-    assert 'Could not locate' in str(ex.value)
\ No newline at end of file
+    assert 'Could not locate' in str(ex.value)
+
+
+def test_content_addressed_attachments(notebook_path, page_server):
+    """Outputs should be named after their content and existing ones should not be uploaded again.
+    """
+    from nbconflux.preprocessor import content_address
+
+    # Learn the name of the plot from the first publish
+    with page_server() as server:
+        html, resources = nbconflux.notebook_to_page(notebook_path, PAGE_URL, 'fake-username',
+                                                     'fake-pass', attach_ipynb=False,
+                                                     content_addressed_attachments=True)
+
+        (filename, data), = resources['outputs'].items()
+        assert filename == content_address(data, extension='.png')
+        assert 'output_6_0.png' not in html
+        assert '/download/attachments/12345/{}?version=1'.format(filename) in html
+        assert server.calls[-1].request.url.endswith('/child/attachment')
+
+    # Mock the same plot already attached to the page at version 3
+    with page_server(attachments=[{'id': 7, 'title': filename, 'version': {'number': 3}}],
+                     version=101) as server:
+        html, resources = nbconflux.notebook_to_page(notebook_path, PAGE_URL, 'fake-username',
+                                                     'fake-pass', attach_ipynb=False,
+                                                     content_addressed_attachments=True)
+
+        # Links to the existing version and uploads nothing
+        assert '/download/attachments/12345/{}?version=3'.format(filename) in html
+        assert not any('child/attachment/7/data' in call.request.url for call in server.calls)
+
+
+@pytest.mark.parametrize('language', [None, 'python'])
+def test_parallel_render(request, tmpdir, page_server, language):
+    """Rendering cells in worker processes should produce the same page as rendering serially."""
+    import nbformat
+
+    notebook_path = os.path.join(os.path.dirname(request.module.__file__), 'notebooks',
+                                 'lots-of-plots.ipynb')
+    if language is not None:
+        # Code cells highlight with the lexer of the notebook language
+        nb = nbformat.read(notebook_path, as_version=4)
+        nb.metadata['language_info'] = {'name': language}
+        notebook_path = str(tmpdir.join('lots-of-plots.ipynb'))
+        nbformat.write(nb, notebook_path)
+    pages = []
+    for render_processes in (1, 2):
+        with page_server():
+            html, resources = nbconflux.notebook_to_page(notebook_path,
+                                                         PAGE_URL,
+                                                         'fake-username', 'fake-pass',
+                                                         render_processes=render_processes)
+            pages.append(html)
+            assert 'render_cells' not in resources
+
+    assert pages[0] == pages[1]
+    if language is not None:
+        assert 'hl-' + language in pages[1]
+
+
+def test_republish_skips_unchanged_outputs(notebook_path):
+    """A warm exporter should reuse its attachment index and only upload outputs that changed."""
+    from nbconflux.api import create_exporter
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as server:
+        server.add('GET', CONTENT_URL + '/child/attachment?expand=version&limit=1000',
+                   match_querystring=True,
+                   json={'results': [{'id': 1, 'title': 'output_6_0.png',
+                                      'version': {'number': 5}}]})
+        server.add('GET', CONTENT_URL, json={'title': 'fake-title', 'version': {'number': 100}})
+        server.add('PUT', CONTENT_URL)
+        server.add('POST', CONTENT_URL + '/label')
+        server.add('POST', CONTENT_URL + '/child/attachment/1/data')
+        server.add('POST', CONTENT_URL + '/child/attachment',
+                   json={'results': [{'id': 9, 'title': 'nbconflux-test.ipynb',
+                                      'version': {'number': 1}}]})
+        server.add('POST', CONTENT_URL + '/child/attachment/9/data')
+
+        exporter = create_exporter(PAGE_URL, 'fake-username', 'fake-pass',
+                                   reuse_attachment_index=True)
+        html, resources = exporter.from_filename(notebook_path)
+        assert 'output_6_0.png?version=6' in html
+        first_calls = len(server.calls)
+
+        html, resources = exporter.from_filename(notebook_path)
+        urls = [call.request.url for call in server.calls[first_calls:]]
+        # Same image at the same version, without listing attachments or uploading it again
+        assert 'output_6_0.png?version=6' in html
+        assert 'nbconflux-test.ipynb?version=2' in html
+        assert not any('expand=version' in url for url in urls)
+        assert not any(url.endswith('/attachment/1/data') for url in urls)
+        assert urls[-1].endswith('/attachment/9/data')
+
+
+def test_publish_report(notebook_path, tmpdir, page_server):
+    """Publishing should report the time spent in each phase and template filter."""
+    with page_server():
+        html, resources = nbconflux.notebook_to_page(notebook_path, PAGE_URL, 'fake-username',
+                                                     'fake-pass', profile_render=True)
+
+    report = resources['report']
+    for name in ('resolve_url', 'read_notebook', 'preprocess', 'list_attachments', 'render',
+                 'page_version', 'page_put', 'labels', 'attachments',
+                 'markdown2html', 'sanitize_html', 'highlight_code', 'ansi2html'):
+        assert report.totals[name]['count'] > 0, name
+    assert report.totals['labels']['count'] == 1
+    assert report.render_profile is not None
+
+    trace = report.to_chrome_trace()
+    assert {event['name'] for event in trace['traceEvents']} >= {'render', 'page_put'}
+    assert all(event['ph'] == 'X' and event['dur'] >= 0 for event in trace['traceEvents'])
+
+    path = tmpdir.join('report.json')
+    report.write(str(path))
+    assert '"render"' in path.read()
+
+
+def test_publish_to_many_pages(notebook_path):
+    """A single exporter should publish to any page named per call."""
+    from nbconflux.api import create_exporter
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as server:
+        server.add('GET',
+                   'http://confluence.localhost/rest/api/content?title=Other+Page&spaceKey=SPACE',
+                   match_querystring=True,
+                   json={'results': [{'id': 67890}]})
+        for page_id in (12345, 67890):
+            add_page(server, page_id)
+
+        exporter = create_exporter(PAGE_URL, 'fake-username', 'fake-pass')
+        template = exporter.template
+        other_url = 'http://confluence.localhost/display/SPACE/Other+Page'
+        html, resources = exporter.from_filename(notebook_path, url=other_url)
+        assert '/download/attachments/67890/output_6_0.png?version=1' in html
+        html, resources = exporter.from_filename(notebook_path, url=other_url)
+        html, resources = exporter.from_filename(notebook_path)
+        assert '/download/attachments/12345/output_6_0.png?version=1' in html
+
+        puts = [call.request.url for call in server.calls if call.request.method == 'PUT']
+        assert puts == ['http://confluence.localhost/rest/api/content/67890'] * 2 + \
+            [CONTENT_URL]
+        # The page URL is only looked up once and the template is only loaded once
+        assert sum('title=Other+Page' in call.request.url for call in server.calls) == 1
+        assert exporter.template is template
+
+
+def test_resume_interrupted_publish(notebook_path, tmpdir, monkeypatch):
+    """Resuming should only perform the steps an interrupted publish did not complete."""
+    import requests
+
+    listing = CONTENT_URL + '/child/attachment?expand=version&limit=1000'
+    monkeypatch.setenv('NBCONFLUX_CACHE_DIR', str(tmpdir))
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as server:
+        server.add('GET', listing, match_querystring=True,
+                   json={'results': [{'id': 1, 'title': 'output_6_0.png',
+                                      'version': {'number': 5}}]})
+        server.add('GET', CONTENT_URL, json={'title': 'fake-title', 'version': {'number': 100}})
+        server.add('PUT', CONTENT_URL)
+        server.add('POST', CONTENT_URL + '/label')
+        server.add('POST', CONTENT_URL + '/child/attachment/1/data')
+        # The link drops while uploading the notebook
+        server.add('POST', CONTENT_URL + '/child/attachment', status=500)
+
+        with pytest.raises(requests.HTTPError):
+            nbconflux.notebook_to_page(notebook_path, PAGE_URL, 'fake-username', 'fake-pass',
+                                       extra_labels=['extra'])
+    assert len(tmpdir.join('journals').listdir()) == 1
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as server:
+        # The page and the plot were updated before the interruption
+        server.add('GET', listing, match_querystring=True,
+                   json={'results': [{'id': 1, 'title': 'output_6_0.png',
+                                      'version': {'number': 6}}]})
+        server.add('GET', CONTENT_URL, json={'title': 'fake-title', 'version': {'number': 101}})
+        server.add('POST', CONTENT_URL + '/child/attachment')
+
+        html, resources = nbconflux.notebook_to_page(notebook_path, PAGE_URL, 'fake-username',
+                                                     'fake-pass', extra_labels=['extra'],
+                                                     resume=True)
+        calls = [(call.request.method, call.request.url) for call in server.calls]
+
+    # Same links as the interrupted publish wrote, so the page needs no update
+    assert 'output_6_0.png?version=6' in html
+    assert 'nbconflux-test.ipynb?version=1' in html
+    assert calls == [
+        ('GET', listing),
+        ('GET', CONTENT_URL),
+        ('POST', CONTENT_URL + '/child/attachment'),
+    ]
+    # A completed publish leaves no journal behind
+    assert tmpdir.join('journals').listdir() == []
+
+
+@pytest.mark.parametrize('skip_unchanged', [False, True])
+def test_unwritable_cache_dir(notebook_path, tmpdir, monkeypatch, page_server, skip_unchanged):
+    """Should publish without a journal, shared rate limits, or a ledger entry when the cache
+    directory cannot be created.
+    """
+    tmpdir.join('file').write('')
+    monkeypatch.setenv('NBCONFLUX_CACHE_DIR', str(tmpdir.join('file', 'nbconflux')))
+    with page_server() as server:
+        html, resources = nbconflux.notebook_to_page(notebook_path, PAGE_URL, 'fake-username',
+                                                     'fake-pass', skip_unchanged=skip_unchanged)
+        puts = [call.request.url for call in server.calls if call.request.method == 'PUT']
+
+    assert puts == [CONTENT_URL]
+
+
+def test_skip_unchanged(notebook_path, tmpdir, monkeypatch, page_server):
+    """Should skip publishing the same notebook again until the page or the notebook changes."""
+    monkeypatch.setenv('NBCONFLUX_CACHE_DIR', str(tmpdir))
+
+    def publish(version, notebook_file=notebook_path, **options):
+        with page_server(version=version) as server:
+            html, resources = nbconflux.notebook_to_page(notebook_file, PAGE_URL, 'fake-username',
+                                                         'fake-pass', skip_unchanged=True,
+                                                         **options)
+            return html, resources, [call.request.method for call in server.calls]
+
+    html, resources, methods = publish(100)
+    assert html is not None and 'PUT' in methods
+
+    # The page is at the version the publish left it at
+    html, resources, methods = publish(101)
+    assert html is None and resources['skipped']
+    assert methods == ['GET']
+    assert 'page_version' in resources['report'].totals
+
+    # Someone edited the page since
+    html, resources, methods = publish(102)
+    assert html is not None and 'PUT' in methods
+
+    # Other options shape another page
+    html, resources, methods = publish(103, generate_toc=False)
+    assert html is not None and 'PUT' in methods
+
+    # Other notebook bytes
+    with open(notebook_path, 'rb') as f:
+        data = f.read() + b'\n'
+    html, resources, methods = publish(104, data, generate_toc=False,
+                                       notebook_name='nbconflux-test.ipynb')
+    assert html is not None and 'PUT' in methods
+    html, resources, methods = publish(105, data, generate_toc=False,
+                                       notebook_name='nbconflux-test.ipynb')
+    assert html is None and methods == ['GET']
+
+
+def test_batch_new_attachments(tmpdir):
+    """Should create new attachments several per request and update existing ones one by one."""
+    import base64
+    import json
+    import nbformat
+    from nbformat import v4
+    from nbconflux.api import create_exporter
+
+    png = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAC'
+                           'hwGA60e6kgAAAABJRU5ErkJggg==')
+    nb = v4.new_notebook()
+    for i in range(7):
+        data = base64.b64encode(png + bytes([i])).decode('ascii')
+        nb.cells.append(v4.new_code_cell('plot({})'.format(i), outputs=[
+            v4.new_output('display_data', data={'image/png': data})]))
+    path = tmpdir.join('plots.ipynb')
+    nbformat.write(nb, str(path))
+    batches = []
+
+    def create(request):
+        titles = re.findall(rb'filename="([^"]+)"', request.body)
+        batches.append([title.decode('utf-8') for title in titles])
+        return 200, {}, json.dumps({'results': [{'id': 100 + len(batches) * 10 + i,
+                                                 'title': title.decode('utf-8')}
+                                                for i, title in enumerate(titles)]})
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as server:
+        server.add('GET', re.compile(re.escape(CONTENT_URL) + '/child/attachment'),
+                   json={'results': [{'id': 1, 'title': 'output_2_0.png',
+                                      'version': {'number': 5}}]})
+        server.add('GET', CONTENT_URL, json={'title': 'fake-title', 'version': {'number': 100}})
+        server.add('PUT', CONTENT_URL)
+        server.add('POST', CONTENT_URL + '/label')
+        server.add('POST', CONTENT_URL + '/child/attachment/1/data')
+        server.add_callback('POST', CONTENT_URL + '/child/attachment',
+                            callback=create)
+
+        exporter = create_exporter(PAGE_URL, 'fake-username', 'fake-pass', attachment_batch_files=3,
+                                   reuse_attachment_index=True)
+        html, resources = exporter.from_filename(str(path))
+        updates = [call.request.url for call in server.calls if call.request.url.endswith('/data')]
+
+    assert batches == [['output_0_0.png', 'output_1_0.png', 'output_3_0.png'],
+                       ['output_4_0.png', 'output_5_0.png', 'output_6_0.png'],
+                       ['plots.ipynb']]
+    assert updates == [CONTENT_URL + '/child/attachment/1/data']
+    # Each new attachment learns its ID from the batch that created it
+    index = exporter.attachment_index[12345]
+    assert index['output_1_0.png'].id == 111
+    assert index['output_4_0.png'].id == 120
+    assert index['plots.ipynb'].id == 130
+
+
+def test_batch_uploads():
+    """Should bound batches by bytes and attachments, giving oversized attachments a batch of their
+    own.
+    """
+    from nbconflux.exporter import batch_uploads
+
+    uploads = [('a', b'x' * 4), ('b', b'x' * 4), ('c', b'x' * 20), ('d', b'x'), ('e', b'x'),
+               ('f', b'x')]
+    assert [[filename for filename, _ in batch] for batch in batch_uploads(uploads, 10, 2)] == \
+        [['a', 'b'], ['c'], ['d', 'e'], ['f']]
+    assert [[filename for filename, _ in batch] for batch in batch_uploads(uploads, 0, 10)] == \
+        [['a', 'b', 'c', 'd', 'e', 'f']]
+
+
+def test_strip_unrenderable(tmpdir, page_server):
+    """Should drop data the page never shows without changing the page, and report it."""
+    import nbformat
+    from nbformat import v4
+
+    nb = v4.new_notebook(metadata={
+        'widgets': {'application/vnd.jupyter.widget-state+json': {'state': {}}}})
+    nb.cells.append(v4.new_code_cell('fig', outputs=[
+        v4.new_output('display_data', data={'application/vnd.plotly.v1+json':
+                                            {'data': [{'x': [1, 2, 3]}]},
+                                            'text/html': '<div>plot</div>',
+                                            'text/plain': 'Figure'},
+                      metadata={'application/vnd.plotly.v1+json': {'config': {}}}),
+        v4.new_output('execute_result', data={'text/plain': '42'}, execution_count=1),
+    ]))
+    path = tmpdir.join('dashboard.ipynb')
+    nbformat.write(nb, str(path))
+
+    pages = []
+    for strip_unrenderable in (False, True):
+        with page_server():
+            from nbconflux.api import create_exporter
+            exporter = create_exporter(PAGE_URL, 'fake-username', 'fake-pass',
+                                       strip_unrenderable=strip_unrenderable)
+            html, resources = exporter.from_filename(str(path))
+            pages.append(html)
+
+    assert pages[0] == pages[1]
+    assert '<div>plot</div>' in html
+    stripped = resources['report'].to_dict()['stripped']
+    assert sorted(stripped) == ['application/vnd.plotly.v1+json', 'metadata.widgets', 'text/plain']
+    assert stripped['application/vnd.plotly.v1+json']['count'] == 1
+    assert stripped['text/plain'] == {'count': 1, 'bytes': len('Figure')}
+
+
+def test_unique_key(notebook_path, page_server):
+    """Should name output attachments with the configured prefix."""
+    from nbconflux.api import create_exporter
+
+    with page_server():
+        exporter = create_exporter(PAGE_URL, 'fake-username', 'fake-pass', unique_key='plot')
+        html, resources = exporter.from_filename(notebook_path)
+    assert '/download/attachments/12345/plot_6_0.png?version=1' in html
+    assert 'output_6_0.png' not in html
+
+
+def test_drop_data_once(notebook_path, monkeypatch, page_server):
+    """Should run the preprocessors that drop data once per publish, whether from bytes or a
+    notebook node.
+    """
+    import nbformat
+    from nbconflux import preprocessor
+    from nbconflux.api import create_exporter
+
+    calls = []
+    for cls in (preprocessor.StripUnrenderablePreprocessor,
+                preprocessor.CoalesceStreamsPreprocessor):
+        def preprocess(self, nb, resources, original=cls.preprocess):
+            calls.append(type(self).__name__)
+            return original(self, nb, resources)
+        monkeypatch.setattr(cls, 'preprocess', preprocess)
+
+    with page_server():
+        exporter = create_exporter(PAGE_URL, 'fake-username', 'fake-pass', strip_unrenderable=True,
+                                   coalesce_streams=True)
+        exporter.from_filename(notebook_path)
+        assert sorted(calls) == ['CoalesceStreamsPreprocessor', 'StripUnrenderablePreprocessor']
+        exporter.from_notebook_node(nbformat.read(notebook_path, as_version=4),
+                                    notebook_name='a.ipynb')
+        assert len(calls) == 4
+
+
+def test_coalesce_streams(tmpdir, page_server):
+    """Should render a progress bar cell as its final progress bar."""
+    import nbformat
+    from nbformat import v4
+
+    nb = v4.new_notebook()
+    nb.cells.append(v4.new_code_cell('for epoch in tqdm(range(20000)): train(epoch)', outputs=[
+        v4.new_output('stream', name='stderr',
+                      text='\r{:3d}%|{:<50}| {}/20000'.format(i // 200, '#' * (i // 400), i))
+        for i in range(20001)
+    ]))
+    path = tmpdir.join('training.ipynb')
+    nbformat.write(nb, str(path))
+
+    with page_server():
+        from nbconflux.api import create_exporter
+        exporter = create_exporter(PAGE_URL, 'fake-username', 'fake-pass', attach_ipynb=False)
+        html, resources = exporter.from_filename(str(path))
+
+    assert '100%|' + '#' * 50 + '| 20000/20000' in html
+    assert ' 99%|' not in html
+    assert html.count('output_subarea output_stream') == 1
+    assert len(html) < 10000
+    assert resources['report'].to_dict()['stripped']['stream']['count'] == 1
+
+
+def test_publish_from_memory(notebook_path, page_server):
+    """Should publish notebook bytes or nodes and attach the notebook under the given name."""
+    import nbformat
+    from nbconflux.api import notebook_to_page
+
+    with open(notebook_path, 'rb') as f:
+        data = f.read()
+    # Serialized differently from nbformat, which must not matter for the attachment
+    data = data.replace(b'\n', b'\r\n')
+    nb = nbformat.reads(data.decode('utf-8'), as_version=4)
+
+    for notebook, expected in ((data, data), (nb, nbformat.writes(nb).encode('utf-8'))):
+        with page_server() as server:
+            html, resources = notebook_to_page(notebook, PAGE_URL, 'fake-username', 'fake-pass',
+                                               notebook_name='executed.ipynb')
+            uploads = [call.request.body for call in server.calls
+                       if call.request.method == 'POST' and
+                       b'filename="executed.ipynb"' in (call.request.body or b'')]
+
+        assert 'executed.ipynb?version=1' in html
+        assert len(uploads) == 1
+        assert expected in uploads[0]
+
+    with pytest.raises(ValueError):
+        notebook_to_page(data, PAGE_URL,
+                         'fake-username', 'fake-pass')
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+import responses
+
+from nbconflux import payload
+from nbconflux.api import create_exporter
+
+TEXT = '<p>café "quoted" \\ back\nslash ☃ \x01</p>' * 7
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def encoder(request, monkeypatch):
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(payload, 'orjson', None)
+    return request.param
+
+
+def test_json_text_stream(encoder):
+    """Should encode the same document as encoding it whole, every time it is iterated."""
+    document = {'title': 'x', 'body': {'storage': {'value': payload.TEXT}}}
+    stream = payload.JSONTextStream(document, TEXT, chunk_chars=10)
+    chunks = list(stream)
+    assert len(chunks) > 10
+    assert json.loads(b''.join(chunks)) == {'title': 'x', 'body': {'storage': {'value': TEXT}}}
+    assert stream.size == len(b''.join(chunks))
+    assert b''.join(stream) == b''.join(chunks)
+
+
+def test_json_text_stream_placeholder():
+    """Should refuse documents without the text placeholder."""
+    with pytest.raises(ValueError):
+        payload.JSONTextStream({'title': 'x'}, TEXT)
+
+
+def test_text_digest():
+    """Should hash the UTF-8 encoding of text."""
+    import hashlib
+    text = TEXT * 50000
+    assert payload.text_digest(text) == hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+@pytest.mark.parametrize('stream_put_threshold', [0, 1])
+def test_update_page(stream_put_threshold, encoder):
+    """Should update the page with the same JSON whether or not the body is streamed, also on
+    retries.
+    """
+    bodies = []
+
+    def put(request):
+        body = request.body if isinstance(request.body, bytes) else b''.join(request.body)
+        bodies.append(json.loads(body))
+        return (429 if len(bodies) == 1 else 200), {'Retry-After': '0'}, '{}'
+
+    with responses.RequestsMock() as server:
+        server.add('GET', 'http://confluence.localhost/rest/api/content/12345',
+                   json={'title': 'fake-title', 'version': {'number': 100}})
+        server.add_callback('PUT', 'http://confluence.localhost/rest/api/content/12345',
+                            callback=put)
+
+        exporter = create_exporter('http://confluence.localhost/pages/viewpage.action?pageId=12345',
+                                   'fake-username', 'fake-pass',
+                                   stream_put_threshold=stream_put_threshold)
+        exporter.update_page(12345, TEXT)
+        sent = server.calls[-1].request
+
+    assert isinstance(sent.body, payload.JSONTextStream) == bool(stream_put_threshold)
+    assert sent.headers['Content-Type'] == 'application/json'
+    assert bodies[0] == bodies[1] == {
+        'version': {'number': 101},
+        'title': 'fake-title',
+        'type': 'page',
+        'body': {'storage': {'representation': 'storage', 'value': TEXT}},
+    }
+    assert exporter.metrics.bytes_out[('PUT', '/rest/api/content/{id}')] > len(TEXT)
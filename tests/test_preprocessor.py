@@ -0,0 +1,117 @@
+import json
+import re
+import urllib.parse as urlparse
+
+import pytest
+import responses
+
+from nbconflux.api import create_exporter
+
+PAGE_URL = 'http://confluence.localhost/pages/viewpage.action?pageId=12345'
+ATTACHMENTS_URL = 'http://confluence.localhost/rest/api/content/12345/child/attachment'
+
+
+def attachment(i):
+    return {'id': i, 'title': 'file_{}.png'.format(i), 'version': {'number': i + 1}}
+
+
+@pytest.fixture
+def server():
+    """Mock page with 7 attachments, listed 2 at a time, that also answers filename lookups."""
+    def handle(request):
+        query = urlparse.parse_qs(urlparse.urlparse(request.url).query)
+        if 'filename' in query:
+            results = [attachment(i) for i in range(7)
+                       if attachment(i)['title'] == query['filename'][0]]
+            return 200, {}, json.dumps({'results': results})
+        start = int(query.get('start', ['0'])[0])
+        results = [attachment(i) for i in range(start, min(start + 2, 7))]
+        links = {'next': '/rest/api/content/12345/child/attachment?start={}'.format(start + 2)} \
+            if start + 2 < 7 else {}
+        return 200, {}, json.dumps({'results': results, 'size': len(results), '_links': links})
+
+    with responses.RequestsMock() as mock:
+        mock.add_callback('GET', re.compile(re.escape(ATTACHMENTS_URL) + r'\?.*'), callback=handle)
+        yield mock
+
+
+def lookup(server, filenames, **options):
+    exporter = create_exporter(PAGE_URL, 'fake-username', 'fake-pass', attachment_lookup_workers=2,
+                               **options)
+    attachments = exporter._preprocessors[-1].list_attachments(filenames)
+    queries = [urlparse.parse_qs(urlparse.urlparse(call.request.url).query)
+               for call in server.calls]
+    return attachments, queries
+
+
+def test_list_attachments(server):
+    """Should list every attachment, fetching pages after the first one concurrently."""
+    attachments, queries = lookup(server, ['file_6.png'], attachment_lookup='list')
+    assert sorted(attachments) == ['file_{}.png'.format(i) for i in range(7)]
+    assert attachments['file_6.png'].version == 7
+    assert queries[0]['limit'] == ['1000']
+    # Two pages at a time until a page reaches the end of the listing
+    assert sorted(int(query.get('start', ['0'])[0]) for query in queries) == [0, 2, 4, 6, 8]
+
+
+def test_find_attachments(server):
+    """Should only look up the filenames the publish needs."""
+    attachments, queries = lookup(server, ['file_3.png', 'new.png'], attachment_lookup='filename')
+    assert list(attachments) == ['file_3.png']
+    assert attachments['file_3.png'].id == 3
+    assert sorted(query['filename'][0] for query in queries) == ['file_3.png', 'new.png']
+
+
+def test_auto_attachment_lookup(server, monkeypatch):
+    """Should look up the filenames missing from the first listing page, or list the rest when there
+    are many.
+    """
+    attachments, queries = lookup(server, ['file_1.png', 'file_5.png'])
+    assert sorted(attachments) == ['file_0.png', 'file_1.png', 'file_5.png']
+    assert [query.get('filename') for query in queries] == [None, ['file_5.png']]
+
+    server.calls.reset()
+    monkeypatch.setattr('nbconflux.preprocessor.MAX_FILENAME_LOOKUPS', 0)
+    attachments, queries = lookup(server, ['file_5.png'])
+    assert len(attachments) == 7
+    assert not any('filename' in query for query in queries)
+
+
+@pytest.mark.parametrize('text,expected', [
+    ('plain\ntext\n', 'plain\ntext\n'),
+    ('\r 10%\r 50%\r100%\n', '100%\n'),
+    ('loading...\rdone\n', 'doneing...\n'),
+    ('line\r\nnext\r\n', 'line\nnext\n'),
+    ('abc\b\bX\n', 'aX\n'),
+    ('\bstart', '\bstart'),
+    ('a\nb\b\rc\r', 'a\nc'),
+])
+def test_collapse_overwrites(text, expected):
+    """Should keep only the text that carriage returns and backspaces leave visible."""
+    from nbconflux.preprocessor import collapse_overwrites
+    assert collapse_overwrites(text) == expected
+
+
+def test_coalesce_streams():
+    """Should merge consecutive outputs to the same stream only."""
+    from nbconflux.preprocessor import CoalesceStreamsPreprocessor
+    from nbformat import v4
+
+    nb = v4.new_notebook()
+    nb.cells.append(v4.new_code_cell('train()', outputs=[
+        v4.new_output('stream', name='stderr', text='\r  0%|          |'),
+        v4.new_output('stream', name='stderr', text='\r 50%|#####     |'),
+        v4.new_output('stream', name='stderr', text='\r100%|##########|\n'),
+        v4.new_output('stream', name='stdout', text='loss=0.1\n'),
+        v4.new_output('display_data', data={'text/plain': 'Figure'}),
+        v4.new_output('stream', name='stdout', text='done\n'),
+        v4.new_output('stream', name='stdout', text='bye\n'),
+    ]))
+    nb, _ = CoalesceStreamsPreprocessor(enabled=True)(nb, {})
+    assert [(output.output_type, output.get('name'), output.get('text'))
+            for output in nb.cells[0].outputs] == [
+        ('stream', 'stderr', '100%|##########|\n'),
+        ('stream', 'stdout', 'loss=0.1\n'),
+        ('display_data', None, None),
+        ('stream', 'stdout', 'done\nbye\n'),
+    ]
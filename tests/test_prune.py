@@ -0,0 +1,130 @@
+import datetime
+import json
+import re
+import urllib.parse as urlparse
+
+import pytest
+import responses
+
+from nbconflux import prune
+from nbconflux.api import create_exporter, prune_page_attachments
+
+PAGE_URL = 'http://confluence.localhost/pages/viewpage.action?pageId=12345'
+CONTENT_URL = 'http://confluence.localhost/rest/api/content/12345'
+
+
+def body(*filenames):
+    return ''.join('<img src="http://confluence.localhost/download/attachments/12345/{}'
+                   '?version=2&amp;a=b" />'.format(filename) for filename in filenames)
+
+
+@pytest.fixture
+def server():
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as mock:
+        mock.add('GET', CONTENT_URL + '/child/attachment', json={'results': [
+            {'id': 1, 'title': 'output_1_0.png', 'version': {'when': '2018-01-01T00:00:00.000Z'}},
+            {'id': 2, 'title': 'output_2_0.png', 'version': {'when': '2018-01-01T00:00:00.000Z'}},
+            {'id': 3, 'title': 'output_3_0.png', 'version': {'when': '2018-01-01T00:00:00.000Z'}},
+            {'id': 4, 'title': 'output_4_0.png', 'version': {'when': '2018-01-01T00:00:00.000Z'}},
+            # Recently uploaded, by a publish that may still be running
+            {'id': 5, 'title': 'output_5_0.png',
+             'version': {'when': '2018-03-30T00:00:00.000+02:00'}},
+            # Not an output attachment
+            {'id': 6, 'title': 'diagram.png', 'version': {'when': '2018-01-01T00:00:00.000Z'}},
+        ]})
+        mock.add('GET', CONTENT_URL + '/version', json={'results': [
+            {'number': 1, 'when': '2018-01-01T00:00:00.000Z'},
+            {'number': 2, 'when': '2018-02-01T00:00:00.000Z'},
+            {'number': 3, 'when': '2018-03-15T00:00:00.000Z'},
+            {'number': 4, 'when': '2018-03-30T00:00:00.000Z'},
+        ]})
+        mock.add('GET', re.compile(re.escape(CONTENT_URL) + r'\?.*version=2.*'),
+                 json={'body': {'storage': {'value': body('output_2_0.png')}}})
+        mock.add('GET', re.compile(re.escape(CONTENT_URL) + r'\?.*version=3.*'),
+                 json={'body': {'storage': {
+                     'value': '<ri:attachment ri:filename="output_3_0.png" />'}}})
+        mock.add('GET', re.compile(re.escape(CONTENT_URL) + r'\?.*version=4.*'),
+                 json={'body': {'storage': {'value': body('output_4_0.png')}}})
+        mock.add('GET', re.compile(re.escape(CONTENT_URL) + r'\?expand=body.storage$'),
+                 json={'body': {'storage': {'value': body('output_4_0.png')}}})
+        mock.add('DELETE', re.compile(r'http://confluence.localhost/rest/api/content/\d+'))
+        yield mock
+
+
+def test_parse_when():
+    """Should parse Confluence timestamps with any UTC offset."""
+    assert prune.parse_when('2018-01-31T12:00:00.000Z') == \
+        datetime.datetime(2018, 1, 31, 12, tzinfo=datetime.timezone.utc)
+    assert prune.parse_when('2018-01-31T14:00:00+02:00') == \
+        datetime.datetime(2018, 1, 31, 12, tzinfo=datetime.timezone.utc)
+
+
+def test_referenced_attachments():
+    """Should find attachments linked by download URL or embedded by filename."""
+    assert prune.referenced_attachments(body('output_1_0.png', 'a%20b.ipynb') +
+                                        '<ri:attachment ri:filename="c.png" />') == \
+        {'output_1_0.png', 'a b.ipynb', 'c.png'}
+
+
+def test_prune(server):
+    """Should delete output attachments no version in the retention window references."""
+    exporter = create_exporter(PAGE_URL, 'fake-username', 'fake-pass')
+    now = datetime.datetime(2018, 4, 1, tzinfo=datetime.timezone.utc)
+    pruner = prune.AttachmentPruner(exporter, retention_days=30, now=now)
+
+    assert pruner.retained_versions(12345) == [2, 3, 4]
+    assert pruner.prune(12345, dry_run=True) == [(1, 'output_1_0.png')]
+    assert not any(call.request.method == 'DELETE' for call in server.calls)
+
+    assert pruner.prune(12345, body=body()) == [(1, 'output_1_0.png')]
+    deletes = [call.request.url for call in server.calls if call.request.method == 'DELETE']
+    assert deletes == ['http://confluence.localhost/rest/api/content/1']
+
+
+def test_prune_page_attachments(server):
+    """Should keep everything that is referenced or newer than the retention window."""
+    orphans = prune_page_attachments(PAGE_URL, 'fake-username', 'fake-pass', retention_days=100000,
+                                     dry_run=True)
+    assert orphans == []
+
+
+def test_prune_unique_key(server):
+    """Should only consider the output attachments with the configured prefix."""
+    server.replace('GET', CONTENT_URL + '/child/attachment', json={'results': [
+        {'id': 7, 'title': 'plot_1_0.png', 'version': {'when': '2018-01-01T00:00:00.000Z'}},
+        {'id': 8, 'title': 'plot_0123456789abcdef.png',
+         'version': {'when': '2018-01-01T00:00:00.000Z'}},
+        {'id': 9, 'title': 'output_1_0.png', 'version': {'when': '2018-01-01T00:00:00.000Z'}},
+    ]})
+    exporter = create_exporter(PAGE_URL, 'fake-username', 'fake-pass', unique_key='plot')
+    now = datetime.datetime(2018, 4, 1, tzinfo=datetime.timezone.utc)
+    pruner = prune.AttachmentPruner(exporter, now=now, unique_key='plot')
+    assert pruner.prune(12345, dry_run=True) == [(7, 'plot_1_0.png'),
+                                                 (8, 'plot_0123456789abcdef.png')]
+
+
+def test_prune_without_version_listing():
+    """Should look up the versions in the window one by one when the server has no version listing.
+    """
+    whens = {1: '2018-01-01T00:00:00.000Z', 2: '2018-02-01T00:00:00.000Z',
+             3: '2018-03-15T00:00:00.000Z', 4: '2018-03-30T00:00:00.000Z'}
+
+    def content(request):
+        query = urlparse.parse_qs(urlparse.urlparse(request.url).query)
+        number = int(query.get('version', [4])[0])
+        value = body('output_{}_0.png'.format(number))
+        return 200, {}, json.dumps({'version': {'number': number, 'when': whens[number]},
+                                    'body': {'storage': {'value': value}}})
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as server:
+        server.add('GET', CONTENT_URL + '/child/attachment', json={'results': [
+            {'id': number, 'title': 'output_{}_0.png'.format(number), 'version': {'when': whens[1]}}
+            for number in whens]})
+        server.add('GET', CONTENT_URL + '/version', status=404)
+        server.add_callback('GET', re.compile(re.escape(CONTENT_URL) + r'\?'), callback=content)
+        exporter = create_exporter(PAGE_URL, 'fake-username', 'fake-pass')
+        now = datetime.datetime(2018, 4, 1, tzinfo=datetime.timezone.utc)
+        pruner = prune.AttachmentPruner(exporter, retention_days=30, now=now)
+
+        assert pruner.retained_versions(12345) == [2, 3, 4]
+        assert pruner.prune(12345, dry_run=True) == [(1, 'output_1_0.png')]
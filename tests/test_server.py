@@ -0,0 +1,242 @@
+import base64
+import json
+import os
+import re
+import stat
+import threading
+import urllib.request
+
+import pytest
+import responses
+
+from nbconflux.server import Publisher, PublishQueue, PublishServer, UnixPublishServer, write_token
+
+
+def test_coalesce_jobs_for_same_page():
+    """Jobs waiting on the same page should collapse into the newest one."""
+    started = threading.Event()
+    release = threading.Event()
+    published = []
+
+    def publish(job):
+        published.append(job['notebook'])
+        if job['notebook'] == 'first':
+            started.set()
+            release.wait(5)
+        return {'notebook': job['notebook']}
+
+    queue = PublishQueue(publish)
+    first = queue.submit('page', {'notebook': 'first'})
+    assert started.wait(5)
+    # Both wait behind the running job, so only the newest of them runs
+    second = queue.submit('page', {'notebook': 'second'})
+    third = queue.submit('page', {'notebook': 'third'})
+    other = queue.submit('other-page', {'notebook': 'other'})
+    assert other.result(5) == {'notebook': 'other', 'coalesced': 0}
+    release.set()
+
+    assert first.result(5) == {'notebook': 'first', 'coalesced': 0}
+    assert second.result(5) == third.result(5) == {'notebook': 'third', 'coalesced': 1}
+    queue.shutdown()
+    assert sorted(published) == ['first', 'other', 'third']
+
+
+def test_publish_errors_reach_callers():
+    """Callers should see the error of the job they waited on."""
+    def publish(job):
+        raise ValueError('Could not locate page')
+
+    queue = PublishQueue(publish)
+    with pytest.raises(ValueError):
+        queue.submit('page', {}).result(5)
+    queue.shutdown()
+
+
+@pytest.fixture
+def daemon():
+    jobs = []
+
+    def publish(job):
+        jobs.append(job)
+        if job['url'] == 'http://confluence.localhost/bad':
+            raise RuntimeError('Unknown URL format')
+        return {'url': job['url'], 'notebook': job['notebook']}
+
+    queue = PublishQueue(publish)
+    server = PublishServer(('127.0.0.1', 0), queue)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1]), jobs
+    server.shutdown()
+    server.server_close()
+    queue.shutdown()
+
+
+def post(url, body, headers=None):
+    headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+    req = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'), headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            return resp.status, json.loads(resp.read().decode('utf-8'))
+    except urllib.error.HTTPError as ex:
+        return ex.code, json.loads(ex.read().decode('utf-8'))
+
+
+def test_daemon_publish(daemon):
+    """Daemon should run posted jobs and report the outcome."""
+    base_url, jobs = daemon
+    status, body = post(base_url + '/publish', {'notebook': '/tmp/a.ipynb',
+                                                'url': 'http://confluence.localhost/page'})
+    assert status == 200
+    assert body == {'status': 'published', 'url': 'http://confluence.localhost/page',
+                    'notebook': '/tmp/a.ipynb', 'coalesced': 0}
+
+    status, body = post(base_url + '/publish', {'notebook': '/tmp/a.ipynb',
+                                                'url': 'http://confluence.localhost/bad'})
+    assert status == 500
+    assert body['message'] == 'Unknown URL format'
+
+    status, body = post(base_url + '/publish', {'notebook': '/tmp/a.ipynb'})
+    assert status == 400
+    assert len(jobs) == 2
+
+
+@pytest.mark.parametrize('job', [
+    ['/tmp/a.ipynb', 'http://confluence.localhost/page'],
+    'http://confluence.localhost/page',
+    {'notebook': ['/tmp/a.ipynb'], 'url': 'http://confluence.localhost/page'},
+    {'notebook': '/tmp/a.ipynb', 'url': {'page': 12345}},
+    {'notebook': '/tmp/a.ipynb', 'url': 'http://confluence.localhost/page', 'password': 1234},
+    {'notebook': '/tmp/a.ipynb', 'url': 'http://confluence.localhost/page',
+     'options': ['generate_toc']},
+    {'notebook': '/tmp/a.ipynb', 'url': 'http://confluence.localhost/page',
+     'options': {'cache_dir': '/tmp'}},
+])
+def test_daemon_malformed_job(daemon, job):
+    """Daemon should reject malformed jobs and jobs setting other options before running them."""
+    base_url, jobs = daemon
+    status, body = post(base_url + '/publish', job)
+    assert status == 400
+    assert body['status'] == 'error'
+    assert jobs == []
+
+
+@pytest.fixture
+def publisher_daemon():
+    queue = PublishQueue(Publisher('daemon-user', 'daemon-pass',
+                                   servers=['http://confluence.localhost']))
+    server = PublishServer(('127.0.0.1', 0), queue)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+    queue.shutdown()
+
+
+def test_daemon_credentials(request, publisher_daemon):
+    """Daemon credentials should only go to the servers the daemon was started for."""
+    notebook = os.path.join(os.path.dirname(request.module.__file__), 'notebooks',
+                            'nbconflux-test.ipynb')
+    page_url = 'http://confluence.localhost/pages/viewpage.action?pageId=12345'
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as server:
+        server.add('GET', re.compile(r'http://confluence.localhost/rest/api/content/12345/child/'),
+                   json={'results': []})
+        server.add('GET', 'http://confluence.localhost/rest/api/content/12345',
+                   json={'title': 'fake-title', 'version': {'number': 100}})
+        server.add('PUT', 'http://confluence.localhost/rest/api/content/12345')
+        server.add('POST', re.compile(r'http://confluence.localhost/rest/api/content/12345/.*'))
+
+        status, body = post(publisher_daemon + '/publish', {
+            'notebook': notebook,
+            'url': 'http://attacker.localhost/pages/viewpage.action?pageId=12345'})
+        assert status == 403
+        assert len(server.calls) == 0
+
+        status, body = post(publisher_daemon + '/publish', {
+            'notebook': notebook, 'url': page_url, 'options': {'cache_dir': '/tmp/elsewhere'}})
+        assert status == 400
+        assert 'cache_dir' in body['message']
+        assert len(server.calls) == 0
+
+        status, body = post(publisher_daemon + '/publish', {
+            'notebook': notebook, 'url': page_url, 'options': {'generate_toc': False}})
+        assert status == 200
+        auth = 'Basic ' + base64.b64encode(b'daemon-user:daemon-pass').decode('ascii')
+        assert server.calls
+        assert all(call.request.headers['Authorization'] == auth for call in server.calls)
+
+
+def test_daemon_token(tmpdir):
+    """Jobs posted to the port should only run when they carry the token from the token file."""
+    path = tmpdir.join('serve-token')
+    path.write('old token')
+    os.chmod(str(path), 0o644)
+    token = write_token(str(path))
+    assert path.read() == token
+    assert stat.S_IMODE(os.stat(str(path)).st_mode) == 0o600
+
+    jobs = []
+    queue = PublishQueue(lambda job: jobs.append(job) or {})
+    server = PublishServer(('127.0.0.1', 0), queue, token=token)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:{}/publish'.format(server.server_address[1])
+        job = {'notebook': '/tmp/a.ipynb', 'url': 'http://confluence.localhost/page'}
+        assert post(url, job)[0] == 401
+        assert post(url, job, {'Authorization': 'Bearer wrong'})[0] == 401
+        assert jobs == []
+        assert post(url, job, {'Authorization': 'Bearer ' + token})[0] == 200
+        assert len(jobs) == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+        queue.shutdown()
+
+
+def test_unix_socket_permissions(tmpdir):
+    """Only the user running the daemon should be able to connect to its socket."""
+    path = str(tmpdir.join('nbconflux.sock'))
+    server = UnixPublishServer(path, PublishQueue(lambda job: {}))
+    try:
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    finally:
+        server.server_close()
+
+
+def test_idle_exporters(monkeypatch):
+    """Exporters should serve any page of their server between jobs, and only a bounded number stay
+    idle.
+    """
+    closed = []
+
+    class Exporter:
+        def __init__(self, url):
+            self.session = self
+            self.url = url
+
+        def close(self):
+            closed.append(self)
+
+    monkeypatch.setattr('nbconflux.server.create_exporter',
+                        lambda url, *args, **options: Exporter(url))
+    monkeypatch.setattr('nbconflux.server.MAX_IDLE_EXPORTERS', 2)
+    publisher = Publisher('daemon-user', 'daemon-pass')
+
+    key, first = publisher.checkout('http://confluence.localhost/page/1', 'user', 'pass', {})
+    _, second = publisher.checkout('http://confluence.localhost/page/2', 'user', 'pass', {})
+    assert first is not second
+    publisher.checkin(key, first)
+    assert publisher.checkout('http://confluence.localhost/page/3', 'user', 'pass', {})[1] is first
+    publisher.checkin(key, first)
+    _, third = publisher.checkout('http://confluence.localhost/page/3', 'user', 'pass',
+                                  {'generate_toc': False})
+    assert third is not first
+
+    publisher.checkin(key, second)
+    other_key, other = publisher.checkout('http://other.localhost/page/1', 'user', 'pass', {})
+    publisher.checkin(other_key, other)
+    # The least recently used idle exporter goes first
+    assert closed == [first]
+    assert publisher.checkout('http://confluence.localhost/page/1', 'user', 'pass', {})[1] is second
@@ -0,0 +1,136 @@
+import json
+import re
+
+import nbformat
+import pytest
+import responses
+
+from nbconflux import split
+from nbconflux.api import create_exporter
+from nbconflux.pages import PageTitleConflict
+from nbformat import v4
+
+API_URL = 'http://confluence.localhost/rest/api/content'
+PAGE_URL = 'http://confluence.localhost/pages/viewpage.action?pageId=100'
+PNG = ('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5E'
+       'rkJggg==')
+
+
+@pytest.fixture
+def nb():
+    return v4.new_notebook(cells=[
+        v4.new_markdown_cell('# Weekly report'),
+        v4.new_code_cell('setup()'),
+        v4.new_markdown_cell('## Data\nWhere it comes from'),
+        v4.new_code_cell('plot()', outputs=[
+            v4.new_output('display_data', data={'image/png': PNG})]),
+        v4.new_markdown_cell('Some *notes* with a # in them'),
+        v4.new_markdown_cell('\n## Model ##'),
+        v4.new_code_cell('fit()', outputs=[
+            v4.new_output('stream', name='stdout', text='loss=0.1\n')]),
+        v4.new_markdown_cell('### Tuning'),
+        v4.new_markdown_cell('## Model'),
+        v4.new_code_cell('evaluate()'),
+    ])
+
+
+def test_split_notebook(nb):
+    """Should split at the highest heading level that occurs more than once."""
+    preamble, parts = split.split_notebook(nb)
+    assert [cell.source for cell in preamble] == ['# Weekly report', 'setup()']
+    assert [part.title for part in parts] == ['Data', 'Model', 'Model']
+    assert [len(part.cells) for part in parts] == [3, 3, 2]
+
+
+def test_split_notebook_without_sections():
+    """Should not split notebooks without repeated headings."""
+    nb = v4.new_notebook(cells=[v4.new_markdown_cell('# Title'), v4.new_code_cell('x = 1')])
+    preamble, parts = split.split_notebook(nb)
+    assert len(preamble) == 2
+    assert parts == []
+
+
+def test_part_titles(nb):
+    """Should prefix titles with the page title and number repeated headings."""
+    _, parts = split.split_notebook(nb)
+    assert split.part_titles('Report', parts) == ['Report - Data', 'Report - Model',
+                                                  'Report - Model (2)']
+
+
+def test_publish_split(nb, tmpdir):
+    """Should publish the sections of an oversized notebook as child pages linked from the page."""
+    path = tmpdir.join('report.ipynb')
+    nbformat.write(nb, str(path))
+    created = []
+
+    def create_page(request):
+        body = json.loads(request.body)
+        created.append((body['title'], body['ancestors'][0]['id']))
+        return 200, {}, json.dumps({'id': str(400 + len(created))})
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as server:
+        server.add('GET', API_URL + '/search',
+                   json={'results': [{'id': '300', 'title': 'Report - Data',
+                                      'ancestors': [{'id': '100'}]}]})
+        server.add('GET', re.compile(API_URL + r'/\d+/child/attachment'),
+                   json={'results': []})
+        server.add('GET', re.compile(API_URL + r'/\d+(\?.*)?$'),
+                   json={'title': 'Report', 'version': {'number': 1}, 'space': {'key': 'SPACE'}})
+        server.add_callback('POST', API_URL, callback=create_page)
+        server.add('PUT', re.compile(API_URL + r'/\d+'))
+        server.add('POST', re.compile(API_URL + r'/\d+/label'))
+        server.add('POST', re.compile(API_URL + r'/\d+/child/attachment'))
+
+        exporter = create_exporter(PAGE_URL, 'fake-username', 'fake-pass', split_threshold=100,
+                                   split_workers=2)
+        html, resources = exporter.from_filename(str(path))
+
+        puts = {call.request.url: json.loads(call.request.body)['body']['storage']['value']
+                for call in server.calls if call.request.method == 'PUT'}
+        uploads = [(call.request.url, re.search(rb'filename="([^"]+)"', call.request.body).group(1))
+                   for call in server.calls if call.request.method == 'POST' and b'filename=' in
+                   (call.request.body or b'')]
+
+    assert sorted(created) == [('Report - Model', 100), ('Report - Model (2)', 100)]
+    assert [page['title'] for page in resources['child_pages']] == \
+        ['Report - Data', 'Report - Model', 'Report - Model (2)']
+    assert resources['child_pages'][0]['page_id'] == 300
+
+    # The page keeps the cells before the first section and links to the child pages in order
+    parent = puts['http://confluence.localhost/rest/api/content/100']
+    assert parent == html
+    assert 'setup' in html and 'plot' not in html
+    assert html.index('ri:content-title="Report - Data"') < \
+        html.index('ri:content-title="Report - Model"')
+    assert 'fit' in puts['http://confluence.localhost/rest/api/content/{}'.format(
+        resources['child_pages'][1]['page_id'])]
+
+    # Outputs go to the child page that shows them and the notebook to the page
+    assert sorted(uploads) == [
+        ('http://confluence.localhost/rest/api/content/100/child/attachment', b'report.ipynb'),
+        ('http://confluence.localhost/rest/api/content/300/child/attachment', b'output_1_0.png'),
+    ]
+
+
+def test_publish_split_title_conflict(nb, tmpdir):
+    """Should not publish any part when a part has the title of a page that is not a child of the
+    page.
+    """
+    path = tmpdir.join('report.ipynb')
+    nbformat.write(nb, str(path))
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as server:
+        server.add('GET', API_URL + '/search',
+                   json={'results': [{'id': '300', 'title': 'Report - Model',
+                                      'ancestors': [{'id': '999'}]}]})
+        server.add('GET', re.compile(API_URL + r'/\d+/child/attachment'),
+                   json={'results': []})
+        server.add('GET', re.compile(API_URL + r'/\d+(\?.*)?$'),
+                   json={'title': 'Report', 'version': {'number': 1}, 'space': {'key': 'SPACE'}})
+
+        exporter = create_exporter(PAGE_URL, 'fake-username', 'fake-pass', split_threshold=100)
+        with pytest.raises(PageTitleConflict):
+            exporter.from_filename(str(path))
+        methods = {call.request.method for call in server.calls}
+
+    assert methods == {'GET'}
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Heavy modules that only publishing needs
+HEAVY_MODULES = ('nbconvert', 'bleach', 'html5lib', 'pygments', 'mistune', 'requests')
+
+# Cumulative import time budget for the command line interface, in milliseconds
+STARTUP_BUDGET_MS = int(os.getenv('NBCONFLUX_STARTUP_BUDGET_MS', '250'))
+
+
+def run_python(code):
+    return subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          check=True)
+
+
+def import_times(stderr):
+    """Parses -X importtime output into a map of module name to cumulative microseconds."""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize('code', [
+    'import nbconflux.cli',
+    'from nbconflux import cli\ntry:\n    cli.main(["--help"])\nexcept SystemExit:\n    pass',
+    'from nbconflux import cli\ntry:\n    cli.main(["--bad-arg"])\nexcept SystemExit:\n    pass',
+])
+def test_cli_skips_heavy_imports(code):
+    """Importing the package and parsing arguments should not load the exporter stack."""
+    times = import_times(run_python(code).stderr)
+    assert 'nbconflux.cli' in times
+    loaded = [name for name in times if name.split('.')[0] in HEAVY_MODULES]
+    assert not loaded
+
+
+def test_cli_startup_budget():
+    """Importing the command line interface should stay within the startup budget."""
+    times = import_times(run_python('import nbconflux.cli').stderr)
+    assert times['nbconflux.cli'] / 1000 < STARTUP_BUDGET_MS
@@ -0,0 +1,187 @@
+import json
+import os
+import socket
+import threading
+import urllib.parse as urlparse
+
+import pytest
+import requests
+
+from nbconflux.api import create_exporter
+from nbconflux.transport import HttpxTransport
+
+h2 = pytest.importorskip('h2')
+pytest.importorskip('httpx')
+
+import h2.config  # noqa: E402
+import h2.connection  # noqa: E402
+import h2.events  # noqa: E402
+
+
+class H2StandIn:
+    """Minimal cleartext HTTP/2 server that answers every request with a
+    handler and records the requests and connections it sees.
+    """
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+        self.connections = 0
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.url = 'http://127.0.0.1:{}'.format(self.sock.getsockname()[1])
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self.serve, args=(client,), daemon=True).start()
+
+    def serve(self, client):
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        client.sendall(conn.data_to_send())
+        streams = {}
+        with client:
+            while True:
+                data = client.recv(65535)
+                if not data:
+                    return
+                for event in conn.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        headers = dict((k.decode(), v.decode()) for k, v in event.headers)
+                        streams[event.stream_id] = (headers, [])
+                    elif isinstance(event, h2.events.DataReceived):
+                        streams[event.stream_id][1].append(event.data)
+                        conn.acknowledge_received_data(event.flow_controlled_length,
+                                                       event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded):
+                        headers, body = streams.pop(event.stream_id)
+                        self.requests.append(headers)
+                        status, response_headers, content = self.handler(headers, b''.join(body))
+                        conn.send_headers(event.stream_id,
+                                          [(':status', str(status)),
+                                           ('content-length', str(len(content)))] +
+                                          list(response_headers.items()))
+                        conn.send_data(event.stream_id, content, end_stream=True)
+                client.sendall(conn.data_to_send())
+
+    def close(self):
+        self.sock.close()
+
+
+def confluence(headers, body):
+    """Answers the Confluence API requests of a publish to page 12345."""
+    path = urlparse.urlparse(headers[':path']).path
+    method = headers[':method']
+    if method == 'GET' and path.endswith('/child/attachment'):
+        return 200, {}, json.dumps({'results': []}).encode()
+    if method == 'GET' and path == '/rest/api/content/12345':
+        return 200, {}, json.dumps({'title': 'fake-title', 'version': {'number': 100}}).encode()
+    return 200, {}, b'{}'
+
+
+@pytest.fixture
+def server():
+    server = H2StandIn(confluence)
+    yield server
+    server.close()
+
+
+def test_select_transport():
+    """Should create the transport the exporter asks for."""
+    exporter = create_exporter('', 'fake-username', 'fake-pass', transport='httpx')
+    assert isinstance(exporter.session, HttpxTransport)
+    exporter = create_exporter('', 'fake-username', 'fake-pass')
+    assert isinstance(exporter.session, requests.Session)
+
+
+def test_publish_over_http2(request, server):
+    """Should publish a notebook over a single HTTP/2 connection with the exporter credentials."""
+    notebook_path = os.path.join(os.path.dirname(request.module.__file__), 'notebooks',
+                                 'nbconflux-test.ipynb')
+    exporter = create_exporter('', 'fake-username', 'fake-pass', transport='httpx')
+    exporter.session = HttpxTransport(http1=False)
+    html, resources = exporter.from_filename(notebook_path,
+                                             url=server.url + '/pages/viewpage.action?pageId=12345')
+
+    assert server.connections == 1
+    assert [(headers[':method'], urlparse.urlparse(headers[':path']).path)
+            for headers in server.requests] == [
+        ('GET', '/rest/api/content/12345/child/attachment'),
+        ('GET', '/rest/api/content/12345'),
+        ('PUT', '/rest/api/content/12345'),
+        ('POST', '/rest/api/content/12345/label'),
+        ('POST', '/rest/api/content/12345/child/attachment'),
+    ]
+    assert all(headers['authorization'].startswith('Basic ') for headers in server.requests)
+    assert 'multipart/form-data' in server.requests[-1]['content-type']
+
+    metrics = resources['metrics']
+    assert metrics.total_requests == 5
+    assert metrics.bytes_out[('PUT', '/rest/api/content/{id}')] > len(html)
+
+
+def test_retry_over_http2(monkeypatch):
+    """Should retry throttled requests and raise requests errors for failed ones."""
+    statuses = [429, 200, 404]
+    server = H2StandIn(lambda headers, body: (statuses.pop(0), {'retry-after': '0'}, b'{}'))
+    try:
+        exporter = create_exporter('', 'fake-username', 'fake-pass', transport='httpx')
+        exporter.session = HttpxTransport(http1=False)
+        exporter.server = server.url
+        resp = exporter.request('GET', server.url + '/rest/api/content/1')
+        assert resp.status_code == 200
+        assert resp.http_version == 'HTTP/2'
+        assert exporter.metrics.retries == {('GET', '/rest/api/content/{id}'): 1}
+
+        with pytest.raises(requests.HTTPError):
+            exporter.request('GET', server.url + '/rest/api/content/1').raise_for_status()
+    finally:
+        server.close()
+
+
+def test_streamed_body_over_http2():
+    """Should send iterable bodies as httpx content and count their bytes."""
+    from nbconflux.payload import TEXT, JSONTextStream
+
+    received = []
+
+    def echo(headers, body):
+        received.append(json.loads(body))
+        return 200, {}, b'{}'
+
+    server = H2StandIn(echo)
+    try:
+        exporter = create_exporter('', 'fake-username', 'fake-pass', transport='httpx')
+        exporter.session = HttpxTransport(http1=False)
+        stream = JSONTextStream({'value': TEXT}, 'x' * 100, chunk_chars=7)
+        resp = exporter.request('PUT', server.url + '/rest/api/content/1', data=stream,
+                                headers={'Content-Type': 'application/json'})
+        assert resp.status_code == 200
+        assert received == [{'value': 'x' * 100}]
+        assert exporter.metrics.bytes_out[('PUT', '/rest/api/content/{id}')] == stream.size
+    finally:
+        server.close()
+
+
+def test_follow_redirects():
+    """Should follow redirects like requests does."""
+    def moved(headers, body):
+        path = urlparse.urlparse(headers[':path']).path
+        if path.startswith('/old'):
+            return 301, {'location': path[len('/old'):]}, b''
+        return 200, {}, json.dumps({'path': path}).encode()
+
+    server = H2StandIn(moved)
+    try:
+        transport = HttpxTransport(http1=False)
+        resp = transport.request('GET', server.url + '/old/rest/api/content/1')
+        assert resp.status_code == 200
+        assert resp.json() == {'path': '/rest/api/content/1'}
+    finally:
+        server.close()
@@ -0,0 +1,130 @@
+import itertools
+import json
+import os
+import re
+import shutil
+import urllib.parse as urlparse
+
+import pytest
+import responses
+
+from nbconflux import tree
+from nbconflux.api import publish_tree
+from nbconflux.pages import PageTitleConflict, cql_string
+
+API_URL = 'http://confluence.localhost/rest/api/content'
+PAGE_URL = 'http://confluence.localhost/pages/viewpage.action?pageId=100'
+
+
+@pytest.fixture
+def notebook_dir(request, tmpdir):
+    notebook_path = os.path.join(os.path.dirname(request.module.__file__), 'notebooks',
+                                 'nbconflux-test.ipynb')
+    for path in ('intro.ipynb', 'guides/setup.ipynb', 'guides/advanced/tuning.ipynb',
+                 '.ipynb_checkpoints/intro-checkpoint.ipynb'):
+        target = tmpdir.join(*path.split('/'))
+        target.dirpath().ensure(dir=True)
+        shutil.copy(notebook_path, str(target))
+    tmpdir.mkdir('empty').join('notes.txt').write('not a notebook')
+    return tmpdir
+
+
+def test_plan_tree(notebook_dir):
+    """Should map directories with notebooks and notebooks to pages, parents first."""
+    pages = tree.plan_tree(str(notebook_dir))
+    assert [(page.key, page.title, page.parent, page.depth) for page in pages] == [
+        ('intro.ipynb', 'intro', None, 0),
+        ('guides', 'guides', None, 0),
+        (os.path.join('guides', 'setup.ipynb'), 'setup', 'guides', 1),
+        (os.path.join('guides', 'advanced'), 'advanced', 'guides', 1),
+        (os.path.join('guides', 'advanced', 'tuning.ipynb'), 'tuning',
+         os.path.join('guides', 'advanced'), 2),
+    ]
+    assert pages[0].path == str(notebook_dir.join('intro.ipynb'))
+    assert pages[1].path is None
+
+
+def test_plan_tree_duplicate_titles(notebook_dir):
+    """Should refuse trees that would publish two pages with the same title."""
+    notebook_dir.join('guides', 'intro.ipynb').write('{}')
+    with pytest.raises(ValueError):
+        tree.plan_tree(str(notebook_dir))
+
+
+def test_cql_string():
+    """Should escape quotes and backslashes in CQL strings."""
+    assert cql_string('a "b" \\c') == '"a \\"b\\" \\\\c"'
+
+
+def test_publish_tree(notebook_dir):
+    """Should look up titles in bulk, create missing pages under their parents, and publish
+    notebooks.
+    """
+    created = []
+    page_ids = itertools.count(300)
+
+    def create_page(request):
+        body = json.loads(request.body)
+        page_id = next(page_ids)
+        created.append((body['title'], body['ancestors'][0]['id'], body['space']['key']))
+        return 200, {}, json.dumps({'id': str(page_id)})
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as server:
+        server.add('GET', API_URL + '/search',
+                   json={'results': [{'id': '200', 'title': 'guides',
+                                      'ancestors': [{'id': '1'}, {'id': '100'}]}]})
+        server.add('GET', re.compile(API_URL + r'/\d+/child/attachment'),
+                   json={'results': []})
+        server.add('GET', re.compile(API_URL + r'/\d+(\?.*)?$'),
+                   json={'title': 'fake-title', 'version': {'number': 1},
+                         'space': {'key': 'SPACE'}})
+        server.add_callback('POST', API_URL, callback=create_page)
+        server.add('PUT', re.compile(API_URL + r'/\d+'))
+        server.add('POST', re.compile(API_URL + r'/\d+/label'))
+        server.add('POST', re.compile(API_URL + r'/\d+/child/attachment'))
+
+        results = publish_tree(str(notebook_dir), PAGE_URL, 'fake-username', 'fake-pass',
+                               max_workers=3)
+
+        searches = [call.request.url for call in server.calls
+                    if '/content/search' in call.request.url]
+        puts = {call.request.url for call in server.calls if call.request.method == 'PUT'}
+
+    # One bulk lookup for all five titles
+    assert len(searches) == 1
+    query = urlparse.parse_qs(urlparse.urlparse(searches[0]).query)
+    assert query['expand'] == ['ancestors']
+    cql = query['cql'][0]
+    assert cql == ('space = "SPACE" and type = page and title in '
+                   '("intro", "guides", "setup", "advanced", "tuning")')
+
+    # Existing pages under their parents are reused and the rest are created under their parents
+    titles = [title for title, _, _ in created]
+    assert sorted(titles) == ['advanced', 'intro', 'setup', 'tuning']
+    parents = {title: parent for title, parent, _ in created}
+    assert parents['intro'] == 100
+    assert parents['setup'] == parents['advanced'] == 200
+    assert titles.index('advanced') < titles.index('tuning')
+    assert parents['tuning'] == 300 + titles.index('advanced')
+
+    assert [os.path.basename(result['notebook']) for result in results] == \
+        ['intro.ipynb', 'setup.ipynb', 'tuning.ipynb']
+    assert puts == {'http://confluence.localhost/rest/api/content/{}'.format(result['page_id'])
+                    for result in results}
+
+
+@pytest.mark.parametrize('ancestors', [[{'id': '1'}, {'id': '999'}], []])
+def test_publish_tree_title_conflict(notebook_dir, ancestors):
+    """Should refuse to reuse or create pages with the title of a page elsewhere in the space."""
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as server:
+        server.add('GET', API_URL + '/search',
+                   json={'results': [{'id': '200', 'title': 'guides', 'ancestors': ancestors}]})
+        server.add('GET', re.compile(API_URL + r'/\d+(\?.*)?$'),
+                   json={'title': 'fake-title', 'version': {'number': 1},
+                         'space': {'key': 'SPACE'}})
+
+        with pytest.raises(PageTitleConflict):
+            publish_tree(str(notebook_dir), PAGE_URL, 'fake-username', 'fake-pass')
+        methods = {call.request.method for call in server.calls}
+
+    assert methods == {'GET'}
@@ -0,0 +1,69 @@
+import threading
+import time
+
+from nbconflux import watch
+
+
+def test_wait_for_change(tmpdir):
+    """Should return once the file changes and then settles."""
+    path = tmpdir.join('notebook.ipynb')
+    path.write('{}')
+    signature = watch.file_signature(str(path))
+
+    def save():
+        time.sleep(0.05)
+        path.write('{"cells": []}')
+        time.sleep(0.02)
+        path.write('{"cells": [], "metadata": {}}')
+
+    thread = threading.Thread(target=save)
+    thread.start()
+    settled = watch.wait_for_change(str(path), signature, interval=0.01, debounce=0.2)
+    thread.join()
+    assert settled == watch.file_signature(str(path))
+    assert settled != signature
+
+
+def test_wait_for_reappearing_file(tmpdir):
+    """Should keep waiting while a saved file is missing and return once it is back."""
+    path = tmpdir.join('notebook.ipynb')
+    path.write('{}')
+    signature = watch.file_signature(str(path))
+
+    def save():
+        time.sleep(0.05)
+        path.write('{"cells": []}')
+        time.sleep(0.02)
+        path.remove()
+        time.sleep(0.3)
+        tmpdir.join('notebook.ipynb~').write('{"cells": [], "metadata": {}}')
+        tmpdir.join('notebook.ipynb~').rename(path)
+
+    thread = threading.Thread(target=save)
+    thread.start()
+    settled = watch.wait_for_change(str(path), signature, interval=0.01, debounce=0.1)
+    thread.join()
+    assert settled is not None
+    assert settled == watch.file_signature(str(path))
+
+
+def test_watch_survives_publish_errors(tmpdir, monkeypatch):
+    """Should keep republishing after a failed publish until interrupted."""
+    path = tmpdir.join('notebook.ipynb')
+    path.write('{}')
+    publishes = []
+    waits = []
+
+    def publish():
+        publishes.append(True)
+        if len(publishes) == 1:
+            raise ValueError('Notebook does not appear to be JSON')
+
+    def wait_for_change(*args):
+        waits.append(args)
+        if len(waits) == 2:
+            raise KeyboardInterrupt()
+
+    monkeypatch.setattr(watch, 'wait_for_change', wait_for_change)
+    watch.watch(str(path), publish)
+    assert len(publishes) == 2